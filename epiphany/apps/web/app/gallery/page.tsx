@@ -129,8 +129,8 @@ export default function GalleryPage() {
 						<a href={it.outputUrl ?? '#'} target="_blank" rel="noreferrer" style={{textDecoration:'none', color:'#e6e6ea'}}>
 							{it.kind === 'image' && it.outputUrl && (
 								<div style={{position:'relative'}}>
-									<img src={it.outputUrl} alt={it.id} style={{width:'100%', height:220, objectFit:'cover', filter: (it.safety && typeof (it.safety as any).nsfw === 'number' && (it.safety as any).nsfw > 0 && !showNsfw) ? 'blur(10px)' : 'none'}} />
-									{(it.safety && typeof (it.safety as any).nsfw === 'number' && (it.safety as any).nsfw > 0) && (
+									<img src={it.outputUrl} alt={it.id} style={{width:'100%', height:220, objectFit:'cover', filter: (it.safety && typeof (it.safety as any).nsfw === 'number' && (it.safety as any).nsfw >= 0.5 && !showNsfw) ? 'blur(10px)' : 'none'}} />
+									{(it.safety && typeof (it.safety as any).nsfw === 'number' && (it.safety as any).nsfw >= 0.5) && (
 										<div style={{position:'absolute', inset:0, display:'grid', placeItems:'center', color:'#e6e6ea', fontWeight:600}}>NSFW blurred</div>
 									)}
 								</div>
@@ -145,7 +145,7 @@ export default function GalleryPage() {
 							<div>{it.kind} • {it.status} {it.createdAt && (<span style={{marginLeft:8, color:'#7c7c86'}}>{new Date(it.createdAt).toLocaleString()}</span>)}</div>
 							<div style={{display:'flex', gap:6, alignItems:'center'}}>
 								{it.safety && <span style={{border:'1px solid #26262a', padding:'2px 6px', borderRadius:8}}>{safetyLabel(it.safety)}</span>}
-								{it.safety && typeof (it.safety as any).nsfw === 'number' && (it.safety as any).nsfw > 0 && (
+								{it.safety && typeof (it.safety as any).nsfw === 'number' && (it.safety as any).nsfw >= 0.5 && (
 									<button onClick={(e)=>{ e.preventDefault(); const container = (e.currentTarget.closest('div')?.parentElement?.previousElementSibling as HTMLElement); const img = container?.querySelector('img') as HTMLImageElement | null; if (img) img.style.filter = img.style.filter ? '' : 'blur(10px)'; }} style={{background:'#0b0b0d', color:'#ddd', border:'1px solid #26262a', padding:'2px 6px', borderRadius:8}}>Toggle Blur</button>
 								)}
 								<a href={recreateHref(it)} style={{color:'#cfd0ff'}}>Recreate</a>
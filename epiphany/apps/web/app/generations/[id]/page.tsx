@@ -88,7 +88,7 @@ export default function GenerationDetail({ params }: { params: { id: string } })
 				<div style={{border:'1px solid #26262a', borderRadius:8, padding:8, background:'#101012'}}>
 					{gen.kind === 'image' && gen.outputUrl && (
 						<div style={{position:'relative'}}>
-							<img src={gen.outputUrl} alt={gen.id} style={{width:'100%', height:'auto', filter: (blur || (!!gen.safety && (gen.safety as any).nsfw > 0 && !showNsfw)) ? 'blur(10px)' : 'none'}} />
+							<img src={gen.outputUrl} alt={gen.id} style={{width:'100%', height:'auto', filter: (blur || (!!gen.safety && (gen.safety as any).nsfw >= 0.5 && !showNsfw)) ? 'blur(10px)' : 'none'}} />
 							{showExplain && explain?.heatmapUrls && explain.heatmapUrls[0] && (
 								<img src={explain.heatmapUrls[0]} alt="heatmap" style={{position:'absolute', inset:8, width:'calc(100% - 16px)', height:'auto', mixBlendMode:'screen', opacity: Math.max(0, Math.min(100, overlayOpacity))/100, pointerEvents:'none'}} />
 							)}
@@ -61,6 +61,12 @@ export async function healthSummary(env: any) {
 		timed(() => checkHttp('http://localhost:8003/health')),
 		timed(() => checkHttp('http://localhost:8004/health')),
 	])
+	// Warm-start state of the model services (their /ready is 503 until startup warmup finishes)
+	const [imgReady, vidReady, editReady] = await Promise.all([
+		checkHttp('http://localhost:8001/ready'),
+		checkHttp('http://localhost:8002/ready'),
+		checkHttp('http://localhost:8003/ready'),
+	])
 	return {
 		ok: db.ok && redis.ok && s3.ok && img.ok && vid.ok && edit.ok && explain.ok,
 		services: {
@@ -71,6 +77,7 @@ export async function healthSummary(env: any) {
 			infer_video: vid.ok, infer_video_ms: vid.ms,
 			edit: edit.ok, edit_ms: edit.ms,
 			explain: explain.ok, explain_ms: explain.ms,
-		}
+		},
+		ready: { infer_image: imgReady, infer_video: vidReady, edit: editReady },
 	}
 }
@@ -36,3 +36,39 @@ export async function getJson<T>(url: string, opts?: { headers?: Record<string,s
 		clearTimeout(id)
 	}
 }
+
+// POSTs JSON and calls onLine for every NDJSON line of the response as it arrives
+export async function postNdjson(url: string, body: any, onLine: (item: any) => Promise<void> | void, opts?: { headers?: Record<string,string>, timeoutMs?: number }) : Promise<number> {
+	const controller = new AbortController()
+	const id = setTimeout(() => controller.abort(), opts?.timeoutMs ?? 600000)
+	try {
+		const res = await fetch(url, {
+			method: 'POST',
+			headers: { 'Content-Type': 'application/json', ...(opts?.headers || {}) },
+			body: JSON.stringify(body),
+			signal: controller.signal,
+		})
+		if (!res.ok || !res.body) {
+			const txt = await res.text().catch(() => '')
+			throw new Error(`HTTP ${res.status} ${res.statusText} ${txt}`)
+		}
+		const reader = res.body.getReader()
+		const decoder = new TextDecoder()
+		let buffered = ''
+		let count = 0
+		for (;;) {
+			const { done, value } = await reader.read()
+			buffered += done ? decoder.decode() : decoder.decode(value, { stream: true })
+			const lines = buffered.split('\n')
+			buffered = done ? '' : (lines.pop() ?? '')
+			for (const line of lines) {
+				if (!line.trim()) continue
+				await onLine(JSON.parse(line))
+				count++
+			}
+			if (done) return count
+		}
+	} finally {
+		clearTimeout(id)
+	}
+}
@@ -1,8 +1,9 @@
 import { Router } from 'express'
 import { z } from 'zod'
-import { queues } from './queues'
+import { queues, connection } from './queues'
 import { Job } from 'bullmq'
 import { prisma } from './db'
+import { postJson } from './http'
 import { getEnv } from './env'
 import { getSignedUrl } from './s3'
 import { getSignedPutUrl, publicUrlFor } from './s3'
@@ -106,6 +107,8 @@ const genVideoSchema = z.object({
 	seed: z.number().int().min(0).max(2_147_483_647).nullable().optional(),
 	modelId: z.enum(["svd","modelscope-t2v"]).optional(),
 	sourceImageUrl: z.string().url().optional(),
+	motion: z.enum(["zoom-in","zoom-out","pan","ken-burns"]).optional(),
+	easing: z.enum(["linear","ease-in","ease-out","ease-in-out"]).optional(),
 	stylize: z.boolean().optional(),
 })
 
@@ -172,6 +175,20 @@ r.post('/edit/resize', async (req, res) => {
 	res.json({ id: job.id })
 })
 
+const editStepSchema = z.discriminatedUnion('op', [
+	z.object({ op: z.literal('crop'), x: z.number(), y: z.number(), w: z.number(), h: z.number() }),
+	z.object({ op: z.literal('resize'), width: z.number().int().min(1), height: z.number().int().min(1) }),
+	z.object({ op: z.literal('upscale'), scale: z.union([z.literal(2), z.literal(4)]) }),
+	z.object({ op: z.literal('restore-face') }),
+	z.object({ op: z.literal('remove-bg'), method: z.enum(['auto','rembg','threshold','color']).optional(), threshold: z.number().int().min(0).max(255).optional(), tolerance: z.number().min(0).optional(), softness: z.number().min(0).optional(), feather: z.number().int().min(0).max(16).optional() }),
+])
+
+r.post('/edit/pipeline', async (req, res) => {
+	const body = z.object({ imageUrl: z.string().url(), steps: z.array(editStepSchema).min(1).max(16), intermediates: z.union([z.boolean(), z.array(z.number().int().min(0))]).optional() }).parse(req.body)
+	const job = await queues.edit_image.add('pipeline', { ...body, requestId: (req as any).id }, { removeOnComplete: true, removeOnFail: true })
+	res.json({ id: job.id })
+})
+
 r.post('/edit/caption', async (req, res) => {
 	const body = z.object({ imageUrl: z.string().url() }).parse(req.body)
 	const job = await queues.edit_image.add('caption', { ...body, requestId: (req as any).id }, { removeOnComplete: true, removeOnFail: true })
@@ -215,6 +232,7 @@ r.get('/jobs/:id/stream', async (req, res) => {
 		res.write(`data: ${JSON.stringify(event)}\n\n`)
 	}
 	let closed = false
+	let lastStep: number | undefined
 	req.on('close', () => { closed = true })
 	const interval = setInterval(async () => {
 		if (closed) { clearInterval(interval); return }
@@ -222,8 +240,17 @@ r.get('/jobs/:id/stream', async (req, res) => {
 		const job = (await statusOf('generate_image')) || (await statusOf('generate_video')) || (await statusOf('edit_image')) || (await statusOf('explain'))
 		if (!job) { send({ id, status: 'not_found' }); clearInterval(interval); res.end(); return }
 		const state = await job.getState()
-		const progress = (job.progress as any) || 0
-		send({ id, state, progress })
+		let progress = (job.progress as any) || 0
+		// Denoising step progress and latent previews published by infer-image (progress:{jobId})
+		const stepRaw = state === 'active' ? await connection.get(`progress:${id}`).catch(() => null) : null
+		const step = stepRaw ? JSON.parse(stepRaw) : null
+		if (step && typeof step.progress === 'number') progress = Math.max(Number(progress) || 0, Math.round(10 + 80 * step.progress))
+		if (step && step.step !== lastStep) {
+			lastStep = step.step
+			send({ id, state, progress, step: step.step, steps: step.steps, preview: step.preview, redacted: step.redacted })
+		} else {
+			send({ id, state, progress })
+		}
 		if (state === 'completed' || state === 'failed') {
 			const result = (await job.getReturnValue().catch(() => null)) as any
 			send({ id, done: true, state, result })
@@ -233,6 +260,13 @@ r.get('/jobs/:id/stream', async (req, res) => {
 	}, 700)
 })
 
+// Cooperative cancel for jobs already running on an inference service: a Redis flag every
+// replica polls between denoising steps/frames, plus a best-effort direct call to the local one
+async function signalCancel(jobId: string) {
+	await connection.set(`cancel:${jobId}`, '1', 'EX', 3600).catch(() => null)
+	await Promise.all(['http://localhost:8001', 'http://localhost:8002'].map((base) => postJson(`${base}/cancel/${encodeURIComponent(jobId)}`, {}, { timeoutMs: 2000 }).catch(() => null)))
+}
+
 r.post('/jobs/:id/cancel', async (req, res) => {
 	const id = String(req.params.id)
 	const found: Job[] = []
@@ -242,6 +276,7 @@ r.post('/jobs/:id/cancel', async (req, res) => {
 	}
 	if (found.length === 0) return res.status(404).json({ error: 'not_found' })
 	await Promise.all(found.map(async j => {
+		if (await j.isActive().catch(() => false)) await signalCancel(String(j.id))
 		try { await j.remove() } catch {}
 		const genId = (j.data && j.data.generationId) ? String(j.data.generationId) : null
 		if (genId) {
@@ -329,6 +364,26 @@ r.post('/explain/:id/refresh', async (req, res) => {
 	res.json({ id: job.id, generationId })
 })
 
+// Queues explanations for many generations as batch jobs: the given ids, or the most recent
+// succeeded image generations that have none yet
+r.post('/explain/backfill', async (req, res) => {
+	const body = z.object({ generationIds: z.array(z.string().min(1)).max(5000).optional(), limit: z.number().int().min(1).max(5000).optional(), batchSize: z.number().int().min(1).max(500).optional() }).parse(req.body || {})
+	const where: any = body.generationIds ? { id: { in: body.generationIds } } : { kind: 'image', status: 'succeeded' }
+	let gens = await prisma.generation.findMany({ where, orderBy: { createdAt: 'desc' }, take: body.generationIds ? undefined : (body.limit ?? 500), select: { id: true, inputPrompt: true } })
+	// Explicit ids are filtered too, so a re-run only queues what is still missing
+	const have = await prisma.explain.findMany({ where: { generationId: { in: gens.map((g) => g.id) } }, select: { generationId: true } })
+	const seen = new Set(have.map((e) => e.generationId))
+	gens = gens.filter((g) => !seen.has(g.id))
+	const size = body.batchSize ?? 100
+	const jobs: string[] = []
+	for (let i = 0; i < gens.length; i += size) {
+		const items = gens.slice(i, i + size).map((g) => ({ generationId: g.id, prompt: g.inputPrompt }))
+		const job = await queues.explain.add('explain-batch', { items }, { removeOnComplete: true, removeOnFail: true })
+		jobs.push(String(job.id))
+	}
+	res.json({ jobs, generations: gens.length })
+})
+
 r.get('/events', async (req, res) => {
 	const generationId = req.query.generationId ? String(req.query.generationId) : undefined
 	const type = req.query.type ? String(req.query.type) : undefined
@@ -510,6 +565,7 @@ r.post('/jobs/by-generation/:id/cancel', async (req, res) => {
 		const jobs = await (q as any).getJobs(['waiting','delayed','active'])
 		for (const j of jobs) {
 			if (j?.data?.generationId === generationId) {
+				if (await j.isActive().catch(() => false)) { await signalCancel(String(j.id)); cancelled = true }
 				try { await j.remove(); cancelled = true } catch {}
 			}
 		}
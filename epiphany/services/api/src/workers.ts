@@ -1,6 +1,6 @@
 import { Worker, Job, Queue } from 'bullmq'
 import IORedis from 'ioredis'
-import { postJson, getJson } from './http'
+import { postJson, getJson, postNdjson } from './http'
 import { prisma } from './db'
 
 const connection = new IORedis(process.env.REDIS_URL || 'redis://localhost:6379')
@@ -13,22 +13,32 @@ function selectImageEndpoint(data: any): string {
 	return 'http://localhost:8001/infer/txt2img'
 }
 
+// The inference service stopped between steps/frames because the job was canceled
+async function markCanceled(job: Job, resp: any) {
+	await prisma.generation.update({ where: { id: job.data.generationId }, data: { status: 'canceled' } }).catch(() => null)
+	await prisma.event.create({ data: { generationId: job.data.generationId, type: 'canceled', payload: { jobId: job.id, stage: 'inference', requestId: (job.data as any)?.requestId } as any } }).catch(() => null)
+	return resp
+}
+
 async function processGenerateImage(job: Job) {
 	const t0 = Date.now()
 	try {
 		await prisma.generation.update({ where: { id: job.data.generationId }, data: { status: 'running' } })
 		await job.updateProgress(10)
 		const url = selectImageEndpoint(job.data)
-		const resp = await postJson<any>(url, job.data)
+		// jobId lets infer-image publish step progress/previews for /jobs/:id/stream
+		const resp = await postJson<any>(url, { ...job.data, jobId: job.id })
+		if (resp?.status === 'canceled') return markCanceled(job, resp)
 		await job.updateProgress(90)
 		const durationMs = resp.duration_ms || (Date.now() - t0)
 		await prisma.generation.update({ where: { id: job.data.generationId }, data: {
 			status: 'succeeded', outputUrl: resp.output_url || null, previewUrls: resp.preview_urls || [], durationMs, modelHash: resp.model_hash || null, safety: resp.safety_scores || null,
 		} })
-		await prisma.event.create({ data: { generationId: job.data.generationId, type: 'succeeded', payload: { jobId: job.id, durationMs, requestId: (job.data as any)?.requestId } as any } })
+		// degraded: infer-image served a placeholder (see echo.memory for the planner's decision)
+		await prisma.event.create({ data: { generationId: job.data.generationId, type: 'succeeded', payload: { jobId: job.id, durationMs, requestId: (job.data as any)?.requestId, ...(resp.degraded ? { degraded: true, memory: resp.echo?.memory || null } : {}) } as any } })
 		if (resp.output_url) {
 			const meta = (resp as any).image_meta || {}
-			await prisma.asset.create({ data: { url: resp.output_url, kind: 'image', mime: 'image/png', width: meta.width || null as any, height: meta.height || null as any, bytes: meta.bytes || null as any, sha256: meta.sha256 || null as any } })
+			await prisma.asset.create({ data: { url: resp.output_url, kind: 'image', mime: meta.mime || 'image/png', width: meta.width || null as any, height: meta.height || null as any, bytes: meta.bytes || null as any, sha256: meta.sha256 || null as any } })
 		}
 		if (Array.isArray(resp.preview_urls)) {
 			const metaMap: Record<string, any> = {}
@@ -39,7 +49,7 @@ async function processGenerateImage(job: Job) {
 			}
 			for (const p of resp.preview_urls) {
 				const m = metaMap[p] || {}
-				await prisma.asset.create({ data: { url: p, kind: 'image', mime: 'image/png', width: m.width || null as any, height: m.height || null as any, bytes: m.bytes || null as any, sha256: m.sha256 || null as any } })
+				await prisma.asset.create({ data: { url: p, kind: 'image', mime: m.mime || 'image/png', width: m.width || null as any, height: m.height || null as any, bytes: m.bytes || null as any, sha256: m.sha256 || null as any } })
 			}
 		}
 		const ex = await explainQueue.add('explain', { generationId: job.data.generationId, prompt: job.data?.prompt }, { removeOnComplete: true, removeOnFail: true })
@@ -58,7 +68,8 @@ async function processGenerateVideo(job: Job) {
 		await prisma.generation.update({ where: { id: job.data.generationId }, data: { status: 'running' } })
 		await job.updateProgress(10)
 		const endpoint = job.data?.stylize ? 'http://localhost:8002/infer/stylize' : (job.data?.sourceImageUrl ? 'http://localhost:8002/infer/animate' : 'http://localhost:8002/infer/t2v')
-		const resp = await postJson<any>(endpoint, job.data)
+		const resp = await postJson<any>(endpoint, { ...job.data, jobId: job.id })
+		if (resp?.status === 'canceled') return markCanceled(job, resp)
 		await job.updateProgress(90)
 		const durationMs = resp.duration_ms || (Date.now() - t0)
 		await prisma.generation.update({ where: { id: job.data.generationId }, data: { status: 'succeeded', outputUrl: resp.output_url || null, durationMs, modelHash: resp.model_hash || null, safety: (resp as any).safety_scores || null } })
@@ -87,6 +98,7 @@ async function processEdit(job: Job) {
 			'crop': 'http://localhost:8003/crop',
 			'resize': 'http://localhost:8003/resize',
 			'caption': 'http://localhost:8003/caption',
+			'pipeline': 'http://localhost:8003/pipeline',
 		}
 		const url = map[task] || 'http://localhost:8003/upscale'
 		const resp = await postJson<any>(url, job.data)
@@ -101,7 +113,33 @@ async function processEdit(job: Job) {
 	}
 }
 
+// Backfill: many generations per job through the explain service's batch endpoint, streamed
+// so each explanation row is written as soon as its result line arrives. Generations that
+// already have a row (an earlier or concurrent backfill, a retried job) are skipped.
+async function processExplainBatch(job: Job) {
+	const wanted = job.data.items as Array<{ generationId: string, prompt?: string }>
+	const have = await prisma.explain.findMany({ where: { generationId: { in: wanted.map((it) => it.generationId) } }, select: { generationId: true } })
+	const seen = new Set(have.map((e) => e.generationId))
+	const items = wanted.filter((it) => !seen.has(it.generationId)).map((it) => ({ id: it.generationId, prompt: it.prompt || '' }))
+	const ids: string[] = []
+	let done = 0
+	let skipped = wanted.length - items.length
+	if (!items.length) return { explain_ids: ids, count: done, skipped }
+	await postNdjson('http://localhost:8004/explain/batch', { items, stream: true }, async (res: any) => {
+		const existing = await prisma.explain.findFirst({ where: { generationId: res.id }, select: { id: true } })
+		if (existing) skipped++
+		else {
+			const explain = await prisma.explain.create({ data: { generationId: res.id, tokenScores: res.token_scores || [], heatmapUrls: res.heatmap_urls || [] } as any })
+			ids.push(explain.id)
+		}
+		done++
+		await job.updateProgress(Math.round((done / items.length) * 100))
+	})
+	return { explain_ids: ids, count: ids.length, skipped }
+}
+
 async function processExplain(job: Job) {
+	if (Array.isArray(job.data?.items)) return processExplainBatch(job)
 	try {
 		await job.updateProgress(10)
 		const genId = (job.data?.generationId || 'x') as string
@@ -0,0 +1,130 @@
+import contextvars
+import functools
+import os
+import threading
+import time
+from typing import Callable, Iterable, Iterator, TypeVar
+
+_redis_available = False
+try:
+	import redis  # type: ignore
+	_redis_available = True
+except Exception:
+	_redis_available = False
+
+T = TypeVar('T')
+
+# Job ids checked while serving the current request, so handler() can drop their state after
+_request_jobs: contextvars.ContextVar[set | None] = contextvars.ContextVar('cancel_request_jobs', default=None)
+
+
+class Canceled(Exception):
+	# Raised between denoising steps or frames once a job's cancel flag is seen. Code that
+	# turns failures into placeholders must let this through.
+	def __init__(self, job_id: str):
+		super().__init__(f"job {job_id} canceled")
+		self.job_id = job_id
+
+
+class CancelRegistry:
+	# Cooperative cancellation flags by API job id. A flag is set either locally (POST
+	# /cancel/{id} on this replica) or in Redis at cancel:{id} by the API, which reaches every
+	# replica. Workers poll check() between steps/frames; Redis is read at most once per
+	# poll_s per job, so the per-step cost is a set lookup.
+	def __init__(self, redis_url: str | None = None, poll_s: float = 0.25, ttl_s: int = 3600, on_abort: Callable[[], None] | None = None):
+		self.poll_s = poll_s
+		self.on_abort = on_abort
+		self.ttl_s = ttl_s
+		self._redis = None
+		if redis_url and _redis_available:
+			try:
+				self._redis = redis.Redis.from_url(redis_url, socket_timeout=0.5)
+			except Exception:
+				self._redis = None
+		self._lock = threading.Lock()
+		self._local: dict[str, float] = {}
+		self._polled: dict[str, float] = {}
+		self.requested = 0
+		self.aborted = 0
+
+	@classmethod
+	def from_env(cls, on_abort: Callable[[], None] | None = None) -> 'CancelRegistry':
+		return cls(os.getenv('CANCEL_REDIS_URL') or os.getenv('REDIS_URL') or None, poll_s=float(os.getenv('CANCEL_POLL_MS', '250')) / 1000.0, on_abort=on_abort)
+
+	def cancel(self, job_id: str) -> None:
+		with self._lock:
+			self._local[job_id] = time.monotonic()
+			self.requested += 1
+			# Flags for jobs that never ran here are dropped after the TTL
+			cutoff = time.monotonic() - self.ttl_s
+			for k in [k for k, t in self._local.items() if t < cutoff]:
+				self._local.pop(k, None)
+
+	def is_canceled(self, job_id: str | None) -> bool:
+		if not job_id:
+			return False
+		if job_id in self._local:
+			return True
+		if self._redis is None:
+			return False
+		now = time.monotonic()
+		if now - self._polled.get(job_id, 0.0) < self.poll_s:
+			return False
+		self._polled[job_id] = now
+		try:
+			flagged = bool(self._redis.exists(f"cancel:{job_id}"))
+		except Exception:
+			return False
+		if flagged:
+			with self._lock:
+				self._local[job_id] = now
+		return flagged
+
+	def check(self, job_id: str | None) -> None:
+		jobs = _request_jobs.get()
+		if jobs is not None and job_id:
+			jobs.add(job_id)
+		if self.is_canceled(job_id):
+			with self._lock:
+				self.aborted += 1
+			raise Canceled(job_id)
+
+	def guard(self, items: Iterable[T], job_id: str | None) -> Iterator[T]:
+		# Checks the flag before producing each item of a lazy frame source
+		it = iter(items)
+		while True:
+			self.check(job_id)
+			try:
+				item = next(it)
+			except StopIteration:
+				return
+			yield item
+
+	def done(self, job_id: str | None) -> None:
+		if job_id:
+			with self._lock:
+				self._local.pop(job_id, None)
+			self._polled.pop(job_id, None)
+
+	def handler(self, fn: Callable) -> Callable:
+		# Decorator for FastAPI handlers: a Canceled raised below becomes a `canceled` response
+		# after on_abort (e.g. releasing cached device memory) has run. Every job the request
+		# checked is done() on the way out, canceled or not, so poll state does not pile up.
+		@functools.wraps(fn)
+		async def wrapper(*args, **kwargs):
+			jobs: set = set()
+			token = _request_jobs.set(jobs)
+			try:
+				return await fn(*args, **kwargs)
+			except Canceled as e:
+				if self.on_abort is not None:
+					self.on_abort()
+				return {"status": "canceled", "job_id": e.job_id}
+			finally:
+				_request_jobs.reset(token)
+				for job_id in jobs:
+					self.done(job_id)
+		return wrapper
+
+	def stats(self) -> dict:
+		return {"backend": "redis" if self._redis is not None else "local", "pending": len(self._local), "requested": self.requested, "aborted": self.aborted}
@@ -0,0 +1,128 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from fastapi import HTTPException
+
+from common import profiling
+
+
+class BoundedExecutor:
+	# Execution model for the inference services: blocking CPU/GPU work runs on a small
+	# compute pool (sized to what the device can actually overlap), blocking I/O (HTTP
+	# fetches, S3 uploads) on a wider I/O pool, and requests beyond workers + max_queue
+	# are turned away at admission instead of piling up on the event loop.
+	def __init__(self, name: str, workers: int = 1, max_queue: int = 8, io_workers: int = 8, reject_status: int = 429):
+		self.name = name
+		self.workers = max(1, int(workers))
+		self.max_queue = max(0, int(max_queue))
+		self.io_workers = max(1, int(io_workers))
+		self.reject_status = reject_status if reject_status in (429, 503) else 429
+		self.compute = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f'{name}-compute')
+		self.io_pool = ThreadPoolExecutor(max_workers=self.io_workers, thread_name_prefix=f'{name}-io')
+		self.inflight = 0
+		self.compute_pending = 0
+		self.compute_running = 0
+		self.admitted = 0
+		self.rejected = 0
+		self._lock = threading.Lock()
+
+	@classmethod
+	def from_env(cls, name: str, workers: int = 1, max_queue: int = 8, io_workers: int = 8) -> 'BoundedExecutor':
+		return cls(
+			name,
+			workers=int(os.getenv('EXEC_WORKERS') or workers),
+			max_queue=int(os.getenv('EXEC_MAX_QUEUE') or max_queue),
+			io_workers=int(os.getenv('EXEC_IO_WORKERS') or io_workers),
+			reject_status=int(os.getenv('EXEC_REJECT_STATUS') or 429),
+		)
+
+	@property
+	def capacity(self) -> int:
+		return self.workers + self.max_queue
+
+	def queue_depth(self) -> int:
+		return max(0, self.inflight - self.workers)
+
+	def try_admit(self) -> bool:
+		if self.inflight >= self.capacity:
+			self.rejected += 1
+			return False
+		self.inflight += 1
+		self.admitted += 1
+		return True
+
+	def release(self) -> None:
+		self.inflight = max(0, self.inflight - 1)
+
+	def saturated(self) -> HTTPException:
+		return HTTPException(
+			status_code=self.reject_status,
+			detail={"error": "saturated", "service": self.name, "queue_depth": self.queue_depth(), "capacity": self.capacity},
+			headers={"Retry-After": "1", "X-Queue-Depth": str(self.queue_depth())},
+		)
+
+	def hold(self) -> Callable[[], None]:
+		# Admits work that outlives its handler (a streamed response) and returns its release.
+		# The release is idempotent: call it both when the stream ends and as the response's
+		# background task, which also runs when the client goes away before the first chunk.
+		if not self.try_admit():
+			raise self.saturated()
+		released = False
+		def release():
+			nonlocal released
+			if not released:
+				released = True
+				self.release()
+		return release
+
+	def admitted_handler(self, fn: Callable) -> Callable:
+		# Decorator for FastAPI handlers; keeps the wrapped signature for request parsing
+		@functools.wraps(fn)
+		async def wrapper(*args, **kwargs):
+			if not self.try_admit():
+				raise self.saturated()
+			try:
+				return await fn(*args, **kwargs)
+			finally:
+				self.release()
+				profiling.request_done()
+		return wrapper
+
+	async def run(self, fn: Callable, *args, **kwargs) -> Any:
+		loop = asyncio.get_running_loop()
+		with self._lock:
+			self.compute_pending += 1
+		# The caller's context (e.g. the request's stage timings) follows the work onto the pool
+		ctx = contextvars.copy_context()
+		def call():
+			with self._lock:
+				self.compute_pending -= 1
+				self.compute_running += 1
+			try:
+				return ctx.run(profiling.wrap(fn), *args, **kwargs)
+			finally:
+				with self._lock:
+					self.compute_running -= 1
+		return await loop.run_in_executor(self.compute, call)
+
+	async def io(self, fn: Callable, *args, **kwargs) -> Any:
+		loop = asyncio.get_running_loop()
+		return await loop.run_in_executor(self.io_pool, functools.partial(contextvars.copy_context().run, profiling.wrap(fn), *args, **kwargs))
+
+	def stats(self) -> dict:
+		return {
+			"workers": self.workers,
+			"max_queue": self.max_queue,
+			"io_workers": self.io_workers,
+			"inflight": self.inflight,
+			"queue_depth": self.queue_depth(),
+			"compute_pending": self.compute_pending,
+			"compute_running": self.compute_running,
+			"admitted": self.admitted,
+			"rejected": self.rejected,
+		}
@@ -0,0 +1,236 @@
+import base64
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from io import BytesIO
+from typing import Any, Callable, Iterable
+from urllib.parse import unquote, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from PIL import Image
+
+from common.metrics import stage
+
+
+class _Entry:
+	__slots__ = ('etag', 'data', 'digest', 'checked_at')
+
+	def __init__(self, etag: str | None, data: bytes, digest: str):
+		self.etag = etag
+		self.data = data
+		self.digest = digest
+		self.checked_at = time.monotonic()
+
+
+class Fetcher:
+	# Input fetches for the Python services: one pooled keep-alive session, an LRU of bytes
+	# keyed by URL + ETag (served without a round trip for ttl seconds, then revalidated with
+	# If-None-Match), coalesced concurrent downloads of the same URL, direct S3 reads for URLs
+	# on our own endpoint in one of `buckets`, and a small cache of decoded images keyed by
+	# content digest. Other buckets on the endpoint go over HTTP, anonymously.
+	def __init__(self, s3: Any = None, endpoint: str = '', allow: Callable[[str], bool] | None = None, buckets: Iterable[str] = (), max_bytes: int = 256 * 1024 * 1024, max_item_bytes: int = 32 * 1024 * 1024, ttl: float = 60.0, decoded_max_bytes: int = 128 * 1024 * 1024, pool_size: int = 16, timeout: float = 10.0):
+		self.s3 = s3
+		self.endpoint = endpoint.rstrip('/')
+		self.allow = allow
+		self.buckets = frozenset(b for b in buckets if b)
+		self.max_bytes = max(0, int(max_bytes))
+		self.max_item_bytes = max(0, int(max_item_bytes))
+		self.ttl = max(0.0, float(ttl))
+		self.decoded_max_bytes = max(0, int(decoded_max_bytes))
+		self.timeout = timeout
+		self.session = requests.Session()
+		adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+		self.session.mount('http://', adapter)
+		self.session.mount('https://', adapter)
+		self._lock = threading.Lock()
+		self._entries: 'OrderedDict[str, _Entry]' = OrderedDict()
+		self._bytes = 0
+		self._by_id: dict[int, _Entry] = {}
+		self._decoded: 'OrderedDict[tuple, Image.Image]' = OrderedDict()
+		self._decoded_bytes = 0
+		self._inflight: dict[str, Future] = {}
+		self.counters = {k: 0 for k in ('hits', 'misses', 'revalidated', 'coalesced', 's3_direct', 'errors', 'evictions', 'decoded_hits', 'decoded_misses')}
+
+	@classmethod
+	def from_env(cls, s3: Any = None, endpoint: str = '', allow: Callable[[str], bool] | None = None, buckets: Iterable[str] = (), pool_size: int = 16) -> 'Fetcher':
+		# The API uploads request inputs to S3_INPUTS_BUCKET, so it is read directly as well
+		mb = 1024 * 1024
+		return cls(
+			s3=s3, endpoint=endpoint, allow=allow, pool_size=pool_size,
+			buckets=[*buckets, os.getenv('S3_INPUTS_BUCKET', '')],
+			max_bytes=int(float(os.getenv('FETCH_CACHE_MB', '256')) * mb),
+			max_item_bytes=int(float(os.getenv('FETCH_CACHE_ITEM_MB', '32')) * mb),
+			ttl=float(os.getenv('FETCH_CACHE_TTL_S', '60')),
+			decoded_max_bytes=int(float(os.getenv('FETCH_DECODED_MB', '128')) * mb),
+			timeout=float(os.getenv('FETCH_TIMEOUT_S', '10')),
+		)
+
+	def fetch(self, url: str | None) -> bytes | None:
+		# None for disallowed or failed fetches, like the per-service helpers this replaces
+		with stage('fetch'):
+			return self._fetch(url)
+
+	def _fetch(self, url: str | None) -> bytes | None:
+		if not url:
+			return None
+		if url.startswith('data:'):
+			return self._data_url(url)
+		if not (url.startswith('http://') or url.startswith('https://')):
+			return None
+		if self.allow is not None and not self.allow(url):
+			return None
+		with self._lock:
+			entry = self._entries.get(url)
+			if entry is not None and time.monotonic() - entry.checked_at < self.ttl:
+				self._entries.move_to_end(url)
+				self.counters['hits'] += 1
+				return entry.data
+			fut = self._inflight.get(url)
+			leader = fut is None
+			if leader:
+				fut = self._inflight[url] = Future()
+			else:
+				self.counters['coalesced'] += 1
+		if not leader:
+			return fut.result()
+		data = None
+		try:
+			data = self._load(url, entry)
+		finally:
+			with self._lock:
+				self._inflight.pop(url, None)
+			fut.set_result(data)
+		return data
+
+	def decode(self, data: bytes | None, mode: str = 'RGB') -> Image.Image | None:
+		# Decoded images are shared between requests: treat the result as read-only
+		if not data:
+			return None
+		with self._lock:
+			entry = self._by_id.get(id(data))
+			digest = entry.digest if entry is not None and entry.data is data else None
+		if digest is None:
+			digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+		key = (digest, mode)
+		with self._lock:
+			im = self._decoded.get(key)
+			if im is not None:
+				self._decoded.move_to_end(key)
+				self.counters['decoded_hits'] += 1
+				return im
+			self.counters['decoded_misses'] += 1
+		with stage('decode'):
+			im = Image.open(BytesIO(data))
+			im = im.convert(mode) if im.mode != mode else im
+			im.load()
+		size = im.width * im.height * len(im.getbands())
+		if size <= self.decoded_max_bytes // 4:
+			with self._lock:
+				if key not in self._decoded:
+					self._decoded[key] = im
+					self._decoded_bytes += size
+				while self._decoded_bytes > self.decoded_max_bytes and self._decoded:
+					_, old = self._decoded.popitem(last=False)
+					self._decoded_bytes -= old.width * old.height * len(old.getbands())
+		return im
+
+	def fetch_image(self, url: str | None, mode: str = 'RGB') -> Image.Image | None:
+		try:
+			return self.decode(self.fetch(url), mode)
+		except Exception:
+			return None
+
+	def stats(self) -> dict:
+		with self._lock:
+			lookups = self.counters['hits'] + self.counters['misses'] + self.counters['revalidated']
+			return {
+				**self.counters,
+				"hit_rate": ((self.counters['hits'] + self.counters['revalidated']) / lookups) if lookups else 0.0,
+				"entries": len(self._entries),
+				"bytes": self._bytes,
+				"max_bytes": self.max_bytes,
+				"decoded_entries": len(self._decoded),
+				"decoded_bytes": self._decoded_bytes,
+				"inflight": len(self._inflight),
+			}
+
+	def _load(self, url: str, entry: _Entry | None) -> bytes | None:
+		etag = entry.etag if entry is not None else None
+		try:
+			target = self._s3_target(url)
+			if target is not None:
+				status, data, new_etag = self._get_s3(*target, etag)
+			else:
+				status, data, new_etag = self._get_http(url, etag)
+		except Exception:
+			with self._lock:
+				self.counters['errors'] += 1
+			return None
+		with self._lock:
+			if status == 304 and entry is not None:
+				entry.checked_at = time.monotonic()
+				self._entries.move_to_end(url)
+				self.counters['revalidated'] += 1
+				return entry.data
+			self.counters['misses'] += 1
+			self._store(url, _Entry(new_etag, data, hashlib.blake2b(data, digest_size=16).hexdigest()))
+		return data
+
+	def _get_http(self, url: str, etag: str | None) -> tuple[int, bytes, str | None]:
+		headers = {'If-None-Match': etag} if etag else {}
+		r = self.session.get(url, timeout=self.timeout, headers=headers)
+		if r.status_code == 304:
+			return 304, b'', etag
+		r.raise_for_status()
+		return r.status_code, r.content, r.headers.get('ETag')
+
+	def _s3_target(self, url: str) -> tuple[str, str] | None:
+		# (bucket, key) for a same-endpoint URL (our MinIO/S3) in one of our own buckets; the
+		# service's credentials must not open any other bucket to the caller
+		if self.s3 is None or not self.endpoint or not url.startswith(self.endpoint + '/'):
+			return None
+		path = urlsplit(url[len(self.endpoint):]).path.lstrip('/')
+		bucket, _, key = path.partition('/')
+		if bucket not in self.buckets or not key:
+			return None
+		return bucket, unquote(key)
+
+	def _get_s3(self, bucket: str, key: str, etag: str | None) -> tuple[int, bytes, str | None]:
+		extra = {'IfNoneMatch': etag} if etag else {}
+		with self._lock:
+			self.counters['s3_direct'] += 1
+		try:
+			obj = self.s3.get_object(Bucket=bucket, Key=key, **extra)
+		except Exception as e:
+			status = getattr(e, 'response', {}).get('ResponseMetadata', {}).get('HTTPStatusCode')
+			if status == 304:
+				return 304, b'', etag
+			raise
+		return 200, obj['Body'].read(), obj.get('ETag')
+
+	def _store(self, url: str, entry: _Entry) -> None:
+		old = self._entries.pop(url, None)
+		if old is not None:
+			self._bytes -= len(old.data)
+			self._by_id.pop(id(old.data), None)
+		if len(entry.data) > self.max_item_bytes or len(entry.data) > self.max_bytes:
+			return
+		self._entries[url] = entry
+		self._by_id[id(entry.data)] = entry
+		self._bytes += len(entry.data)
+		while self._bytes > self.max_bytes and self._entries:
+			_, victim = self._entries.popitem(last=False)
+			self._bytes -= len(victim.data)
+			self._by_id.pop(id(victim.data), None)
+			self.counters['evictions'] += 1
+
+	def _data_url(self, url: str) -> bytes | None:
+		try:
+			head, _, payload = url.partition(',')
+			return base64.b64decode(payload) if ';base64' in head else unquote(payload).encode('latin-1')
+		except Exception:
+			return None
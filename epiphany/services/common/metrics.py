@@ -0,0 +1,255 @@
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Iterable
+
+# Request stage names, in pipeline order; anything else a service records is reported too
+STAGES = ('fetch', 'decode', 'model_load', 'preprocess', 'text_encode', 'inference', 'render', 'safety', 'encode', 'hash', 'upload')
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+STEP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class Timings:
+	# Per-request stage durations. Stages are exclusive: time spent in a stage nested inside
+	# another (a model load inside inference) is counted only for the inner one. Worker
+	# threads reach the request's Timings through the context copied by BoundedExecutor.
+	def __init__(self):
+		self._lock = threading.Lock()
+		self.started = time.perf_counter()
+		self.stages: dict[str, float] = {}
+		self.steps: list[float] = []
+		self.labels: dict[str, str] = {}
+
+	def add(self, stage: str, ms: float) -> None:
+		with self._lock:
+			self.stages[stage] = self.stages.get(stage, 0.0) + ms
+
+	def add_steps(self, durations_ms: Iterable[float]) -> None:
+		with self._lock:
+			self.steps.extend(durations_ms)
+
+	def merge(self, other: 'Timings') -> None:
+		# Folds in the stages of shared work (a micro-batch this request was part of)
+		with other._lock:
+			stages, steps = dict(other.stages), list(other.steps)
+		for stage, ms in stages.items():
+			self.add(stage, ms)
+		self.add_steps(steps)
+
+	def label(self, **labels: Any) -> None:
+		self.labels.update({k: str(v) for k, v in labels.items() if v is not None})
+
+	@property
+	def total_ms(self) -> float:
+		return (time.perf_counter() - self.started) * 1000.0
+
+	def as_dict(self) -> dict:
+		with self._lock:
+			stages, steps = dict(self.stages), sorted(self.steps)
+		out = {k: round(stages[k], 2) for k in STAGES if k in stages}
+		out.update({k: round(v, 2) for k, v in stages.items() if k not in out})
+		if steps:
+			out['steps'] = {"count": len(steps), "mean": round(sum(steps) / len(steps), 2), "p50": round(steps[len(steps) // 2], 2), "max": round(steps[-1], 2)}
+		out['total'] = round(self.total_ms, 2)
+		return out
+
+
+_current: ContextVar[Timings | None] = ContextVar('timings', default=None)
+_stack = threading.local()
+
+
+def current() -> Timings | None:
+	return _current.get()
+
+
+def label(**labels: Any) -> None:
+	t = _current.get()
+	if t is not None:
+		t.label(**labels)
+
+
+@contextmanager
+def stage(name: str):
+	# Times a synchronous block into the current request's Timings (a no-op without one).
+	# Not for async code: the nesting stack is per thread.
+	t = _current.get()
+	if t is None:
+		yield
+		return
+	stack = getattr(_stack, 'frames', None)
+	if stack is None:
+		stack = _stack.frames = []
+	frame = [0.0]
+	stack.append(frame)
+	t0 = time.perf_counter()
+	try:
+		yield
+	finally:
+		elapsed = (time.perf_counter() - t0) * 1000.0
+		stack.pop()
+		if stack:
+			stack[-1][0] += elapsed
+		t.add(name, elapsed - frame[0])
+
+
+def timed(name: str, fn: Callable, *args, **kwargs) -> Any:
+	# fn(*args, **kwargs) as one stage; for handing a stage to an executor thread
+	with stage(name):
+		return fn(*args, **kwargs)
+
+
+@contextmanager
+def collect():
+	# Binds a fresh Timings for work shared by several requests (a micro-batch); callers merge
+	# it into each request's own Timings
+	t = Timings()
+	token = _current.set(t)
+	try:
+		yield t
+	finally:
+		_current.reset(token)
+
+
+class StepTimer:
+	# diffusers callback_on_step_end recording the interval between consecutive step ends.
+	# The first step is not reported: its interval would include prompt encoding.
+	def __init__(self, timings: Timings):
+		self.timings = timings
+		self.last: float | None = None
+
+	def __call__(self, pipe: Any, step: int, timestep: Any, kwargs: dict) -> dict:
+		now = time.perf_counter()
+		if self.last is not None:
+			self.timings.add_steps([(now - self.last) * 1000.0])
+		self.last = now
+		return kwargs
+
+
+class Histogram:
+	def __init__(self, name: str, help: str, labelnames: tuple[str, ...], buckets: tuple[float, ...]):
+		self.name = name
+		self.help = help
+		self.labelnames = labelnames
+		self.buckets = tuple(sorted(buckets))
+		self._lock = threading.Lock()
+		# labels -> [bucket counts..., +Inf count, sum]
+		self._series: dict[tuple, list] = {}
+
+	def observe(self, value: float, labels: tuple) -> None:
+		i = bisect.bisect_left(self.buckets, value)
+		with self._lock:
+			series = self._series.get(labels)
+			if series is None:
+				series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+			series[i] += 1
+			series[-1] += value
+
+	def render(self) -> list[str]:
+		lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+		with self._lock:
+			series = {k: list(v) for k, v in self._series.items()}
+		for labels, counts in sorted(series.items()):
+			base = ','.join(f'{n}="{_escape(v)}"' for n, v in zip(self.labelnames, labels))
+			sep = ',' if base else ''
+			cumulative = 0
+			for bound, count in zip(self.buckets + (float('inf'),), counts[:-1]):
+				cumulative += count
+				le = '+Inf' if bound == float('inf') else repr(bound)
+				lines.append(f'{self.name}_bucket{{{base}{sep}le="{le}"}} {cumulative}')
+			lines.append(f"{self.name}_sum{{{base}}} {counts[-1]!r}")
+			lines.append(f"{self.name}_count{{{base}}} {cumulative}")
+		return lines
+
+
+def _escape(value: str) -> str:
+	return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class GpuHighWater:
+	# Allocator peaks survive torch.cuda.reset_peak_memory_stats() (used for per-call
+	# measurements) as long as sample() runs before each reset
+	def __init__(self):
+		self.allocated = 0
+		self.reserved = 0
+
+	def sample(self) -> None:
+		try:
+			import torch
+			if not torch.cuda.is_available():
+				return
+			self.allocated = max(self.allocated, int(torch.cuda.max_memory_allocated()))
+			self.reserved = max(self.reserved, int(torch.cuda.max_memory_reserved()))
+		except Exception:
+			pass
+
+	def render(self, service: str) -> list[str]:
+		self.sample()
+		return [
+			"# HELP epiphany_gpu_memory_allocated_peak_bytes Highest CUDA memory allocated by tensors since start",
+			"# TYPE epiphany_gpu_memory_allocated_peak_bytes gauge",
+			f'epiphany_gpu_memory_allocated_peak_bytes{{service="{service}"}} {self.allocated}',
+			"# HELP epiphany_gpu_memory_reserved_peak_bytes Highest CUDA memory reserved by the caching allocator since start",
+			"# TYPE epiphany_gpu_memory_reserved_peak_bytes gauge",
+			f'epiphany_gpu_memory_reserved_peak_bytes{{service="{service}"}} {self.reserved}',
+		]
+
+
+gpu_high_water = GpuHighWater()
+
+
+class Metrics:
+	# Per-service request metrics: handlers decorated with instrument() get a Timings for the
+	# request, return it as `timings` (and `duration_ms`), and feed the histograms served on
+	# /metrics in the Prometheus text format.
+	def __init__(self, service: str):
+		self.service = service
+		labels = ('service', 'endpoint', 'model', 'resolution')
+		self.requests = Histogram('epiphany_request_duration_seconds', 'End-to-end handler time', labels, REQUEST_BUCKETS)
+		self.stages = Histogram('epiphany_stage_duration_seconds', 'Time per request stage (exclusive of nested stages)', labels + ('stage',), REQUEST_BUCKETS)
+		self.steps = Histogram('epiphany_diffusion_step_duration_seconds', 'Time per denoising step', labels, STEP_BUCKETS)
+
+	def observe(self, endpoint: str, t: Timings) -> None:
+		labels = (self.service, endpoint, t.labels.get('model', ''), t.labels.get('resolution', ''))
+		self.requests.observe(t.total_ms / 1000.0, labels)
+		with t._lock:
+			stages, steps = dict(t.stages), list(t.steps)
+		for name, ms in stages.items():
+			self.stages.observe(ms / 1000.0, labels + (name,))
+		for ms in steps:
+			self.steps.observe(ms / 1000.0, labels)
+		gpu_high_water.sample()
+
+	def instrument(self, endpoint: str) -> Callable:
+		def decorator(fn: Callable) -> Callable:
+			@functools.wraps(fn)
+			async def wrapper(*args, **kwargs):
+				t = Timings()
+				token = _current.set(t)
+				try:
+					result = await fn(*args, **kwargs)
+				finally:
+					_current.reset(token)
+				# Streamed responses do their work after the handler returns; they are not timed
+				if not isinstance(result, dict):
+					return result
+				if result.get('status') != 'canceled':
+					# Endpoint-specific timings a handler already returned (per-op times) are kept
+					extra = result.get('timings')
+					result['timings'] = {**(extra if isinstance(extra, dict) else {}), **t.as_dict()}
+					result['duration_ms'] = result['timings']['total']
+				self.observe(endpoint, t)
+				return result
+			return wrapper
+		return decorator
+
+	def render(self) -> str:
+		lines = self.requests.render() + self.stages.render() + self.steps.render() + gpu_high_water.render(self.service)
+		return '\n'.join(lines) + '\n'
+
+
+# Content type of the Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
@@ -0,0 +1,279 @@
+import asyncio
+import cProfile
+import functools
+import hmac
+import io
+import json
+import os
+import pstats
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from typing import Any, Callable
+
+from fastapi import HTTPException, Request
+
+try:
+	import pyinstrument  # type: ignore
+	from pyinstrument.renderers import ConsoleRenderer, HTMLRenderer  # type: ignore
+	from pyinstrument.session import Session  # type: ignore
+	_pyinstrument_available = True
+except Exception:
+	_pyinstrument_available = False
+
+ENGINES = ('auto', 'cprofile', 'pyinstrument')
+
+# The capture every BoundedExecutor job checks; None while disarmed
+_active: 'Capture | None' = None
+
+
+def wrap(fn: Callable) -> Callable:
+	# fn itself while disarmed (one global read per executor job), else fn under the capture
+	capture = _active
+	return fn if capture is None else functools.partial(capture.run, fn)
+
+
+def request_done() -> None:
+	capture = _active
+	if capture is not None:
+		capture.request_done()
+
+
+def _torch_profiler():
+	try:
+		import torch
+		import torch.profiler
+		return torch
+	except Exception:
+		return None
+
+
+class Capture:
+	# One armed profiling window. Every executor job that starts while it is active runs under
+	# its own Python profiler (cProfile and pyinstrument are per thread, and the work runs on
+	# the pool threads, not the event loop), plus torch.profiler for the first few jobs when
+	# torch is present; results are merged when the window closes.
+	def __init__(self, requests: int | None, seconds: float, engine: str, use_torch: bool, max_traces: int = 8):
+		self.id = uuid.uuid4().hex[:12]
+		self.requests = requests
+		self.seconds = seconds
+		self.engine = engine
+		self.torch = _torch_profiler() if use_torch else None
+		self.max_traces = max_traces
+		self.started_at = time.time()
+		self.finished_at: float | None = None
+		self.jobs = 0
+		self.requests_done = 0
+		self._lock = threading.Lock()
+		self._stats: pstats.Stats | None = None
+		self._sessions: list = []
+		self._traces: list[bytes] = []
+		self._ops: list[str] = []
+		self._done = asyncio.Event()
+
+	def run(self, fn: Callable, *args, **kwargs) -> Any:
+		with self._lock:
+			self.jobs += 1
+			trace = self.torch is not None and len(self._traces) + len(self._ops) < self.max_traces
+		if trace:
+			torch = self.torch
+			activities = [torch.profiler.ProfilerActivity.CPU]
+			if torch.cuda.is_available():
+				activities.append(torch.profiler.ProfilerActivity.CUDA)
+			with torch.profiler.profile(activities=activities) as tp:
+				result = self._python(fn, *args, **kwargs)
+			self._keep_trace(tp)
+			return result
+		return self._python(fn, *args, **kwargs)
+
+	def _python(self, fn: Callable, *args, **kwargs) -> Any:
+		if self.engine == 'pyinstrument':
+			profiler = pyinstrument.Profiler(async_mode='disabled')
+			profiler.start()
+			try:
+				return fn(*args, **kwargs)
+			finally:
+				profiler.stop()
+				with self._lock:
+					self._sessions.append(profiler.last_session)
+		profiler = cProfile.Profile()
+		profiler.enable()
+		try:
+			return fn(*args, **kwargs)
+		finally:
+			profiler.disable()
+			with self._lock:
+				if self._stats is None:
+					self._stats = pstats.Stats(profiler)
+				else:
+					self._stats.add(profiler)
+
+	def _keep_trace(self, tp: Any) -> None:
+		try:
+			ops = tp.key_averages().table(sort_by='self_cuda_time_total' if self.torch.cuda.is_available() else 'self_cpu_time_total', row_limit=40)
+			with tempfile.NamedTemporaryFile(suffix='.json') as f:
+				tp.export_chrome_trace(f.name)
+				data = open(f.name, 'rb').read()
+		except Exception:
+			return
+		with self._lock:
+			self._traces.append(data)
+			self._ops.append(ops)
+
+	def request_done(self) -> None:
+		# Called on the event loop as each admitted request finishes
+		self.requests_done += 1
+		if self.requests is not None and self.requests_done >= self.requests:
+			self._done.set()
+
+	async def wait(self) -> None:
+		try:
+			await asyncio.wait_for(self._done.wait(), timeout=self.seconds)
+		except asyncio.TimeoutError:
+			pass
+
+	def describe(self) -> dict:
+		return {
+			"id": self.id,
+			"engine": self.engine,
+			"torch": self.torch is not None,
+			"requests": self.requests,
+			"seconds": self.seconds,
+			"requests_done": self.requests_done,
+			"jobs": self.jobs,
+			"started_at": self.started_at,
+			"duration_ms": round(((self.finished_at or time.time()) - self.started_at) * 1000.0, 1),
+		}
+
+	def artifact(self, service: str) -> bytes:
+		# A zip of everything captured: text summaries to read in place, plus profile.pstats
+		# (snakeviz), profile.html (pyinstrument) and torch_trace_N.json (chrome://tracing,
+		# Perfetto) for the full picture
+		buf = io.BytesIO()
+		with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as z:
+			z.writestr('summary.json', json.dumps({"service": service, **self.describe()}, indent=2))
+			if self._stats is not None:
+				text = io.StringIO()
+				self._stats.stream = text
+				self._stats.sort_stats('cumulative').print_stats(60)
+				z.writestr('profile.txt', text.getvalue())
+				with tempfile.NamedTemporaryFile(suffix='.pstats') as f:
+					self._stats.dump_stats(f.name)
+					z.writestr('profile.pstats', open(f.name, 'rb').read())
+			if self._sessions:
+				session = functools.reduce(Session.combine, self._sessions)
+				z.writestr('profile.html', HTMLRenderer().render(session))
+				z.writestr('profile.txt', ConsoleRenderer(unicode=False, color=False).render(session))
+			for i, (trace, ops) in enumerate(zip(self._traces, self._ops)):
+				z.writestr(f"torch_trace_{i}.json", trace)
+				z.writestr(f"torch_ops_{i}.txt", ops)
+		return buf.getvalue()
+
+
+class Profiler:
+	# On-demand profiling for a service: POST /debug/profile arms a Capture for the next N
+	# admitted requests or T seconds (whichever ends first), then uploads the artifact to S3
+	# and answers with its URL. Disabled unless PROFILE_TOKEN is set; while disarmed the only
+	# cost is the executor's check of the module-level capture.
+	def __init__(self, service: str, s3: Any, bucket: str, endpoint: str, token: str | None = None, engine: str = 'auto', max_requests: int = 50, max_seconds: float = 300.0):
+		self.service = service
+		self.s3 = s3
+		self.bucket = bucket
+		self.endpoint = endpoint.rstrip('/')
+		self.token = token or None
+		self.engine = engine if engine in ENGINES else 'auto'
+		self.max_requests = max(1, int(max_requests))
+		self.max_seconds = max(1.0, float(max_seconds))
+		self.last: dict | None = None
+		self._task: asyncio.Task | None = None
+
+	@classmethod
+	def from_env(cls, service: str, s3: Any, bucket: str, endpoint: str) -> 'Profiler':
+		return cls(
+			service, s3, bucket, endpoint,
+			token=os.getenv('PROFILE_TOKEN'),
+			engine=os.getenv('PROFILE_ENGINE', 'auto'),
+			max_requests=int(os.getenv('PROFILE_MAX_REQUESTS', '50')),
+			max_seconds=float(os.getenv('PROFILE_MAX_SECONDS', '300')),
+		)
+
+	def authorize(self, request: Request) -> None:
+		if self.token is None:
+			raise HTTPException(status_code=404, detail='profiling disabled')
+		given = request.headers.get('x-profile-token') or ''
+		if not hmac.compare_digest(given.encode(), self.token.encode()):
+			raise HTTPException(status_code=401, detail='unauthorized')
+
+	def _engine(self) -> str:
+		if self.engine == 'auto':
+			return 'pyinstrument' if _pyinstrument_available else 'cprofile'
+		if self.engine == 'pyinstrument' and not _pyinstrument_available:
+			raise HTTPException(status_code=400, detail='pyinstrument is not installed')
+		return self.engine
+
+	def arm(self, requests: int | None = None, seconds: float | None = None, use_torch: bool = True) -> Capture:
+		global _active
+		# A capture whose window closed long ago without finishing (its event loop went away) is
+		# replaced rather than blocking profiling for good
+		if _active is not None and time.time() < _active.started_at + _active.seconds + 60:
+			raise HTTPException(status_code=409, detail={"error": 'already armed', "capture": _active.describe()})
+		if requests is None and seconds is None:
+			requests = 1
+		requests = None if requests is None else max(1, min(int(requests), self.max_requests))
+		seconds = self.max_seconds if seconds is None else max(0.1, min(float(seconds), self.max_seconds))
+		capture = Capture(requests, seconds, self._engine(), use_torch)
+		_active = capture
+		return capture
+
+	async def _finish(self, capture: Capture, upload: Callable) -> dict:
+		global _active
+		await capture.wait()
+		# Disarm before building the artifact so the upload itself is not profiled
+		_active = None
+		capture.finished_at = time.time()
+		key = f"debug/profiles/{self.service}/{time.strftime('%Y%m%dT%H%M%S', time.gmtime(capture.started_at))}_{capture.id}.zip"
+		try:
+			url = await upload(self._upload, capture, key)
+			self.last = {**capture.describe(), "url": url}
+		except Exception as e:
+			self.last = {**capture.describe(), "url": None, "error": f"{type(e).__name__}: {e}"[:200]}
+		return self.last
+
+	def _upload(self, capture: Capture, key: str) -> str:
+		self.s3.put_object(Bucket=self.bucket, Key=key, Body=capture.artifact(self.service), ContentType='application/zip')
+		return f"{self.endpoint}/{self.bucket}/{key}"
+
+	async def post(self, request: Request, upload: Callable) -> dict:
+		# Body: {"requests": N, "seconds": T, "torch": true, "wait": true}. With wait (the
+		# default) the call returns once the window closes and the artifact is uploaded;
+		# otherwise it returns at once and GET /debug/profile reports the URL later.
+		# `upload` runs blocking work off the loop (the executor's io).
+		self.authorize(request)
+		try:
+			body = await request.json()
+		except Exception:
+			body = {}
+		body = body if isinstance(body, dict) else {}
+		try:
+			capture = self.arm(body.get('requests'), body.get('seconds'), body.get('torch', True) is not False)
+		except (TypeError, ValueError) as e:
+			raise HTTPException(status_code=400, detail=str(e))
+		self._task = asyncio.ensure_future(self._finish(capture, upload))
+		if body.get('wait', True) is False:
+			return {"armed": True, **capture.describe()}
+		return await asyncio.shield(self._task)
+
+	def get(self, request: Request) -> dict:
+		self.authorize(request)
+		return self.status()
+
+	def status(self) -> dict:
+		capture = _active
+		return {
+			"enabled": self.token is not None,
+			"engine": self.engine,
+			"armed": None if capture is None else capture.describe(),
+			"last": self.last,
+		}
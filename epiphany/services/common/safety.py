@@ -0,0 +1,133 @@
+import os
+import threading
+import time
+from typing import Any
+
+from common.metrics import stage
+
+_safety_available = False
+try:
+	import torch  # type: ignore
+	from transformers import AutoFeatureExtractor  # type: ignore
+	from diffusers.pipelines.stable_diffusion.safety_checker import StableDiffusionSafetyChecker  # type: ignore
+	_safety_available = True
+except Exception:
+	_safety_available = False
+
+# Scores at or above this are treated as unsafe (0.5 == the checker's own concept threshold)
+NSFW_THRESHOLD = float(os.getenv('SAFETY_NSFW_THRESHOLD', '0.5'))
+
+
+def _resolve_device() -> str:
+	device_env = (os.getenv('SAFETY_DEVICE') or os.getenv('TORCH_DEVICE') or '').strip().lower()
+	if device_env in ('cpu',):
+		return 'cpu'
+	if device_env in ('cuda', 'gpu'):
+		return 'cuda'
+	return 'cuda' if _safety_available and torch.cuda.is_available() else 'cpu'
+
+
+def _cosine(a, b):
+	return torch.mm(torch.nn.functional.normalize(a), torch.nn.functional.normalize(b).t())
+
+
+class SafetyScorer:
+	# Resident CLIP safety checker: loaded lazily once, pinned to one device, scores a list of
+	# images (generation batches, sampled video frames) per forward pass and returns a
+	# continuous score per image instead of the checker's boolean.
+	def __init__(self, model_id: str | None = None, device: str | None = None, max_batch: int = 16):
+		self.model_id = model_id or os.getenv('SAFETY_MODEL', 'CompVis/stable-diffusion-safety-checker')
+		self.device = device
+		self.max_batch = max(1, int(max_batch))
+		self._extractor = None
+		self._checker = None
+		self._failed = False
+		self._lock = threading.Lock()
+		self.load_ms = 0.0
+		self.calls = 0
+		self.images = 0
+		self.total_ms = 0.0
+		self.last_ms = 0.0
+
+	@property
+	def available(self) -> bool:
+		return _safety_available and not self._failed
+
+	def load(self) -> bool:
+		if self._checker is not None:
+			return True
+		if not self.available:
+			return False
+		with self._lock:
+			if self._checker is not None:
+				return True
+			try:
+				t0 = time.perf_counter()
+				self.device = self.device or _resolve_device()
+				dtype = torch.float16 if self.device == 'cuda' else torch.float32
+				with stage('model_load'):
+					extractor = AutoFeatureExtractor.from_pretrained(self.model_id)
+					checker = StableDiffusionSafetyChecker.from_pretrained(self.model_id, torch_dtype=dtype).to(self.device).eval()
+				self._extractor, self._checker = extractor, checker
+				self.load_ms = (time.perf_counter() - t0) * 1000.0
+			except Exception:
+				self._failed = True
+				return False
+		return True
+
+	def score(self, images: list[Any]) -> list[float]:
+		# images: PIL images or HxWx3 uint8 arrays
+		if not images:
+			return []
+		if not self.load():
+			return [0.0] * len(images)
+		with stage('safety'):
+			return self._score(images)
+
+	def _score(self, images: list[Any]) -> list[float]:
+		t0 = time.perf_counter()
+		try:
+			out: list[float] = []
+			for i in range(0, len(images), self.max_batch):
+				chunk = images[i:i + self.max_batch]
+				pixels = self._extractor(chunk, return_tensors='pt').pixel_values
+				pixels = pixels.to(self.device, dtype=self._checker.dtype)
+				with torch.no_grad():
+					out.extend(self._continuous(pixels))
+			return out
+		except Exception:
+			return [0.0] * len(images)
+		finally:
+			elapsed = (time.perf_counter() - t0) * 1000.0
+			with self._lock:
+				self.calls += 1
+				self.images += len(images)
+				self.total_ms += elapsed
+				self.last_ms = elapsed
+
+	def score_one(self, image: Any) -> float:
+		return self.score([image])[0]
+
+	def _continuous(self, clip_input) -> list[float]:
+		# Same margins StableDiffusionSafetyChecker.forward thresholds at 0, squashed to (0, 1)
+		c = self._checker
+		embeds = c.visual_projection(c.vision_model(clip_input)[1])
+		special = _cosine(embeds, c.special_care_embeds) - c.special_care_embeds_weights
+		adjust = torch.any(special > 0, dim=1, keepdim=True).to(embeds.dtype) * 0.01
+		concepts = _cosine(embeds, c.concept_embeds) - c.concept_embeds_weights + adjust
+		margin = concepts.max(dim=1).values.float()
+		return [round(v, 4) for v in torch.sigmoid(margin / 0.01).tolist()]
+
+	def stats(self) -> dict:
+		with self._lock:
+			return {
+				"available": self.available,
+				"loaded": self._checker is not None,
+				"device": self.device,
+				"load_ms": round(self.load_ms, 1),
+				"calls": self.calls,
+				"images": self.images,
+				"last_ms": round(self.last_ms, 1),
+				"avg_ms_per_image": round(self.total_ms / self.images, 2) if self.images else 0.0,
+				"threshold": NSFW_THRESHOLD,
+			}
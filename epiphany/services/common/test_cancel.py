@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+from common.cancel import Canceled, CancelRegistry
+
+
+class FakeRedis:
+	def __init__(self):
+		self.keys = set()
+		self.reads = 0
+
+	def exists(self, key):
+		self.reads += 1
+		return int(key in self.keys)
+
+
+def test_local_flag_stops_a_frame_source_mid_stream():
+	reg = CancelRegistry()
+	seen = []
+	with pytest.raises(Canceled) as err:
+		for i in reg.guard(range(100), 'job-1'):
+			seen.append(i)
+			if i == 4:
+				reg.cancel('job-1')
+	assert seen == [0, 1, 2, 3, 4] and err.value.job_id == 'job-1'
+	assert reg.stats()['aborted'] == 1
+	# other and anonymous jobs are unaffected
+	assert list(reg.guard(range(3), 'job-2')) == [0, 1, 2]
+	assert list(reg.guard(range(3), None)) == [0, 1, 2]
+
+
+def test_redis_flag_is_polled_at_most_once_per_interval():
+	reg = CancelRegistry(poll_s=60)
+	reg._redis = FakeRedis()
+	assert not reg.is_canceled('a') and not reg.is_canceled('a')
+	assert reg._redis.reads == 1
+	reg._redis.keys.add('cancel:b')
+	assert reg.is_canceled('b')
+	# once seen, the flag is held locally
+	assert reg.is_canceled('b') and reg._redis.reads == 2
+
+
+def test_handler_turns_canceled_into_a_response():
+	released = []
+	reg = CancelRegistry(on_abort=lambda: released.append(True))
+
+	@reg.handler
+	async def handler(job_id):
+		reg.check(job_id)
+		return {"ok": True}
+
+	reg.cancel('x')
+	assert asyncio.run(handler('x')) == {"status": "canceled", "job_id": 'x'}
+	assert released == [True] and reg.stats()['pending'] == 0
+	assert asyncio.run(handler('y')) == {"ok": True}
+
+
+def test_handler_drops_poll_state_for_finished_jobs():
+	reg = CancelRegistry(poll_s=60)
+	reg._redis = FakeRedis()
+
+	@reg.handler
+	async def handler(job_id):
+		reg.check(job_id)
+		return list(reg.guard(range(2), job_id))
+
+	assert asyncio.run(handler('a')) == [0, 1] and reg._redis.reads == 1
+	assert reg._polled == {} and reg.stats()['pending'] == 0
@@ -0,0 +1,46 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from common.executor import BoundedExecutor
+
+
+def test_compute_runs_off_the_event_loop():
+	ex = BoundedExecutor('t', workers=1)
+	async def go():
+		return await ex.run(threading.current_thread)
+	assert asyncio.run(go()) is not threading.main_thread()
+
+
+def test_admission_rejects_when_saturated():
+	ex = BoundedExecutor('t', workers=1, max_queue=1, reject_status=503)
+	gate = threading.Event()
+
+	@ex.admitted_handler
+	async def handler():
+		return await ex.run(gate.wait, 5)
+
+	async def go():
+		first = [asyncio.ensure_future(handler()) for _ in range(2)]
+		await asyncio.sleep(0.05)
+		assert ex.queue_depth() == 1
+		with pytest.raises(HTTPException) as err:
+			await handler()
+		gate.set()
+		await asyncio.gather(*first)
+		return err.value
+	err = asyncio.run(go())
+	assert err.status_code == 503 and err.headers['X-Queue-Depth'] == '1'
+	assert ex.stats()['rejected'] == 1 and ex.inflight == 0
+
+
+def test_hold_keeps_a_slot_until_released_once():
+	ex = BoundedExecutor('t', workers=1, max_queue=0)
+	release = ex.hold()
+	with pytest.raises(HTTPException):
+		ex.hold()
+	release()
+	release()
+	assert ex.inflight == 0 and ex.stats()['admitted'] == 1
@@ -0,0 +1,118 @@
+import base64
+import threading
+import time
+from io import BytesIO
+
+from PIL import Image
+
+from common.fetch import Fetcher
+
+
+class FakeResponse:
+	def __init__(self, status_code, content=b'', etag=None):
+		self.status_code = status_code
+		self.content = content
+		self.headers = {'ETag': etag} if etag else {}
+
+	def raise_for_status(self):
+		if self.status_code >= 400:
+			raise RuntimeError(self.status_code)
+
+
+class FakeSession:
+	# Serves one body with a fixed ETag and honours If-None-Match
+	def __init__(self, body, etag='"v1"', delay=0.0):
+		self.body, self.etag, self.delay = body, etag, delay
+		self.calls = []
+
+	def get(self, url, timeout=None, headers=None):
+		self.calls.append(dict(headers or {}))
+		time.sleep(self.delay)
+		if (headers or {}).get('If-None-Match') == self.etag:
+			return FakeResponse(304)
+		return FakeResponse(200, self.body, self.etag)
+
+
+def png_bytes(color=(255, 0, 0)):
+	buf = BytesIO()
+	Image.new('RGB', (8, 8), color).save(buf, format='PNG')
+	return buf.getvalue()
+
+
+def test_cached_within_ttl_then_revalidated_with_etag():
+	f = Fetcher(ttl=60)
+	f.session = FakeSession(b'payload')
+	assert f.fetch('http://x/a.png') == b'payload'
+	assert f.fetch('http://x/a.png') == b'payload'
+	assert len(f.session.calls) == 1
+	f.ttl = 0
+	assert f.fetch('http://x/a.png') == b'payload'
+	assert f.session.calls[-1] == {'If-None-Match': '"v1"'}
+	s = f.stats()
+	assert (s['misses'], s['hits'], s['revalidated']) == (1, 1, 1)
+
+
+def test_concurrent_fetches_of_one_url_are_coalesced():
+	f = Fetcher()
+	f.session = FakeSession(b'slow', delay=0.1)
+	out = []
+	threads = [threading.Thread(target=lambda: out.append(f.fetch('http://x/b.png'))) for _ in range(4)]
+	for t in threads:
+		t.start()
+	for t in threads:
+		t.join()
+	assert out == [b'slow'] * 4
+	assert len(f.session.calls) == 1 and f.stats()['coalesced'] == 3
+
+
+def test_same_endpoint_urls_read_from_s3():
+	class FakeS3:
+		def get_object(self, Bucket, Key, **kw):
+			self.args = (Bucket, Key, kw)
+			return {'Body': BytesIO(b'obj'), 'ETag': '"e"'}
+	s3 = FakeS3()
+	f = Fetcher(s3=s3, endpoint='http://minio:9000', buckets=['bucket'])
+	assert f.fetch('http://minio:9000/bucket/dir/a%20b.png') == b'obj'
+	assert s3.args == ('bucket', 'dir/a b.png', {})
+	assert f.stats()['s3_direct'] == 1
+
+
+def test_foreign_buckets_on_the_endpoint_go_over_http():
+	class FakeS3:
+		def get_object(self, **kw):
+			raise AssertionError('read with service credentials')
+	f = Fetcher(s3=FakeS3(), endpoint='http://minio:9000', buckets=['outputs'])
+	f.session = FakeSession(b'public')
+	assert f.fetch('http://minio:9000/epiphany-explain/secret.png') == b'public'
+	assert len(f.session.calls) == 1 and f.stats()['s3_direct'] == 0
+
+
+def test_disallowed_and_failed_fetches_return_none():
+	f = Fetcher(allow=lambda u: u.startswith('http://ok/'))
+	f.session = FakeSession(b'x')
+	assert f.fetch('http://evil/a.png') is None
+	assert f.fetch('file:///etc/passwd') is None
+	f.session.get = lambda *a, **k: FakeResponse(500)
+	assert f.fetch('http://ok/a.png') is None
+	assert f.stats()['errors'] == 1
+
+
+def test_data_urls_and_decoded_cache():
+	data = png_bytes()
+	f = Fetcher()
+	url = 'data:image/png;base64,' + base64.b64encode(data).decode()
+	a = f.fetch_image(url, 'RGB')
+	b = f.decode(data, 'RGB')
+	assert a is b and a.getpixel((0, 0)) == (255, 0, 0)
+	assert f.decode(data, 'L') is not a
+	s = f.stats()
+	assert (s['decoded_hits'], s['decoded_misses']) == (1, 2)
+
+
+def test_byte_cache_evicts_least_recently_used():
+	f = Fetcher(max_bytes=10)
+	f.session = FakeSession(b'123456')
+	f.fetch('http://x/1')
+	f.fetch('http://x/2')
+	s = f.stats()
+	assert s['entries'] == 1 and s['bytes'] == 6 and s['evictions'] == 1
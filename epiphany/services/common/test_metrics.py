@@ -0,0 +1,82 @@
+import asyncio
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common.metrics import Histogram, Metrics, StepTimer, Timings, collect, current, label, stage, timed
+
+
+def test_nested_stages_are_exclusive():
+	async def handler():
+		with stage('inference'):
+			time.sleep(0.02)
+			with stage('model_load'):
+				time.sleep(0.03)
+		return {"ok": True}
+	out = asyncio.run(Metrics('test').instrument('x')(handler)())
+	t = out['timings']
+	assert t['model_load'] >= 30 and 20 <= t['inference'] < 30
+	assert list(t)[:2] == ['model_load', 'inference'] and out['duration_ms'] == t['total'] >= 50
+
+
+def test_stage_without_request_is_a_noop():
+	assert current() is None
+	with stage('fetch'):
+		pass
+	assert timed('fetch', lambda a, b=0: a + b, 1, b=2) == 3
+
+
+def test_shared_work_is_merged_into_each_request():
+	with collect() as shared:
+		with stage('inference'):
+			pass
+		timer = StepTimer(shared)
+		for step in range(3):
+			timer(None, step, None, {})
+	assert current() is None and len(shared.steps) == 2
+	mine = Timings()
+	mine.add('inference', 5.0)
+	mine.merge(shared)
+	d = mine.as_dict()
+	assert d['inference'] >= 5.0 and d['steps']['count'] == 2
+
+
+def test_histogram_renders_cumulative_buckets():
+	h = Histogram('lat_seconds', 'help', ('endpoint',), (0.1, 1.0))
+	for v in (0.05, 0.5, 0.5, 3.0):
+		h.observe(v, ('a"b',))
+	lines = h.render()
+	assert lines[:2] == ['# HELP lat_seconds help', '# TYPE lat_seconds histogram']
+	assert 'lat_seconds_bucket{endpoint="a\\"b",le="0.1"} 1' in lines
+	assert 'lat_seconds_bucket{endpoint="a\\"b",le="1.0"} 3' in lines
+	assert 'lat_seconds_bucket{endpoint="a\\"b",le="+Inf"} 4' in lines
+	assert 'lat_seconds_sum{endpoint="a\\"b"} 4.05' in lines and 'lat_seconds_count{endpoint="a\\"b"} 4' in lines
+
+
+def test_instrument_labels_and_threads_share_the_request():
+	metrics = Metrics('svc')
+	pool = ThreadPoolExecutor(1)
+
+	async def handler():
+		label(model='m', resolution='64x64')
+		# BoundedExecutor copies the context the same way
+		ctx = contextvars.copy_context()
+		await asyncio.get_running_loop().run_in_executor(pool, ctx.run, timed, 'upload', time.sleep, 0.01)
+		return {"timings": {"ops": []}}
+
+	out = asyncio.run(metrics.instrument('ep')(handler)())
+	assert out['timings']['ops'] == [] and out['timings']['upload'] >= 10
+	text = metrics.render()
+	assert 'epiphany_request_duration_seconds_count{service="svc",endpoint="ep",model="m",resolution="64x64"} 1' in text
+	assert 'stage="upload"' in text and 'epiphany_gpu_memory_allocated_peak_bytes{service="svc"} 0' in text
+
+
+def test_canceled_and_streamed_results_are_left_alone():
+	metrics = Metrics('svc')
+	async def canceled():
+		return {"status": 'canceled'}
+	async def streamed():
+		return 'stream'
+	assert 'timings' not in asyncio.run(metrics.instrument('c')(canceled)())
+	assert asyncio.run(metrics.instrument('s')(streamed)()) == 'stream'
+	assert 'endpoint="s"' not in metrics.render() and 'endpoint="c"' in metrics.render()
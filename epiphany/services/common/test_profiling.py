@@ -0,0 +1,82 @@
+import asyncio
+import io
+import json
+import zipfile
+
+import pytest
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.testclient import TestClient
+
+from common import profiling
+from common.executor import BoundedExecutor
+from common.profiling import Profiler
+
+
+class FakeS3:
+	def __init__(self):
+		self.objects = {}
+
+	def put_object(self, Bucket, Key, Body, ContentType):
+		self.objects[Key] = Body
+
+
+def busy_loop(n):
+	return sum(i * i for i in range(n))
+
+
+def test_disarmed_jobs_run_unwrapped():
+	assert profiling._active is None
+	assert profiling.wrap(busy_loop) is busy_loop
+	profiling.request_done()
+
+
+def test_capture_covers_the_next_requests_and_uploads_a_zip():
+	s3 = FakeS3()
+	ex = BoundedExecutor('t', workers=1, io_workers=1)
+	profiler = Profiler('svc', s3, 'bucket', 'http://s3/', engine='cprofile')
+
+	@ex.admitted_handler
+	async def handler():
+		return await ex.run(busy_loop, 10_000)
+
+	async def go():
+		capture = profiler.arm(requests=2, use_torch=False)
+		with pytest.raises(HTTPException) as err:
+			profiler.arm()
+		assert err.value.status_code == 409
+		finish = asyncio.ensure_future(profiler._finish(capture, ex.io))
+		await handler()
+		await handler()
+		return await asyncio.wait_for(finish, 5)
+	result = asyncio.run(go())
+	assert profiling._active is None
+	assert result['url'].startswith('http://s3/bucket/debug/profiles/svc/') and result['jobs'] == 2 and result['requests_done'] == 2
+	(body,) = s3.objects.values()
+	z = zipfile.ZipFile(io.BytesIO(body))
+	assert {'summary.json', 'profile.txt', 'profile.pstats'} <= set(z.namelist())
+	assert 'busy_loop' in z.read('profile.txt').decode()
+	assert json.loads(z.read('summary.json'))['service'] == 'svc'
+
+
+def test_endpoint_needs_the_token():
+	app = FastAPI()
+	ex = BoundedExecutor('t', workers=1, io_workers=1)
+	s3 = FakeS3()
+	disabled = Profiler('svc', s3, 'bucket', 'http://s3', token=None)
+	profiler = Profiler('svc', s3, 'bucket', 'http://s3', token='secret', engine='cprofile')
+
+	@app.get('/off')
+	async def off(request: Request):
+		return disabled.get(request)
+
+	@app.post('/debug/profile')
+	async def post(request: Request):
+		return await profiler.post(request, ex.io)
+
+	c = TestClient(app)
+	assert c.get('/off').status_code == 404
+	assert c.post('/debug/profile', json={}).status_code == 401
+	assert c.post('/debug/profile', json={"seconds": 0.1, "torch": False}, headers={"X-Profile-Token": 'wrong'}).status_code == 401
+	r = c.post('/debug/profile', json={"seconds": 0.1, "torch": False}, headers={"X-Profile-Token": 'secret'})
+	assert r.status_code == 200 and r.json()['url'] and r.json()['jobs'] == 0
+	assert profiler.status()['last']['id'] == r.json()['id'] and profiling._active is None
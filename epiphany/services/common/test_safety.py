@@ -0,0 +1,37 @@
+import pytest
+
+from common import safety
+from common.safety import SafetyScorer
+
+
+def test_unavailable_checker_scores_zero_without_raising(monkeypatch):
+	monkeypatch.setattr(safety, '_safety_available', False)
+	scorer = SafetyScorer()
+	assert scorer.score([object(), object()]) == [0.0, 0.0]
+	assert scorer.score([]) == []
+	assert scorer.stats()["loaded"] is False
+
+
+def test_margin_maps_to_continuous_score():
+	torch = pytest.importorskip('torch')
+
+	class FakeChecker:
+		dtype = torch.float32
+		concept_embeds = torch.eye(2)
+		concept_embeds_weights = torch.tensor([0.7, 0.7])
+		special_care_embeds = torch.eye(2)
+		special_care_embeds_weights = torch.tensor([2.0, 2.0])
+
+		def vision_model(self, x):
+			return (None, x)
+
+		def visual_projection(self, x):
+			return x
+
+	scorer = SafetyScorer()
+	scorer._checker = FakeChecker()
+	# margins: +0.3 (clearly unsafe), ~+0.007 (at the checker's threshold), -1.4 (clearly safe)
+	hi, mid, lo = scorer._continuous(torch.tensor([[1.0, 0.0], [1.0, 1.0], [-1.0, -1.0]]))
+	assert hi > 0.99
+	assert 0.5 < mid < 0.99
+	assert lo < 0.01
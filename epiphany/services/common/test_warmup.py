@@ -0,0 +1,78 @@
+import asyncio
+
+from common.warmup import Warmup, warmup_names
+
+
+def test_models_load_and_warm_in_order_before_ready():
+	seen = []
+	warmup = Warmup(
+		{'a': lambda: seen.append('load a') or 'A', 'b': lambda: seen.append('load b') or 'B', 'c': lambda: 'C'},
+		{'a': lambda m: seen.append(f"warm {m}")},
+		names=['a', 'b'],
+	)
+	assert not warmup.ready() and warmup.status()['models']['a']['state'] == 'pending'
+	assert warmup.run()
+	assert seen == ['load a', 'warm A', 'load b']
+	status = warmup.status()
+	assert status['ready'] and status['finished'] and set(status['models']) == {'a', 'b'}
+	assert status['models']['a']['warm_ms'] is not None and status['models']['b']['warm_ms'] is None
+	assert status['models']['b']['load_ms'] is not None
+
+
+def test_failed_loads_keep_the_replica_unready():
+	def broken():
+		raise RuntimeError('no weights')
+	def bad_warm(model):
+		raise ValueError('tiny input')
+	warmup = Warmup({'ok': lambda: 1, 'none': lambda: None, 'broken': broken}, {'ok': bad_warm}, names=['ok', 'none', 'broken'])
+	assert not warmup.run()
+	models = warmup.status()['models']
+	# a failed warm call is reported but the loaded model still counts as ready
+	assert models['ok']['state'] == 'ready' and models['ok']['error'].startswith('warmup: ValueError')
+	assert models['none'] == {**models['none'], 'state': 'failed', 'error': 'unavailable'}
+	assert models['broken']['error'] == 'RuntimeError: no weights'
+
+
+def test_configuration(monkeypatch):
+	assert warmup_names('all', ['a', 'b']) == ['a', 'b']
+	assert warmup_names(' b, nope ,', ['a', 'b']) == ['b']
+	# nothing to warm: ready straight away
+	assert Warmup({'a': lambda: 1}).ready()
+	monkeypatch.setenv('WARMUP_MODELS', 'a')
+	monkeypatch.setenv('WARMUP_INFERENCE', 'false')
+	warmup = Warmup.from_env({'a': lambda: 1, 'b': lambda: 2}, {'a': lambda m: 1 / 0}, default='all')
+	assert warmup.names == ['a'] and warmup.run()
+	assert warmup.status()['models']['a']['warm_ms'] is None
+	monkeypatch.delenv('WARMUP_MODELS')
+	assert Warmup.from_env({'a': lambda: 1, 'b': lambda: 2}, default='b').names == ['b']
+	monkeypatch.setenv('WARMUP_OPTIONAL', 'a,b')
+	monkeypatch.setenv('WARMUP_RETRIES', '0')
+	warmup = Warmup.from_env({'a': lambda: 1, 'b': lambda: 2}, default='b', optional='')
+	assert warmup.optional == ['b'] and warmup.retries == 0
+
+
+def test_failed_loads_are_retried_with_backoff_and_optional_ones_do_not_block():
+	attempts = {'flaky': 0, 'gone': 0}
+	def flaky():
+		attempts['flaky'] += 1
+		if attempts['flaky'] < 3:
+			raise OSError('download reset')
+		return 'F'
+	def gone():
+		attempts['gone'] += 1
+		return None
+	warmup = Warmup({'flaky': flaky, 'gone': gone}, names=['flaky', 'gone'], optional=['gone'], retries=3, retry_delay=0.01)
+	passes, states = [], []
+	async def run_job(fn, *args):
+		passes.append(args[0] if args else 'all')
+		states.append(warmup.status()['loading'])
+		return fn(*args)
+	assert asyncio.run(warmup.serve(run_job))
+	assert attempts == {'flaky': 3, 'gone': 4} and passes == ['all', ['flaky', 'gone'], ['flaky', 'gone'], ['gone']]
+	assert states[1] == ['flaky', 'gone']
+	status = warmup.status()
+	assert status['ready'] and status['finished'] and status['failed'] == ['gone'] and status['loading'] == []
+	assert status['models']['flaky']['state'] == 'ready' and status['models']['gone']['attempts'] == 4
+	# a required model that never loads keeps the replica unready once its retries are used up
+	strict = Warmup({'gone': gone}, names=['gone'], retries=1, retry_delay=0)
+	assert not asyncio.run(strict.serve(run_job)) and strict.status()['failed'] == ['gone']
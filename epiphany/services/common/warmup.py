@@ -0,0 +1,149 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Awaitable, Callable, Iterable
+
+# Per-model warmup states, in the order a model moves through them; a failed load waits in
+# 'retrying' for its next attempt and ends 'failed' once its retries are used up
+STATES = ('pending', 'loading', 'warming', 'ready', 'retrying', 'failed')
+IN_PROGRESS = ('pending', 'loading', 'warming', 'retrying')
+
+# Longest wait between two load attempts
+MAX_RETRY_DELAY_S = 300.0
+
+
+def warmup_names(spec: str, available: Iterable[str]) -> list[str]:
+	# Comma-separated model names, "all", or "none"/empty
+	names = [n.strip() for n in (spec or '').split(',') if n.strip()]
+	available = list(available)
+	if 'all' in names:
+		return available
+	return [n for n in names if n in available]
+
+
+class Warmup:
+	# Startup warmup for a service's resident models. run() loads each configured model in
+	# turn (on a worker thread, so /health answers meanwhile) and optionally runs one tiny
+	# inference through it so lazy CUDA/cuDNN initialisation and autotuning happen before
+	# the first request. serve() drives that at startup and retries failed loads (a transient
+	# download error, a busy device) with exponential backoff. /ready reports ready once every
+	# configured model is warm; optional models only hold it back while their first load runs.
+	def __init__(self, loaders: dict[str, Callable[[], Any]], warmers: dict[str, Callable[[Any], Any]] | None = None, names: Iterable[str] = (), warm_inference: bool = True, optional: Iterable[str] = (), retries: int = 3, retry_delay: float = 10.0):
+		self.loaders = dict(loaders)
+		self.warmers = dict(warmers or {})
+		self.names = [n for n in names if n in self.loaders]
+		self.warm_inference = warm_inference
+		self.optional = [n for n in optional if n in self.names]
+		self.retries = max(0, int(retries))
+		self.retry_delay = max(0.0, float(retry_delay))
+		self._lock = threading.Lock()
+		self._models = {n: {"state": 'pending', "attempts": 0, "load_ms": None, "warm_ms": None, "error": None} for n in self.names}
+		self.started_at: float | None = None
+		self.finished_at: float | None = None
+
+	@classmethod
+	def from_env(cls, loaders: dict[str, Callable[[], Any]], warmers: dict[str, Callable[[Any], Any]] | None = None, default: str = '', optional: str = '') -> 'Warmup':
+		spec = os.getenv('WARMUP_MODELS')
+		optional_spec = os.getenv('WARMUP_OPTIONAL')
+		return cls(
+			loaders, warmers, warmup_names(default if spec is None else spec, loaders),
+			os.getenv('WARMUP_INFERENCE', 'true').lower() != 'false',
+			optional=warmup_names(optional if optional_spec is None else optional_spec, loaders),
+			retries=int(os.getenv('WARMUP_RETRIES') or 3),
+			retry_delay=float(os.getenv('WARMUP_RETRY_DELAY_S') or 10.0),
+		)
+
+	def _set(self, name: str, **fields) -> None:
+		with self._lock:
+			self._models[name].update(fields)
+
+	def _load(self, name: str) -> bool:
+		# Loaders return the model (None when it cannot be loaded here); warmers get that model
+		with self._lock:
+			self._models[name]['attempts'] += 1
+			self._models[name].update(state='loading', error=None)
+		t0 = time.perf_counter()
+		try:
+			model = self.loaders[name]()
+		except Exception as e:
+			model, error = None, f"{type(e).__name__}: {e}"[:200]
+		else:
+			error = None if model is not None else 'unavailable'
+		self._set(name, load_ms=round((time.perf_counter() - t0) * 1000.0, 1))
+		if model is None:
+			self._set(name, state='failed', error=error)
+			return False
+		warm = self.warmers.get(name) if self.warm_inference else None
+		if warm is not None:
+			self._set(name, state='warming')
+			t0 = time.perf_counter()
+			try:
+				warm(model)
+			except Exception as e:
+				# A failed warm call leaves the model usable; it is reported, not fatal
+				self._set(name, error=f"warmup: {type(e).__name__}: {e}"[:200])
+			self._set(name, warm_ms=round((time.perf_counter() - t0) * 1000.0, 1))
+		self._set(name, state='ready')
+		return True
+
+	def run(self, names: Iterable[str] | None = None) -> bool:
+		# One pass over `names` (default: every configured model)
+		if self.started_at is None:
+			self.started_at = time.time()
+		for name in self.names if names is None else names:
+			self._load(name)
+		self.finished_at = time.time()
+		return self.ready()
+
+	def failed(self) -> list[str]:
+		with self._lock:
+			return [n for n, m in self._models.items() if m['state'] in ('failed', 'retrying')]
+
+	async def serve(self, run_job: Callable[..., Awaitable[Any]]) -> bool:
+		# Startup driver: the first pass, then up to `retries` more passes over the models that
+		# failed, waiting retry_delay, 2x, 4x, ... (capped) before each. Passes run through
+		# run_job (the service executor's run); the waits do not hold a worker.
+		if not self.names:
+			return True
+		await run_job(self.run)
+		delay = self.retry_delay
+		for _ in range(self.retries):
+			failed = self.failed()
+			if not failed:
+				break
+			for name in failed:
+				self._set(name, state='retrying', next_retry_at=round(time.time() + delay, 3))
+			await asyncio.sleep(delay)
+			await run_job(self.run, failed)
+			delay = min(delay * 2, MAX_RETRY_DELAY_S)
+		for name in self.names:
+			self._set(name, next_retry_at=None)
+		return self.ready()
+
+	def ready(self) -> bool:
+		if self.started_at is None and self.names:
+			return False
+		with self._lock:
+			for name, m in self._models.items():
+				if m['state'] == 'ready':
+					continue
+				# An optional model only blocks readiness until its first attempt has finished
+				if name in self.optional and m['attempts'] and m['state'] in ('failed', 'retrying'):
+					continue
+				return False
+			return True
+
+	def status(self) -> dict:
+		with self._lock:
+			models = {n: dict(m) for n, m in self._models.items()}
+		return {
+			"ready": self.ready(),
+			"finished": not any(m['state'] in IN_PROGRESS for m in models.values()),
+			"duration_ms": round((self.finished_at - self.started_at) * 1000.0, 1) if self.finished_at and self.started_at else None,
+			"warm_inference": self.warm_inference,
+			"loading": [n for n, m in models.items() if m['state'] in IN_PROGRESS],
+			"failed": [n for n, m in models.items() if m['state'] == 'failed'],
+			"optional": list(self.optional),
+			"models": models,
+		}
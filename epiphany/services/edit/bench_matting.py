@@ -0,0 +1,62 @@
+import argparse
+import json
+import time
+
+import numpy as np
+from PIL import Image
+
+import matting
+
+
+def legacy_threshold(im: Image.Image) -> Image.Image:
+	# Previous /remove-bg fallback: interpreted loop over every pixel
+	px = im.load()
+	for y in range(im.height):
+		for x in range(im.width):
+			r, g, b, a = px[x, y]
+			if r < 20 and g < 20 and b < 20:
+				px[x, y] = (r, g, b, 0)
+	return im
+
+
+def vectorized_threshold(im: Image.Image) -> Image.Image:
+	return matting.to_image(matting.threshold_key(matting.rgba_array(im)))
+
+
+def vectorized_color(im: Image.Image) -> Image.Image:
+	return matting.to_image(matting.feather(matting.distance_key(matting.rgba_array(im)), 2))
+
+
+def timed(fn, im: Image.Image, repeat: int) -> float:
+	best = float('inf')
+	for _ in range(repeat):
+		src = im.copy()
+		t0 = time.perf_counter()
+		fn(src)
+		best = min(best, time.perf_counter() - t0)
+	return best * 1000.0
+
+
+def main():
+	ap = argparse.ArgumentParser(description="edit background-removal fallback: per-pixel loop vs NumPy keying")
+	ap.add_argument('--sizes', default='256,512,1024,2048')
+	ap.add_argument('--repeat', type=int, default=3)
+	ap.add_argument('--skip-legacy-above', type=int, default=2048, help='skip the per-pixel loop for larger sizes')
+	args = ap.parse_args()
+	rng = np.random.default_rng(0)
+	for size in [int(s) for s in args.sizes.split(',')]:
+		arr = rng.integers(0, 255, (size, size, 4), dtype=np.uint8)
+		arr[: size // 4] = (5, 5, 5, 255)  # dark band so the key has work to do
+		im = Image.fromarray(arr, 'RGBA')
+		row = {"size": size}
+		if size <= args.skip_legacy_above:
+			row["per_pixel_ms"] = round(timed(legacy_threshold, im, 1), 1)
+		row["threshold_ms"] = round(timed(vectorized_threshold, im, args.repeat), 1)
+		row["color_feather_ms"] = round(timed(vectorized_color, im, args.repeat), 1)
+		if "per_pixel_ms" in row:
+			row["threshold_speedup"] = round(row["per_pixel_ms"] / max(1e-3, row["threshold_ms"]), 1)
+		print(json.dumps(row))
+
+
+if __name__ == '__main__':
+	main()
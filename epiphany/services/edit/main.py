@@ -1,23 +1,39 @@
-﻿from fastapi import FastAPI, Request
+﻿from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
 import os
+import asyncio
 import boto3
 from io import BytesIO
-from PIL import Image, ImageFilter, ImageEnhance
+from PIL import Image, ImageEnhance
 import hashlib
 import random
-import base64
 from typing import Tuple
-import requests
+from botocore.config import Config
+from common.executor import BoundedExecutor
+from common.fetch import Fetcher
+from common.metrics import CONTENT_TYPE, Metrics, label, stage, timed
+from common.profiling import Profiler
+from common.warmup import Warmup
+from model_pool import ModelPool
+from tiling import process_tiled
+import matting
+from pipeline import PipelineError, run_steps, validate_intermediates, validate_steps
 
 app = FastAPI(title="Epiphany Edit")
 
+executor = BoundedExecutor.from_env('edit', workers=2, max_queue=8, io_workers=8)
+metrics = Metrics('edit')
+
 S3_ENDPOINT = os.getenv('S3_ENDPOINT', 'http://localhost:9000')
 S3_BUCKET = os.getenv('S3_BUCKET', 'epiphany-outputs')
 S3_REGION = os.getenv('S3_REGION', 'us-east-1')
 S3_ACCESS_KEY = os.getenv('S3_ACCESS_KEY', 'minioadmin')
 S3_SECRET_KEY = os.getenv('S3_SECRET_KEY', 'minioadmin')
 
-s3 = boto3.client('s3', endpoint_url=S3_ENDPOINT, aws_access_key_id=S3_ACCESS_KEY, aws_secret_access_key=S3_SECRET_KEY, region_name=S3_REGION)
+s3 = boto3.client('s3', endpoint_url=S3_ENDPOINT, aws_access_key_id=S3_ACCESS_KEY, aws_secret_access_key=S3_SECRET_KEY, region_name=S3_REGION, config=Config(max_pool_connections=executor.io_workers))
+
+# On-demand profiling (/debug/profile); off unless PROFILE_TOKEN is set
+profiler = Profiler.from_env('edit', s3, S3_BUCKET, S3_ENDPOINT)
 
 ALLOWED_URL_PREFIXES = [p.strip() for p in (os.getenv('ALLOWED_URL_PREFIXES') or '').split(',') if p.strip()]
 
@@ -35,9 +51,13 @@ def is_allowed_url(url: str) -> bool:
 			return True
 	return False
 
+# Pooled, cached input fetches shared by every edit endpoint
+fetcher = Fetcher.from_env(s3, S3_ENDPOINT, is_allowed_url, buckets=[S3_BUCKET], pool_size=executor.io_workers)
+
 def upload_png(key: str, buf: BytesIO) -> str:
 	buf.seek(0)
-	s3.put_object(Bucket=S3_BUCKET, Key=key, Body=buf.getvalue(), ContentType='image/png')
+	with stage('upload'):
+		s3.put_object(Bucket=S3_BUCKET, Key=key, Body=buf.getvalue(), ContentType='image/png')
 	return f"{S3_ENDPOINT}/{S3_BUCKET}/{key}"
 
 def make_image(width: int, height: int, color=(0,0,0)) -> BytesIO:
@@ -46,25 +66,24 @@ def make_image(width: int, height: int, color=(0,0,0)) -> BytesIO:
 	img.save(buf, format='PNG')
 	return buf
 
+def encode_png(im: Image.Image) -> BytesIO:
+	buf = BytesIO()
+	with stage('encode'):
+		im.convert('RGBA').save(buf, format='PNG')
+	return buf
+
 def image_meta(buf: BytesIO, width: int, height: int):
 	data = buf.getvalue()
-	sha256 = hashlib.sha256(data).hexdigest()
+	with stage('hash'):
+		sha256 = hashlib.sha256(data).hexdigest()
 	return {"width": width, "height": height, "bytes": len(data), "sha256": sha256}
 
 def fetch_image(url: str) -> Tuple[Image.Image, int, int]:
-	if url and url.startswith('data:image/') and ';base64,' in url:
-		head, b64 = url.split(',', 1)
-		raw = base64.b64decode(b64)
-		im = Image.open(BytesIO(raw)).convert('RGBA')
+	im = fetcher.fetch_image(url, 'RGBA')
+	if im is not None:
+		# The decoded image is shared through the fetch cache; ops below may mutate theirs
+		im = im.copy()
 		return im, im.width, im.height
-	if url and (url.startswith('http://') or url.startswith('https://')) and is_allowed_url(url):
-		try:
-			r = requests.get(url, timeout=10)
-			r.raise_for_status()
-			im = Image.open(BytesIO(r.content)).convert('RGBA')
-			return im, im.width, im.height
-		except Exception:
-			pass
 	# Placeholder: return a gray image
 	im = Image.new('RGBA', (512, 512), (64,64,64,255))
 	return im, im.width, im.height
@@ -72,7 +91,7 @@ def fetch_image(url: str) -> Tuple[Image.Image, int, int]:
 # Optional integrations
 _rembg_available = False
 try:
-	from rembg import remove as rembg_remove  # type: ignore
+	from rembg import new_session as rembg_new_session, remove as rembg_remove  # type: ignore
 	_rembg_available = True
 except Exception:
 	_rembg_available = False
@@ -97,119 +116,252 @@ try:
 except Exception:
 	_gfpgan_available = False
 
+def resolve_device() -> str:
+	device_env = os.getenv('TORCH_DEVICE', '').strip().lower()
+	if device_env in ('cuda','gpu') and 'CUDA_VISIBLE_DEVICES' not in os.environ:
+		os.environ['CUDA_VISIBLE_DEVICES'] = '0'
+	if device_env == 'cpu':
+		return 'cpu'
+	return 'cuda' if (device_env in ('cuda','gpu')) or ('CUDA_VISIBLE_DEVICES' in os.environ) or ('TORCH_CUDA' in os.environ) or (_realesrgan_available and torch.cuda.is_available()) else 'cpu'
+
+def build_realesrgan(scale: int):
+	if not _realesrgan_available:
+		raise RuntimeError('realesrgan not installed')
+	model = RealESRGAN(torch.device(resolve_device()), scale)
+	model.load_weights(os.path.join(REALESRGAN_WEIGHTS_DIR, f'RealESRGAN_x{scale}.pth'), download=True)
+	return model
+
+def build_gfpgan():
+	if not _gfpgan_available:
+		raise RuntimeError('gfpgan not installed')
+	resolve_device()
+	return GFPGANer(model_path=GFPGAN_MODEL_PATH, upscale=1, arch='clean', channel_multiplier=2, bg_upsampler=None)
+
+UPSCALE_TILE = int(os.getenv('UPSCALE_TILE', '512'))
+UPSCALE_TILE_OVERLAP = int(os.getenv('UPSCALE_TILE_OVERLAP', '16'))
+REALESRGAN_WEIGHTS_DIR = os.getenv('REALESRGAN_WEIGHTS_DIR', 'weights')
+REMBG_MODEL = os.getenv('REMBG_MODEL', 'u2net')
+GFPGAN_MODEL_PATH = os.getenv('GFPGAN_MODEL_PATH', 'https://github.com/TencentARC/GFPGAN/releases/download/v1.3.0/GFPGANv1.4.pth')
+
+# Upscalers and face restorer stay resident once loaded; EDIT_PRELOAD warms them at startup
+models = ModelPool({
+	'realesrgan-x2': lambda: build_realesrgan(2),
+	'realesrgan-x4': lambda: build_realesrgan(4),
+	'gfpgan': build_gfpgan,
+	'rembg': lambda: rembg_new_session(REMBG_MODEL),
+})
+
+def warm_gfpgan(restorer):
+	import numpy as np
+	restorer.enhance(np.zeros((64, 64, 3), dtype=np.uint8), has_aligned=False, only_center_face=False, paste_back=True)
+
+# One tile-sized pass per model so device setup and autotuning happen before the first request
+warmup = Warmup.from_env({name: (lambda name=name: models.get(name, force=True)) for name in models.builders}, {
+	'realesrgan-x2': lambda model: model.predict(Image.new('RGB', (64, 64))),
+	'realesrgan-x4': lambda model: model.predict(Image.new('RGB', (64, 64))),
+	'gfpgan': warm_gfpgan,
+	'rembg': lambda session: rembg_remove(Image.new('RGBA', (64, 64)), session=session),
+}, default=os.getenv('EDIT_PRELOAD', ''))
+
+@app.on_event('startup')
+async def preload_models():
+	if warmup.names:
+		# Loads in the background so /health answers while weights download
+		asyncio.ensure_future(warmup.serve(executor.run))
+
+@app.get('/ready')
+async def ready():
+	status = warmup.status()
+	return JSONResponse(status, status_code=200 if status['ready'] else 503)
+
+@app.post('/debug/profile')
+async def debug_profile(request: Request):
+	return await profiler.post(request, executor.io)
+
+@app.get('/debug/profile')
+async def debug_profile_status(request: Request):
+	return profiler.get(request)
+
+@app.get('/metrics')
+async def metrics_endpoint():
+	return Response(metrics.render(), media_type=CONTENT_TYPE)
+
 @app.get('/health')
 async def health():
-	return {"ok": True}
+	return {"ok": True, "executor": executor.stats(), "models": models.stats(), "tiling": {"tile": UPSCALE_TILE, "overlap": UPSCALE_TILE_OVERLAP}, "fetch": fetcher.stats(), "warmup": warmup.status()}
+
+def upscale_image(im: Image.Image, scale: int) -> tuple[Image.Image, dict]:
+	model = models.get(f'realesrgan-x{scale}') if _realesrgan_available and scale in (2,4) else None
+	if model is not None:
+		try:
+			predict = getattr(model, 'predict', None) or getattr(model, 'enhance')
+			res, tiles = process_tiled(im.convert('RGB'), predict, scale, UPSCALE_TILE, UPSCALE_TILE_OVERLAP)
+			return res.convert('RGBA'), {"model": f'realesrgan-x{scale}', "tiles": tiles, "tile": UPSCALE_TILE}
+		except Exception:
+			pass
+	w, h = im.width, im.height
+	return im.resize((max(1, w*scale), max(1, h*scale)), resample=Image.Resampling.LANCZOS), {"model": "lanczos", "tiles": 0, "tile": UPSCALE_TILE}
 
 @app.post('/upscale')
+@executor.admitted_handler
+@metrics.instrument('upscale')
 async def upscale(request: Request):
 	body = await request.json()
 	image_url = body.get('imageUrl')
 	scale = int(body.get('scale', 2))
-	im, w, h = fetch_image(image_url or '')
+	im, w, h = await executor.io(fetch_image, image_url or '')
 	new_w, new_h = max(1, w*scale), max(1, h*scale)
-	res = im.resize((new_w, new_h), resample=Image.Resampling.LANCZOS)
-	# Try RealESRGAN if available and scale is 4
-	if _realesrgan_available and scale in (2,4):
+	res, info = await executor.run(timed, 'inference', upscale_image, im, scale)
+	label(model=info['model'], resolution=f"{w}x{h}")
+	buf = await executor.run(encode_png, res)
+	key = f"edit/upscale_{random.randint(0,1_000_000)}.png"
+	url = await executor.io(upload_png, key, buf)
+	return {"output_url": url, "image_meta": image_meta(buf, new_w, new_h), "echo": info}
+
+def restore_face_image(im: Image.Image) -> Image.Image:
+	res = ImageEnhance.Contrast(ImageEnhance.Sharpness(im).enhance(1.5)).enhance(1.1)
+	# Try GFPGAN if available (it works on BGR arrays and restores detected faces in place)
+	restorer = models.get('gfpgan') if _gfpgan_available else None
+	if restorer is not None:
 		try:
-			device_env = os.getenv('TORCH_DEVICE', '').strip().lower()
-			if device_env in ('cuda','gpu') and 'CUDA_VISIBLE_DEVICES' not in os.environ:
-				os.environ['CUDA_VISIBLE_DEVICES'] = '0'
-			device = 'cuda' if (device_env in ('cuda','gpu')) or ('CUDA_VISIBLE_DEVICES' in os.environ) or ('TORCH_CUDA' in os.environ) or (hasattr(torch, 'cuda') and torch.cuda.is_available()) else 'cpu'
-			model = RealESRGAN(torch.device(device), scale)
-			# model weights load is environment-dependent; guard with try/except
-			try:
-				model.load_weights('weights/RealESRGAN_x4plus.pth', download=True)
-			except Exception:
-				pass
-			res = model.enhance(im.convert('RGB'))[0].convert('RGBA')
+			import numpy as np
+			bgr = np.ascontiguousarray(np.asarray(im.convert('RGB'))[:, :, ::-1])
+			_, _, restored = restorer.enhance(bgr, has_aligned=False, only_center_face=False, paste_back=True)
+			if restored is not None:
+				res = Image.fromarray(np.ascontiguousarray(restored[:, :, ::-1])).convert('RGBA')
 		except Exception:
 			pass
-	buf = BytesIO(); res.convert('RGBA').save(buf, format='PNG')
-	key = f"edit/upscale_{random.randint(0,1_000_000)}.png"
-	url = upload_png(key, buf)
-	return {"output_url": url, "image_meta": image_meta(buf, new_w, new_h)}
+	return res
 
 @app.post('/restore-face')
+@executor.admitted_handler
+@metrics.instrument('restore-face')
 async def restore_face(request: Request):
 	body = await request.json()
 	image_url = body.get('imageUrl')
-	im, w, h = fetch_image(image_url or '')
-	res = ImageEnhance.Contrast(ImageEnhance.Sharpness(im).enhance(1.5)).enhance(1.1)
-	# Try GFPGAN if available
-	if _gfpgan_available:
-		try:
-			device_env = os.getenv('TORCH_DEVICE', '').strip().lower()
-			if device_env in ('cuda','gpu') and 'CUDA_VISIBLE_DEVICES' not in os.environ:
-				os.environ['CUDA_VISIBLE_DEVICES'] = '0'
-			restorer = GFPGANer(model_path=None, upscale=1, arch='clean', channel_multiplier=2, bg_upsampler=None)
-			_, _, restored = restorer.enhance(im.convert('RGB'), has_aligned=False, only_center_face=False, paste_back=True)
-			res = restored.convert('RGBA') if hasattr(restored, 'convert') else res
-		except Exception:
-			pass
-	buf = BytesIO(); res.convert('RGBA').save(buf, format='PNG')
+	im, w, h = await executor.io(fetch_image, image_url or '')
+	label(model='gfpgan' if _gfpgan_available else 'enhance', resolution=f"{w}x{h}")
+	res = await executor.run(timed, 'inference', restore_face_image, im)
+	buf = await executor.run(encode_png, res)
 	key = f"edit/restore_{random.randint(0,1_000_000)}.png"
-	url = upload_png(key, buf)
+	url = await executor.io(upload_png, key, buf)
 	return {"output_url": url, "image_meta": image_meta(buf, w, h)}
 
+def remove_background(im: Image.Image, method: str = 'auto', threshold: int = 20, tolerance: float = 40.0, softness: float = 20.0, feather_radius: int = 0) -> tuple[Image.Image, str]:
+	# rembg (resident session) when available; otherwise, or if it fails, NumPy keying
+	used = None
+	if method in ('auto', 'rembg') and _rembg_available:
+		session = models.get('rembg')
+		if session is not None:
+			try:
+				removed = rembg_remove(im.convert('RGBA'), session=session)
+				if isinstance(removed, Image.Image):
+					im, used = removed, 'rembg'
+			except Exception:
+				pass
+	arr = matting.rgba_array(im)
+	if used is None:
+		if method == 'color':
+			matting.distance_key(arr, tolerance=tolerance, softness=softness)
+			used = 'color'
+		else:
+			# fallback heuristic for dark bg
+			matting.threshold_key(arr, threshold)
+			used = 'threshold'
+	matting.feather(arr, feather_radius)
+	return matting.to_image(arr), used
+
+def remove_bg_op(im: Image.Image, params: dict) -> tuple[Image.Image, dict]:
+	res, used = remove_background(im, str(params.get('method') or 'auto'), int(params.get('threshold', 20)), float(params.get('tolerance', 40)), float(params.get('softness', 20)), max(0, min(16, int(params.get('feather', 0)))))
+	return res, {"method": used}
+
 @app.post('/remove-bg')
+@executor.admitted_handler
+@metrics.instrument('remove-bg')
 async def remove_bg(request: Request):
 	body = await request.json()
 	image_url = body.get('imageUrl')
-	im, w, h = fetch_image(image_url or '')
-	if _rembg_available:
-		try:
-			rgba = im.convert('RGBA')
-			removed = rembg_remove(rgba)
-			im = removed if isinstance(removed, Image.Image) else rgba
-		except Exception:
-			# fallback heuristic for dark bg
-			px = im.load()
-			for y in range(im.height):
-				for x in range(im.width):
-					r,g,b,a = px[x,y]
-					if r < 20 and g < 20 and b < 20: px[x,y] = (r,g,b,0)
-	else:
-		px = im.load()
-		for y in range(im.height):
-			for x in range(im.width):
-				r,g,b,a = px[x,y]
-				if r < 20 and g < 20 and b < 20: px[x,y] = (r,g,b,0)
-	buf_out = BytesIO(); im.save(buf_out, format='PNG')
+	im, w, h = await executor.io(fetch_image, image_url or '')
+	im, info = await executor.run(timed, 'inference', remove_bg_op, im, body)
+	label(model=info['method'], resolution=f"{w}x{h}")
+	buf_out = await executor.run(encode_png, im)
 	key = f"edit/nobg_{random.randint(0,1_000_000)}.png"
-	url = upload_png(key, buf_out)
-	return {"output_url": url, "image_meta": image_meta(buf_out, w, h)}
+	url = await executor.io(upload_png, key, buf_out)
+	return {"output_url": url, "image_meta": image_meta(buf_out, w, h), "echo": info}
+
+def crop_image(im: Image.Image, x: int, y: int, w: int, h: int) -> Image.Image:
+	iw, ih = im.width, im.height
+	x2, y2 = max(0, min(iw, x+w)), max(0, min(ih, y+h))
+	x1, y1 = max(0, min(iw, x)), max(0, min(ih, y))
+	if x2 <= x1 or y2 <= y1:
+		return im
+	return im.crop((x1, y1, x2, y2))
 
 @app.post('/crop')
+@executor.admitted_handler
+@metrics.instrument('crop')
 async def crop(request: Request):
 	body = await request.json()
 	image_url = body.get('imageUrl')
 	x = int(body.get('x', 0)); y = int(body.get('y', 0)); w = int(body.get('w', 0)); h = int(body.get('h', 0))
-	im, iw, ih = fetch_image(image_url or '')
-	x2, y2 = max(0, min(iw, x+w)), max(0, min(ih, y+h))
-	x1, y1 = max(0, min(iw, x)), max(0, min(ih, y))
-	if x2 <= x1 or y2 <= y1:
-		res = im
-	else:
-		res = im.crop((x1, y1, x2, y2))
-	buf = BytesIO(); res.convert('RGBA').save(buf, format='PNG')
+	im, iw, ih = await executor.io(fetch_image, image_url or '')
+	label(resolution=f"{iw}x{ih}")
+	res = crop_image(im, x, y, w, h)
+	buf = await executor.run(encode_png, res)
 	key = f"edit/crop_{random.randint(0,1_000_000)}.png"
-	url = upload_png(key, buf)
+	url = await executor.io(upload_png, key, buf)
 	return {"output_url": url, "image_meta": image_meta(buf, res.width, res.height)}
 
 @app.post('/resize')
+@executor.admitted_handler
+@metrics.instrument('resize')
 async def resize(request: Request):
 	body = await request.json()
 	image_url = body.get('imageUrl')
 	width = max(1, int(body.get('width', 0)))
 	height = max(1, int(body.get('height', 0)))
-	im, iw, ih = fetch_image(image_url or '')
-	res = im.resize((width, height), resample=Image.Resampling.LANCZOS)
-	buf = BytesIO(); res.convert('RGBA').save(buf, format='PNG')
+	im, iw, ih = await executor.io(fetch_image, image_url or '')
+	label(resolution=f"{iw}x{ih}")
+	res = await executor.run(timed, 'inference', im.resize, (width, height), resample=Image.Resampling.LANCZOS)
+	buf = await executor.run(encode_png, res)
 	key = f"edit/resize_{random.randint(0,1_000_000)}.png"
-	url = upload_png(key, buf)
+	url = await executor.io(upload_png, key, buf)
 	return {"output_url": url, "image_meta": image_meta(buf, width, height)}
 
+# Pipeline ops: (image, step params) -> (image, info), same defaults as the single-op endpoints
+PIPELINE_OPS = {
+	'crop': lambda im, p: (crop_image(im, int(p.get('x', 0)), int(p.get('y', 0)), int(p.get('w', 0)), int(p.get('h', 0))), {}),
+	'resize': lambda im, p: (im.resize((max(1, int(p.get('width', im.width))), max(1, int(p.get('height', im.height)))), resample=Image.Resampling.LANCZOS), {}),
+	'upscale': lambda im, p: upscale_image(im, int(p.get('scale', 2))),
+	'restore-face': lambda im, p: (restore_face_image(im), {}),
+	'remove-bg': lambda im, p: remove_bg_op(im, p),
+}
+
+async def upload_result(prefix: str, im: Image.Image) -> tuple[str, BytesIO]:
+	buf = await executor.run(encode_png, im)
+	key = f"edit/{prefix}_{random.randint(0,1_000_000)}.png"
+	return await executor.io(upload_png, key, buf), buf
+
+@app.post('/pipeline')
+@executor.admitted_handler
+@metrics.instrument('pipeline')
+async def pipeline(request: Request):
+	# One fetch/decode, every op on the in-memory image, one encode/upload of the result
+	body = await request.json()
+	try:
+		steps = validate_steps(body.get('steps'), PIPELINE_OPS)
+		keep = validate_intermediates(body.get('intermediates'), len(steps))
+	except PipelineError as e:
+		raise HTTPException(status_code=400, detail=str(e))
+	im, w, h = await executor.io(fetch_image, body.get('imageUrl') or '')
+	label(model='+'.join(s['op'] for s in steps), resolution=f"{w}x{h}")
+	res, steps_timing, kept = await executor.run(timed, 'inference', run_steps, im, steps, PIPELINE_OPS, keep)
+	outputs = await asyncio.gather(upload_result('pipeline', res), *(upload_result(f"pipeline_step{i}", kept[i]) for i in sorted(kept)))
+	(url, buf), rest = outputs[0], outputs[1:]
+	intermediates = [{"step": i, "op": steps[i]['op'], "output_url": u, "image_meta": image_meta(b, kept[i].width, kept[i].height)} for i, (u, b) in zip(sorted(kept), rest)]
+	# Per-op times; the shared stage breakdown is added alongside by metrics.instrument
+	return {"output_url": url, "image_meta": image_meta(buf, res.width, res.height), "intermediates": intermediates, "timings": {"ops": steps_timing}}
+
 @app.post('/caption')
 async def caption(request: Request):
 	body = await request.json()
@@ -0,0 +1,80 @@
+import numpy as np
+from PIL import Image
+
+# Alpha operations over one RGBA array: rgb and alpha below are views into that array, so
+# keying writes straight into the buffer that is handed back to PIL without another copy.
+
+
+def rgba_array(im: Image.Image) -> np.ndarray:
+	# One writable HxWx4 copy of the decoded image; everything else works on views of it
+	return np.array(im.convert('RGBA'), dtype=np.uint8)
+
+
+def to_image(arr: np.ndarray) -> Image.Image:
+	# Shares arr's memory (no copy); keep arr alive as long as the image
+	h, w = arr.shape[:2]
+	return Image.frombuffer('RGBA', (w, h), arr, 'raw', 'RGBA', 0, 1)
+
+
+def threshold_key(arr: np.ndarray, max_value: int = 20) -> np.ndarray:
+	# Legacy dark-background key: pixels with every channel below max_value become transparent
+	# max over the channel views is far cheaper than .all() across the strided last axis
+	brightest = np.maximum(np.maximum(arr[..., 0], arr[..., 1]), arr[..., 2])
+	np.copyto(arr[..., 3], 0, where=brightest < max_value)
+	return arr
+
+
+def border_color(arr: np.ndarray, width: int = 4) -> np.ndarray:
+	# Median of the outer frame of pixels; robust to a subject touching one edge
+	h, w = arr.shape[:2]
+	width = max(1, min(width, h // 2 or 1, w // 2 or 1))
+	rgb = arr[..., :3]
+	edge = np.concatenate([
+		rgb[:width].reshape(-1, 3), rgb[-width:].reshape(-1, 3),
+		rgb[:, :width].reshape(-1, 3), rgb[:, -width:].reshape(-1, 3),
+	])
+	return np.median(edge, axis=0)
+
+
+def distance_key(arr: np.ndarray, color=None, tolerance: float = 40.0, softness: float = 20.0) -> np.ndarray:
+	# Pixels within `tolerance` (RGB euclidean) of the key colour go transparent, ramping back
+	# to opaque over `softness`; existing alpha is only ever reduced
+	key = border_color(arr) if color is None else np.asarray(color, dtype=np.float32)[:3]
+	# Accumulated per channel plane: contiguous float32 temporaries instead of an HxWx3 one
+	dist = np.zeros(arr.shape[:2], dtype=np.float32)
+	for c in range(3):
+		d = arr[..., c].astype(np.float32)
+		d -= np.float32(key[c])
+		d *= d
+		dist += d
+	np.sqrt(dist, out=dist)
+	dist -= np.float32(tolerance)
+	dist *= np.float32(255.0 / max(1e-6, softness))
+	np.clip(dist, 0.0, 255.0, out=dist)
+	alpha = arr[..., 3]
+	np.minimum(alpha, (dist + 0.5).astype(np.uint8), out=alpha)
+	return arr
+
+
+def _box_blur(a: np.ndarray, r: int, axis: int) -> np.ndarray:
+	# Sum of 2r+1 shifted views of an edge-padded copy; uint16 holds 255 * 33 for r <= 16
+	n = a.shape[axis]
+	padded = np.take(a, np.clip(np.arange(-r, n + r), 0, n - 1), axis=axis)
+	out = np.zeros(a.shape, dtype=np.uint16)
+	for k in range(2 * r + 1):
+		out += padded[k:k + n] if axis == 0 else padded[:, k:k + n]
+	out += r  # round to nearest on the divide
+	out //= 2 * r + 1
+	return out
+
+
+def feather(arr: np.ndarray, radius: int = 2) -> np.ndarray:
+	# Softens alpha edges: two separable box passes approximate a gaussian of ~radius
+	radius = min(int(radius), 16)
+	if radius <= 0:
+		return arr
+	a = arr[..., 3].astype(np.uint16)
+	for _ in range(2):
+		a = _box_blur(_box_blur(a, radius, 0), radius, 1)
+	arr[..., 3] = a
+	return arr
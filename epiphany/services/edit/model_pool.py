@@ -0,0 +1,67 @@
+import threading
+import time
+from typing import Any, Callable
+
+from common.metrics import stage
+
+
+class ModelPool:
+	# Named, process-wide model instances (RealESRGAN x2/x4, GFPGAN) built once on first use
+	# or at startup by the warmup, then shared by every request. A builder that fails is not
+	# retried on every request: requests skip it until retry_at, which backs off from
+	# retry_delay (doubling, capped at max_retry_delay) on each further failure. The warmup
+	# retries with force=True, which ignores the backoff.
+	def __init__(self, builders: dict[str, Callable[[], Any]], retry_delay: float = 30.0, max_retry_delay: float = 600.0):
+		self.builders = dict(builders)
+		self.retry_delay = max(0.0, float(retry_delay))
+		self.max_retry_delay = max(self.retry_delay, float(max_retry_delay))
+		self._models: dict[str, Any] = {}
+		self._failed: dict[str, dict] = {}
+		self._locks = {name: threading.Lock() for name in self.builders}
+		self.loads = {name: 0 for name in self.builders}
+		self.load_ms = {name: 0.0 for name in self.builders}
+		self.hits = {name: 0 for name in self.builders}
+
+	def _backing_off(self, name: str) -> bool:
+		failed = self._failed.get(name)
+		return failed is not None and time.monotonic() < failed['retry_at']
+
+	def get(self, name: str, force: bool = False) -> Any | None:
+		model = self._models.get(name)
+		if model is not None:
+			self.hits[name] += 1
+			return model
+		if name not in self.builders or (not force and self._backing_off(name)):
+			return None
+		with self._locks[name]:
+			model = self._models.get(name)
+			if model is None and (force or not self._backing_off(name)):
+				t0 = time.perf_counter()
+				try:
+					with stage('model_load'):
+						model = self.builders[name]()
+				except Exception as e:
+					failures = self._failed.get(name, {}).get('failures', 0) + 1
+					delay = min(self.retry_delay * 2 ** (failures - 1), self.max_retry_delay)
+					self._failed[name] = {"error": str(e)[:200], "failures": failures, "retry_at": time.monotonic() + delay}
+					return None
+				self.loads[name] += 1
+				self.load_ms[name] = (time.perf_counter() - t0) * 1000.0
+				self._models[name] = model
+				self._failed.pop(name, None)
+			return model
+
+	def stats(self) -> dict:
+		return {
+			name: {
+				"loaded": name in self._models,
+				"loads": self.loads[name],
+				"load_ms": round(self.load_ms[name], 1),
+				"hits": self.hits[name],
+				"error": self._failed.get(name, {}).get('error'),
+				"failures": self._failed.get(name, {}).get('failures', 0),
+				"retry_in_s": round(max(0.0, self._failed[name]['retry_at'] - time.monotonic()), 1) if name in self._failed else None,
+			}
+			for name in self.builders
+		}
+
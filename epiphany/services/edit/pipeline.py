@@ -0,0 +1,52 @@
+import time
+from typing import Any, Callable
+
+from PIL import Image
+
+# op(image, params) -> (image, info); info is merged into that step's timing entry
+Op = Callable[[Image.Image, dict], tuple[Image.Image, dict]]
+
+MAX_STEPS = 16
+
+
+class PipelineError(ValueError):
+	pass
+
+
+def validate_steps(steps: Any, ops: dict[str, Op]) -> list[dict]:
+	if not isinstance(steps, list) or not steps:
+		raise PipelineError('steps must be a non-empty list')
+	if len(steps) > MAX_STEPS:
+		raise PipelineError(f'at most {MAX_STEPS} steps')
+	out = []
+	for i, step in enumerate(steps):
+		if not isinstance(step, dict) or step.get('op') not in ops:
+			raise PipelineError(f"step {i}: unknown op {step.get('op') if isinstance(step, dict) else step!r}; expected one of {sorted(ops)}")
+		out.append(step)
+	return out
+
+
+def validate_intermediates(inter: Any, count: int) -> set[int]:
+	# `true` keeps every step but the last, a list keeps those step indexes (out of range
+	# ones are ignored); anything else keeps none
+	if inter is True:
+		return set(range(count - 1))
+	if not inter:
+		return set()
+	if not isinstance(inter, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in inter):
+		raise PipelineError('intermediates must be true or a list of step indexes')
+	return {i for i in inter if 0 <= i < count - 1}
+
+
+def run_steps(im: Image.Image, steps: list[dict], ops: dict[str, Op], keep: set[int] | None = None) -> tuple[Image.Image, list[dict], dict[int, Image.Image]]:
+	# Applies every step to the same in-memory image: no encode/decode between steps.
+	# Images after the steps listed in `keep` are returned for optional intermediate uploads.
+	timings: list[dict] = []
+	kept: dict[int, Image.Image] = {}
+	for i, step in enumerate(steps):
+		t0 = time.perf_counter()
+		im, info = ops[step['op']](im, step)
+		timings.append({"op": step['op'], "ms": round((time.perf_counter() - t0) * 1000.0, 2), "width": im.width, "height": im.height, **(info or {})})
+		if keep and i in keep:
+			kept[i] = im
+	return im, timings, kept
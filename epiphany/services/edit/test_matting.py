@@ -0,0 +1,30 @@
+import numpy as np
+from PIL import Image
+
+import matting
+from bench_matting import legacy_threshold
+
+
+def test_threshold_key_matches_per_pixel_loop():
+	rng = np.random.default_rng(1)
+	im = Image.fromarray(rng.integers(0, 40, (24, 32, 4), dtype=np.uint8), 'RGBA')
+	expected = np.asarray(legacy_threshold(im.copy()))
+	arr = matting.rgba_array(im)
+	out = matting.to_image(matting.threshold_key(arr))
+	assert np.array_equal(np.asarray(out), expected)
+	arr[0, 0, 3] = 7  # the returned image is a view of the same buffer
+	assert out.getpixel((0, 0))[3] == 7
+
+
+def test_color_key_uses_border_colour_and_feathers_edges():
+	arr = np.zeros((40, 40, 4), dtype=np.uint8)
+	arr[...] = (0, 200, 0, 255)  # green screen
+	arr[10:30, 10:30] = (200, 50, 50, 255)
+	assert list(matting.border_color(arr)) == [0, 200, 0]
+	matting.distance_key(arr, tolerance=30, softness=10)
+	assert arr[0, 0, 3] == 0 and arr[20, 20, 3] == 255
+	matting.feather(arr, 2)
+	edge = arr[20, 5:15, 3]
+	assert edge[0] == 0 and edge[-1] == 255
+	assert (np.diff(edge.astype(int)) > 0).all()  # a ramp instead of a hard step at x=10
+	assert arr[0, 0, 3] == 0 and arr[20, 20, 3] == 255
@@ -0,0 +1,48 @@
+import threading
+import time
+
+from model_pool import ModelPool
+
+
+def test_models_load_once_and_failures_are_remembered():
+	built = []
+
+	def build():
+		built.append(1)
+		return object()
+
+	def broken():
+		built.append('x')
+		raise RuntimeError('no weights')
+
+	pool = ModelPool({'up': build, 'bad': broken})
+	threads = [threading.Thread(target=pool.get, args=('up',)) for _ in range(8)]
+	for t in threads:
+		t.start()
+	for t in threads:
+		t.join()
+	assert pool.get('up') is pool.get('up')
+	assert pool.get('bad') is None and pool.get('bad') is None
+	assert built == [1, 'x']
+	stats = pool.stats()
+	assert stats['up']['loads'] == 1 and stats['up']['hits'] >= 2
+	assert stats['bad']['error'] == 'no weights' and stats['bad']['failures'] == 1
+
+
+def test_failed_builds_are_retried_after_a_backoff_or_when_forced():
+	attempts = []
+
+	def flaky():
+		attempts.append(1)
+		if len(attempts) < 3:
+			raise TimeoutError('download timed out')
+		return object()
+
+	pool = ModelPool({'gfpgan': flaky}, retry_delay=0.05)
+	assert pool.get('gfpgan') is None and pool.get('gfpgan') is None and len(attempts) == 1
+	assert pool.get('gfpgan', force=True) is None and pool.stats()['gfpgan']['failures'] == 2
+	time.sleep(0.15)
+	model = pool.get('gfpgan')
+	assert model is not None and pool.get('gfpgan') is model and len(attempts) == 3
+	assert pool.stats()['gfpgan']['error'] is None
+
@@ -0,0 +1,32 @@
+import pytest
+from PIL import Image
+
+from pipeline import PipelineError, run_steps, validate_intermediates, validate_steps
+
+OPS = {
+	'crop': lambda im, p: (im.crop((0, 0, p['w'], p['h'])), {}),
+	'double': lambda im, p: (im.resize((im.width * 2, im.height * 2)), {"scale": 2}),
+}
+
+
+def test_steps_run_in_order_on_one_image():
+	steps = validate_steps([{'op': 'crop', 'w': 10, 'h': 8}, {'op': 'double'}, {'op': 'double'}], OPS)
+	res, timings, kept = run_steps(Image.new('RGB', (64, 64)), steps, OPS, keep={0})
+	assert res.size == (40, 32)
+	assert [t['op'] for t in timings] == ['crop', 'double', 'double']
+	assert timings[1]['width'] == 20 and timings[1]['scale'] == 2 and timings[0]['ms'] >= 0
+	assert list(kept) == [0] and kept[0].size == (10, 8)
+
+
+@pytest.mark.parametrize('steps', [None, [], [{'op': 'nope'}], ['crop'], [{'op': 'crop'}] * 17])
+def test_invalid_steps_are_rejected(steps):
+	with pytest.raises(PipelineError):
+		validate_steps(steps, OPS)
+
+
+def test_intermediates_are_validated():
+	assert validate_intermediates(True, 3) == {0, 1}
+	assert validate_intermediates([1, 5, -1], 3) == {1} and validate_intermediates(None, 3) == set()
+	for bad in (['a'], [None], [True], 'all'):
+		with pytest.raises(PipelineError):
+			validate_intermediates(bad, 3)
@@ -0,0 +1,20 @@
+import numpy as np
+from PIL import Image
+
+from tiling import process_tiled
+
+
+def test_tiled_result_matches_whole_image_pass():
+	rng = np.random.default_rng(0)
+	im = Image.fromarray(rng.integers(0, 255, (70, 90, 3), dtype=np.uint8))
+	up = lambda t: t.resize((t.width * 2, t.height * 2), Image.NEAREST)
+	res, tiles = process_tiled(im, up, 2, tile=32, overlap=4)
+	assert tiles == 9
+	assert res.size == (180, 140)
+	assert np.array_equal(np.asarray(res), np.asarray(up(im)))
+
+
+def test_small_images_skip_tiling():
+	im = Image.new('RGB', (16, 16))
+	res, tiles = process_tiled(im, lambda t: t.resize((64, 64)), 4, tile=32)
+	assert tiles == 1 and res.size == (64, 64)
@@ -0,0 +1,32 @@
+from typing import Callable, Iterator
+
+from PIL import Image
+
+
+def tile_boxes(width: int, height: int, tile: int) -> Iterator[tuple[int, int, int, int]]:
+	for y in range(0, height, tile):
+		for x in range(0, width, tile):
+			yield x, y, min(x + tile, width), min(y + tile, height)
+
+
+def process_tiled(im: Image.Image, fn: Callable[[Image.Image], Image.Image], scale: int, tile: int = 512, overlap: int = 16) -> tuple[Image.Image, int]:
+	# Runs fn (an x`scale` model) on tile-sized pieces padded by `overlap` pixels of real
+	# context on every side, then keeps only each piece's scaled core. Seams get the same
+	# neighbourhood the model would see on the whole image, and model memory is bounded by
+	# the tile size rather than the input size. Returns (result, tiles processed).
+	w, h = im.size
+	if tile <= 0 or (w <= tile and h <= tile):
+		return fn(im), 1
+	out = Image.new(im.mode, (w * scale, h * scale))
+	count = 0
+	for x0, y0, x1, y1 in tile_boxes(w, h, tile):
+		px0, py0 = max(0, x0 - overlap), max(0, y0 - overlap)
+		px1, py1 = min(w, x1 + overlap), min(h, y1 + overlap)
+		res = fn(im.crop((px0, py0, px1, py1)))
+		if res.mode != out.mode:
+			res = res.convert(out.mode)
+		left, top = (x0 - px0) * scale, (y0 - py0) * scale
+		core = res.crop((left, top, left + (x1 - x0) * scale, top + (y1 - y0) * scale))
+		out.paste(core, (x0 * scale, y0 * scale))
+		count += 1
+	return out, count
@@ -0,0 +1,95 @@
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+# Colormaps as 256-entry RGB lookup tables, interpolated from a handful of control points;
+# rendering is one normalize + one table gather over the whole field
+_STOPS = {
+	'inferno': [(0, 0, 4), (40, 11, 84), (101, 21, 110), (159, 42, 99), (212, 72, 66), (245, 125, 21), (250, 193, 39), (252, 255, 164)],
+	'viridis': [(68, 1, 84), (72, 40, 120), (62, 74, 137), (49, 104, 142), (38, 130, 142), (31, 158, 137), (53, 183, 121), (110, 206, 88), (181, 222, 43), (253, 231, 37)],
+	'jet': [(0, 0, 128), (0, 0, 255), (0, 128, 255), (0, 255, 255), (128, 255, 128), (255, 255, 0), (255, 128, 0), (255, 0, 0), (128, 0, 0)],
+	'gray': [(0, 0, 0), (255, 255, 255)],
+}
+
+
+def _lut(stops) -> np.ndarray:
+	stops = np.asarray(stops, dtype=np.float32)
+	x = np.linspace(0.0, 1.0, len(stops))
+	t = np.linspace(0.0, 1.0, 256)
+	return np.stack([np.interp(t, x, stops[:, c]) for c in range(3)], axis=-1).round().astype(np.uint8)
+
+
+COLORMAPS = {name: _lut(stops) for name, stops in _STOPS.items()}
+
+
+def fit_size(shape: tuple[int, int], size: int) -> tuple[int, int]:
+	# (width, height) with the long side at `size`, keeping the field's aspect ratio
+	h, w = shape
+	if w >= h:
+		return size, max(1, round(size * h / w))
+	return max(1, round(size * w / h)), size
+
+
+def colorize(field: np.ndarray, width: int, height: int, cmap: str = 'inferno') -> Image.Image:
+	return colorize_stack(np.asarray(field)[None], width, height, cmap)[0]
+
+
+def colorize_stack(fields: np.ndarray, width: int, height: int, cmap: str = 'inferno') -> list[Image.Image]:
+	# [n, h, w] fields at any resolution: bilinear resize of each in float ('F' mode), then one
+	# per-field normalize to 0..255 and one colormap gather across the whole stack
+	lut = COLORMAPS.get(cmap, COLORMAPS['inferno'])
+	fields = np.asarray(fields, dtype=np.float32)
+	n = fields.shape[0]
+	lo = fields.reshape(n, -1).min(axis=1)
+	hi = fields.reshape(n, -1).max(axis=1)
+	if fields.shape[1:] != (height, width):
+		out = np.empty((n, height, width), dtype=np.float32)
+		for i in range(n):
+			out[i] = np.asarray(Image.fromarray(np.ascontiguousarray(fields[i]), mode='F').resize((width, height), Image.BILINEAR), dtype=np.float32)
+	else:
+		out = fields.copy()
+	span = hi - lo
+	scale = np.divide(255.0, span, out=np.zeros_like(span), where=span > 0)
+	out -= lo[:, None, None]
+	out *= scale[:, None, None]
+	np.clip(out, 0.0, 255.0, out=out)
+	rgb = lut[out.astype(np.uint8)]
+	return [Image.fromarray(rgb[i], mode='RGB') for i in range(n)]
+
+
+def synthetic_heatmap(width: int = 256, height: int = 256) -> Image.Image:
+	# Placeholder used when a generation has no captured attention: the original radial
+	# emphasis over an x/y gradient, computed on index grids instead of per pixel
+	cx, cy = width / 2.0, height / 2.0
+	dx = (np.arange(width) - cx) / cx
+	dy = (np.arange(height) - cy) / cy
+	r = np.maximum(0.0, 255.0 * (1.0 - (dx[None, :] ** 2 + dy[:, None] ** 2))).astype(np.uint8) // 2
+	g = (np.arange(width) / max(1, width - 1) * 255.0).astype(np.uint8)
+	b = (np.arange(height) / max(1, height - 1) * 255.0).astype(np.uint8) // 2
+	out = np.empty((height, width, 3), dtype=np.uint8)
+	out[..., 0] = r
+	out[..., 1] = g[None, :]
+	out[..., 2] = b[:, None]
+	return Image.fromarray(out, mode='RGB')
+
+
+def load_maps(data: bytes) -> tuple[np.ndarray, list[str]]:
+	# attention/{id}.npz written by infer-image: maps [tokens, h, w] float16 plus token strings
+	with np.load(BytesIO(data), allow_pickle=False) as z:
+		return z['maps'].astype(np.float32), [str(t) for t in z['tokens']]
+
+
+def token_scores(maps: np.ndarray, tokens: list[str]) -> list[dict]:
+	# Share of total cross-attention mass per token, scaled so the strongest token is 1.0
+	mass = maps.reshape(len(tokens), -1).sum(axis=1)
+	top = float(mass.max()) if len(mass) else 0.0
+	return [{"token": t, "score": round(float(m) / top, 4) if top > 0 else 0.0} for t, m in zip(tokens, mass)]
+
+
+def encode_png(im: Image.Image) -> BytesIO:
+	# Level 1: about half the encode time of the default for ~3% larger files on smooth maps,
+	# which dominates render time once colorizing is vectorized
+	buf = BytesIO()
+	im.save(buf, format='PNG', compress_level=1)
+	return buf
@@ -1,50 +1,231 @@
-﻿from fastapi import FastAPI, Request
+﻿from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from starlette.background import BackgroundTask
 import os
+import json
+import asyncio
+import threading
+from collections import OrderedDict
 import boto3
 from io import BytesIO
-from PIL import Image
+from botocore.config import Config
+from common.executor import BoundedExecutor
+from common.metrics import CONTENT_TYPE, Metrics, label, stage, timed
+from common.profiling import Profiler
+import numpy as np
+import heatmap
 
 app = FastAPI(title="Epiphany Explain")
 
+executor = BoundedExecutor.from_env('explain', workers=2, max_queue=16, io_workers=8)
+metrics = Metrics('explain')
+
 S3_ENDPOINT = os.getenv('S3_ENDPOINT', 'http://localhost:9000')
 S3_BUCKET = os.getenv('S3_BUCKET', 'epiphany-explain')
 S3_REGION = os.getenv('S3_REGION', 'us-east-1')
 S3_ACCESS_KEY = os.getenv('S3_ACCESS_KEY', 'minioadmin')
 S3_SECRET_KEY = os.getenv('S3_SECRET_KEY', 'minioadmin')
+# infer-image writes captured cross-attention to attention/{generationId}.npz in its bucket
+ATTENTION_MAPS_BUCKET = os.getenv('ATTENTION_MAPS_BUCKET', 'epiphany-outputs')
+ATTENTION_MAX_TOKENS = int(os.getenv('ATTENTION_MAX_TOKENS', '16'))
+ATTENTION_CACHE_MAX_ENTRIES = int(os.getenv('ATTENTION_CACHE_MAX_ENTRIES', '1024'))
+EXPLAIN_BATCH_MAX = int(os.getenv('EXPLAIN_BATCH_MAX', '500'))
+EXPLAIN_BATCH_CHUNK = int(os.getenv('EXPLAIN_BATCH_CHUNK', '32'))
+
+s3 = boto3.client('s3', endpoint_url=S3_ENDPOINT, aws_access_key_id=S3_ACCESS_KEY, aws_secret_access_key=S3_SECRET_KEY, region_name=S3_REGION, config=Config(max_pool_connections=executor.io_workers))
+
+# On-demand profiling (/debug/profile); off unless PROFILE_TOKEN is set
+profiler = Profiler.from_env('explain', s3, S3_BUCKET, S3_ENDPOINT)
+
+# Rendered heatmap sets by (id, size, cmap); the S3 manifest next to them covers restarts and
+# other replicas, so a generation is rendered and uploaded once
+_rendered: 'OrderedDict[tuple, dict]' = OrderedDict()
+_rendered_lock = threading.Lock()
+_counters = {"hits": 0, "s3_hits": 0, "rendered": 0, "synthetic": 0}
+
+def remember(key: tuple, result: dict) -> dict:
+	with _rendered_lock:
+		_rendered[key] = result
+		_rendered.move_to_end(key)
+		while len(_rendered) > ATTENTION_CACHE_MAX_ENTRIES:
+			_rendered.popitem(last=False)
+	return result
 
-s3 = boto3.client('s3', endpoint_url=S3_ENDPOINT, aws_access_key_id=S3_ACCESS_KEY, aws_secret_access_key=S3_SECRET_KEY, region_name=S3_REGION)
+def recall(key: tuple) -> dict | None:
+	with _rendered_lock:
+		result = _rendered.get(key)
+		if result is not None:
+			_rendered.move_to_end(key)
+			_counters["hits"] += 1
+		return result
+
+@app.post('/debug/profile')
+async def debug_profile(request: Request):
+	return await profiler.post(request, executor.io)
+
+@app.get('/debug/profile')
+async def debug_profile_status(request: Request):
+	return profiler.get(request)
+
+@app.get('/metrics')
+async def metrics_endpoint():
+	return Response(metrics.render(), media_type=CONTENT_TYPE)
 
 @app.get('/health')
 async def health():
-	return {"ok": True}
+	return {"ok": True, "executor": executor.stats(), "attention": {**_counters, "entries": len(_rendered)}}
+
+def upload_png(key: str, buf: BytesIO) -> str:
+	with stage('upload'):
+		s3.put_object(Bucket=S3_BUCKET, Key=key, Body=buf.getvalue(), ContentType='image/png')
+	return f"{S3_ENDPOINT}/{S3_BUCKET}/{key}"
+
+def read_object(bucket: str, key: str) -> bytes | None:
+	try:
+		with stage('fetch'):
+			return s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+	except Exception:
+		return None
+
+def load_attention(id: str) -> tuple | None:
+	data = read_object(ATTENTION_MAPS_BUCKET, f"attention/{id}.npz")
+	if data is None:
+		return None
+	try:
+		with stage('decode'):
+			return heatmap.load_maps(data)
+	except Exception:
+		return None
+
+def prompt_scores(prompt: str) -> list[dict]:
+	# Positional placeholder scores for generations without captured attention
+	toks = [t for t in (prompt or '').strip().split() if t] or ['prompt']
+	return [{"token": t, "score": max(0.1, 1.0 - (i*0.1))} for i, t in enumerate(toks)]
+
+def render_batch(loaded: list[tuple], size: int, cmap: str) -> list[list[BytesIO]]:
+	# Per item: the mean over tokens first (the overlay the UI shows), then one map per token.
+	# Items whose maps share a grid are colorized as one stack.
+	fields: list[list] = []
+	groups: dict[tuple, list[int]] = {}
+	for i, (maps, tokens) in enumerate(loaded):
+		fields.append([maps.mean(axis=0)] + [maps[j] for j in range(min(len(tokens), ATTENTION_MAX_TOKENS))])
+		groups.setdefault(maps.shape[1:], []).append(i)
+	out: list[list[BytesIO]] = [[] for _ in loaded]
+	for shape, members in groups.items():
+		w, h = heatmap.fit_size(shape, size)
+		with stage('render'):
+			images = iter(heatmap.colorize_stack(np.stack([f for i in members for f in fields[i]]), w, h, cmap))
+		with stage('encode'):
+			for i in members:
+				out[i] = [heatmap.encode_png(next(images)) for _ in fields[i]]
+	return out
+
+def render_synthetic(size: int) -> BytesIO:
+	with stage('render'):
+		im = heatmap.synthetic_heatmap(size, size)
+	with stage('encode'):
+		return heatmap.encode_png(im)
+
+def read_params(size, cmap) -> tuple[int, str]:
+	size = max(16, min(int(size or 256), 2048))
+	return size, (cmap if cmap in heatmap.COLORMAPS else 'inferno')
+
+async def synthetic_urls(size: int) -> list[str]:
+	# No captured maps (stub runs, capture disabled): one shared placeholder per size, not
+	# remembered per id so real maps are picked up if they appear later
+	skey = ('', size, 'synthetic')
+	placeholder = recall(skey)
+	if placeholder is None:
+		buf = await executor.run(render_synthetic, size)
+		url = await executor.io(upload_png, f"attention/synthetic_{size}.png", buf)
+		placeholder = remember(skey, {"heatmap_urls": [url]})
+	return placeholder["heatmap_urls"]
+
+async def explain_items(items: list[dict], size: int, cmap: str) -> list[dict]:
+	# Heatmaps and token scores for many generations: cache and manifest lookups and map loads
+	# run concurrently on the I/O pool, every new map is colorized in one compute call, and all
+	# uploads go out together
+	results: list[dict | None] = [recall((it['id'], size, cmap)) for it in items]
+	todo = [i for i, r in enumerate(results) if r is None]
+	prefix = lambda i: f"attention/{items[i]['id']}/{cmap}_{size}"
+	manifests = await asyncio.gather(*[executor.io(read_object, S3_BUCKET, f"{prefix(i)}/index.json") for i in todo])
+	for i, manifest in zip(todo, manifests):
+		if manifest is not None:
+			_counters["s3_hits"] += 1
+			results[i] = remember((items[i]['id'], size, cmap), json.loads(manifest))
+	todo = [i for i in todo if results[i] is None]
+	loaded = await asyncio.gather(*[executor.io(load_attention, items[i]['id']) for i in todo])
+	captured = [(i, got) for i, got in zip(todo, loaded) if got is not None]
+	if captured:
+		bufs = await executor.run(render_batch, [got for _, got in captured], size, cmap)
+		uploads = [(i, n, b) for (i, _), item_bufs in zip(captured, bufs) for n, b in zip(['mean'] + [str(k) for k in range(len(item_bufs) - 1)], item_bufs)]
+		urls = await asyncio.gather(*[executor.io(upload_png, f"{prefix(i)}/{n}.png", b) for i, n, b in uploads])
+		by_item: dict[int, list[str]] = {}
+		for (i, _, _), url in zip(uploads, urls):
+			by_item.setdefault(i, []).append(url)
+		for i, (maps, tokens) in captured:
+			results[i] = {"id": items[i]['id'], "heatmap_urls": by_item[i], "tokens": tokens[:len(by_item[i]) - 1], "token_scores": heatmap.token_scores(maps, tokens), "captured": True}
+		await asyncio.gather(*[executor.io(timed, 'upload', s3.put_object, Bucket=S3_BUCKET, Key=f"{prefix(i)}/index.json", Body=json.dumps(results[i]).encode(), ContentType='application/json') for i, _ in captured])
+		for i, _ in captured:
+			remember((items[i]['id'], size, cmap), results[i])
+		_counters["rendered"] += len(captured)
+	missing = [i for i in todo if results[i] is None]
+	if missing:
+		_counters["synthetic"] += len(missing)
+		urls = await synthetic_urls(size)
+		for i in missing:
+			results[i] = {"id": items[i]['id'], "heatmap_urls": urls, "tokens": [], "token_scores": prompt_scores(items[i].get('prompt') or ''), "captured": False}
+	return results
 
 @app.get('/attention/{id}')
-async def attention(id: str):
-	# Generate a simple synthetic heatmap (gradient with radial emphasis)
-	w, h = 256, 256
-	img = Image.new('RGB', (w, h))
-	px = img.load()
-	cx, cy = w/2.0, h/2.0
-	for y in range(h):
-		for x in range(w):
-			dx = (x - cx) / cx
-			dy = (y - cy) / cy
-			r = int(max(0, 255 * (1.0 - (dx*dx + dy*dy))))
-			g = int((x / (w-1)) * 255)
-			b = int((y / (h-1)) * 255)
-			px[x, y] = (r//2, g, b//2)
-	buf = BytesIO()
-	img.save(buf, format='PNG')
-	key = f"attention/{id}_attn.png"
-	s3.put_object(Bucket=S3_BUCKET, Key=key, Body=buf.getvalue(), ContentType='image/png')
-	url = f"{S3_ENDPOINT}/{S3_BUCKET}/{key}"
-	return {"id": id, "heatmap_urls": [url]}
+@executor.admitted_handler
+@metrics.instrument('attention')
+async def attention(id: str, request: Request):
+	size, cmap = read_params(request.query_params.get('size'), request.query_params.get('cmap'))
+	label(model=cmap, resolution=f"{size}x{size}")
+	result = (await explain_items([{"id": id, "prompt": request.query_params.get('prompt')}], size, cmap))[0]
+	return {k: v for k, v in result.items() if k != 'token_scores'}
 
 @app.get('/tokens/{id}')
+@metrics.instrument('tokens')
 async def tokens(id: str, request: Request):
-	prompt = request.query_params.get('prompt') or ''
-	toks = [t for t in prompt.strip().split() if t] or ['prompt']
-	scores = []
-	for i, t in enumerate(toks):
-		scores.append({"token": t, "score": max(0.1, 1.0 - (i*0.1))})
-	return {"id": id, "token_scores": scores}
+	loaded = await executor.io(load_attention, id)
+	if loaded is not None:
+		maps, toks = loaded
+		return {"id": id, "token_scores": heatmap.token_scores(maps, toks), "captured": True}
+	return {"id": id, "token_scores": prompt_scores(request.query_params.get('prompt') or '')}
+
+@app.post('/explain/batch')
+@executor.admitted_handler
+@metrics.instrument('batch')
+async def explain_batch(request: Request):
+	# Backfill: {"items": [{"id", "prompt"}], "size", "cmap", "stream"}. Results keyed by id, or
+	# with stream=true one NDJSON line per generation as each chunk finishes
+	body = await request.json()
+	items = body.get('items')
+	if not isinstance(items, list) or not items:
+		raise HTTPException(status_code=400, detail='items must be a non-empty list')
+	if len(items) > EXPLAIN_BATCH_MAX:
+		raise HTTPException(status_code=400, detail=f'at most {EXPLAIN_BATCH_MAX} items')
+	if not all(isinstance(it, dict) and isinstance(it.get('id'), str) and it['id'] for it in items):
+		raise HTTPException(status_code=400, detail='every item needs a string id')
+	size, cmap = read_params(body.get('size'), body.get('cmap'))
+	label(model=cmap, resolution=f"{size}x{size}")
+	chunks = [items[i:i + EXPLAIN_BATCH_CHUNK] for i in range(0, len(items), EXPLAIN_BATCH_CHUNK)]
+	if body.get('stream'):
+		# The handler's slot is released when it returns the response, before any chunk is
+		# rendered; the stream holds a slot of its own until it ends
+		release = executor.hold()
+		async def lines():
+			try:
+				for chunk in chunks:
+					for result in await explain_items(chunk, size, cmap):
+						yield json.dumps(result) + '\n'
+			finally:
+				release()
+		return StreamingResponse(lines(), media_type='application/x-ndjson', background=BackgroundTask(release))
+	results = {}
+	for chunk in chunks:
+		for result in await explain_items(chunk, size, cmap):
+			results[result['id']] = result
+	return {"results": results, "count": len(results)}
@@ -0,0 +1,55 @@
+from io import BytesIO
+
+import numpy as np
+
+import heatmap
+
+
+def legacy_heatmap(w, h):
+	out = np.zeros((h, w, 3), dtype=np.uint8)
+	cx, cy = w / 2.0, h / 2.0
+	for y in range(h):
+		for x in range(w):
+			dx = (x - cx) / cx
+			dy = (y - cy) / cy
+			r = int(max(0, 255 * (1.0 - (dx * dx + dy * dy))))
+			out[y, x] = (r // 2, int((x / (w - 1)) * 255), int((y / (h - 1)) * 255) // 2)
+	return out
+
+
+def test_synthetic_matches_the_per_pixel_original():
+	assert np.array_equal(np.asarray(heatmap.synthetic_heatmap(64, 48)), legacy_heatmap(64, 48))
+
+
+def test_colorize_any_resolution_spans_the_colormap():
+	field = np.outer(np.linspace(0, 1, 8), np.ones(16)).astype(np.float32)
+	im = heatmap.colorize(field, 300, 150, 'gray')
+	a = np.asarray(im)
+	assert im.size == (300, 150) and a.shape == (150, 300, 3)
+	assert a[0].max() == 0 and a[-1].min() == 255
+	assert np.all(np.diff(a[:, 0, 0].astype(int)) >= 0)
+	# constant fields do not divide by zero
+	assert np.asarray(heatmap.colorize(np.ones((4, 4)), 8, 8)).shape == (8, 8, 3)
+
+
+def test_fit_size_keeps_aspect():
+	assert heatmap.fit_size((32, 64), 512) == (512, 256)
+	assert heatmap.fit_size((48, 32), 300) == (200, 300)
+
+
+def test_maps_round_trip_and_token_scores():
+	maps = np.zeros((3, 4, 4), dtype=np.float16)
+	maps[0] = 1.0
+	maps[1, :2] = 1.0
+	buf = BytesIO()
+	np.savez_compressed(buf, maps=maps, tokens=np.array(['a', 'cat', 'sat']))
+	loaded, tokens = heatmap.load_maps(buf.getvalue())
+	assert tokens == ['a', 'cat', 'sat'] and loaded.shape == (3, 4, 4)
+	assert [s['score'] for s in heatmap.token_scores(loaded, tokens)] == [1.0, 0.5, 0.0]
+
+
+def test_colorize_stack_normalizes_each_field():
+	fields = np.stack([np.linspace(0, 1, 16).reshape(4, 4), np.linspace(10, 20, 16).reshape(4, 4), np.full((4, 4), 3.0)])
+	a, b, flat = [np.asarray(im) for im in heatmap.colorize_stack(fields, 8, 8, 'gray')]
+	assert np.abs(a.astype(int) - b).max() <= 1
+	assert a.min() == 0 and a.max() == 255 and flat.max() == 0
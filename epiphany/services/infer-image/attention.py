@@ -0,0 +1,123 @@
+import math
+import threading
+from contextlib import contextmanager
+from io import BytesIO
+from typing import Any
+
+import numpy as np
+
+
+class Capture:
+	# Running per-step sums of cross-attention probabilities for one pipeline call, one
+	# [batch, queries, text tokens] accumulator per captured layer resolution
+	def __init__(self, batch: int, width: int, height: int):
+		self.batch = batch
+		self.width = width
+		self.height = height
+		self.sums: dict[int, Any] = {}
+		self.counts: dict[int, int] = {}
+
+	def add(self, probs) -> None:
+		q = probs.shape[1]
+		acc = self.sums.get(q)
+		if acc is None:
+			self.sums[q] = probs.float().clone()
+			self.counts[q] = 1
+		else:
+			acc.add_(probs)
+			self.counts[q] += 1
+
+	def grid(self, queries: int) -> tuple[int, int]:
+		# Latent grid for a query count, from the image aspect ratio
+		factor = math.sqrt(self.width * self.height / queries)
+		return max(1, round(self.height / factor)), max(1, round(self.width / factor))
+
+	def maps(self, index: int, token_count: int):
+		# [token_count, h, w] float16 for prompt tokens 1..token_count (BOS dropped), every
+		# resolution resized to the finest captured grid and averaged, each token scaled to 0..1
+		if not self.sums or token_count <= 0:
+			return None
+		import torch
+		import torch.nn.functional as F
+		target = max(self.sums)
+		gh, gw = self.grid(target)
+		total = None
+		for q, acc in self.sums.items():
+			h, w = self.grid(q)
+			m = (acc[index, :, 1:1 + token_count] / self.counts[q]).T.reshape(1, -1, h, w)
+			if (h, w) != (gh, gw):
+				m = F.interpolate(m, size=(gh, gw), mode='bilinear', align_corners=False)
+			total = m if total is None else total + m
+		total = total[0] / len(self.sums)
+		peak = total.flatten(1).amax(dim=1).clamp_min(1e-8)
+		return (total / peak[:, None, None]).to(torch.float16).cpu().numpy()
+
+
+class _TapProcessor:
+	# Wraps a cross-attention (attn2) processor: when the calling thread has an active capture
+	# and the layer is small enough, recomputes head-averaged softmax(QK^T) from the layer's own
+	# q/k projections and adds it into the capture, then defers to the wrapped processor
+	# (SDPA/flash) for the real output. Idle cost is one thread-local lookup per layer.
+	def __init__(self, inner: Any, tap: 'AttentionTap'):
+		self.inner = inner
+		self.tap = tap
+
+	def __call__(self, attn, hidden_states, encoder_hidden_states=None, attention_mask=None, *args, **kwargs):
+		cap = getattr(self.tap.local, 'capture', None)
+		if cap is not None and encoder_hidden_states is not None and hidden_states.ndim == 3 and hidden_states.shape[1] <= self.tap.max_queries:
+			import torch
+			with torch.no_grad():
+				states, context = hidden_states, encoder_hidden_states
+				# Classifier-free guidance runs [negative, positive]; only the prompt half matters
+				if states.shape[0] == 2 * cap.batch:
+					states, context = states[cap.batch:], context[cap.batch:]
+				q = attn.head_to_batch_dim(attn.to_q(states))
+				k = attn.head_to_batch_dim(attn.to_k(context))
+				probs = attn.get_attention_scores(q, k, None)
+				cap.add(probs.reshape(states.shape[0], attn.heads, *probs.shape[1:]).mean(dim=1))
+		return self.inner(attn, hidden_states, encoder_hidden_states, attention_mask, *args, **kwargs)
+
+
+class AttentionTap:
+	# Installed once on a UNet (shared by the txt2img/img2img/ControlNet variants); captures are
+	# per calling thread so concurrent compute workers never mix their maps
+	def __init__(self, max_queries: int = 1024):
+		self.max_queries = max_queries
+		self.local = threading.local()
+		self.installed = 0
+		self.captures = 0
+
+	def install(self, unet: Any) -> None:
+		if getattr(unet, '_epiphany_tap', None) is self:
+			return
+		procs = dict(unet.attn_processors)
+		wrapped = {name: (_TapProcessor(p, self) if name.split('.')[-2] == 'attn2' else p) for name, p in procs.items()}
+		unet.set_attn_processor(wrapped)
+		unet._epiphany_tap = self
+		self.installed += 1
+
+	@contextmanager
+	def capture(self, batch: int, width: int, height: int):
+		cap = Capture(batch, width, height)
+		self.local.capture = cap
+		try:
+			yield cap
+		finally:
+			self.local.capture = None
+			self.captures += 1
+
+	def stats(self) -> dict:
+		return {"installed": self.installed, "captures": self.captures, "max_queries": self.max_queries}
+
+
+def prompt_tokens(tokenizer: Any, prompt: str) -> list[str]:
+	# Token strings for positions 1..n of the text encoder input (BOS/EOS/padding excluded)
+	ids = tokenizer(prompt, truncation=True, max_length=tokenizer.model_max_length).input_ids[1:-1]
+	return [t.replace('</w>', '') for t in tokenizer.convert_ids_to_tokens(ids)]
+
+
+def encode_maps(maps: np.ndarray, tokens: list[str]) -> bytes:
+	# attention/{generationId}.npz, read by the explain service
+	buf = BytesIO()
+	np.savez_compressed(buf, maps=maps.astype(np.float16), tokens=np.array(tokens))
+	return buf.getvalue()
@@ -0,0 +1,79 @@
+import asyncio
+from typing import Any, Callable, Hashable
+
+
+class MicroBatcher:
+	# Groups concurrent requests with the same compatibility key (dims, steps, cfg, model)
+	# for up to window_ms or max_batch items, then runs them as one batched call.
+	# run_batch(key, items) is executed off the event loop and must return one result per item,
+	# as a job on the service's BoundedExecutor when one is given (the default thread pool if not).
+	def __init__(self, run_batch: Callable[[Hashable, list], list], max_batch: int = 4, window_ms: float = 25.0, executor: Any = None):
+		self.run_batch = run_batch
+		self.max_batch = max(1, int(max_batch))
+		self.window_ms = max(0.0, float(window_ms))
+		self.executor = executor
+		self._pending: dict[Hashable, list] = {}
+		self._timers: dict[Hashable, asyncio.TimerHandle] = {}
+		self._running = None  # created lazily so it binds to the serving loop
+		self.batches = 0
+		self.items = 0
+		self.max_seen = 0
+
+	async def submit(self, key: Hashable, item: Any) -> Any:
+		loop = asyncio.get_running_loop()
+		fut = loop.create_future()
+		bucket = self._pending.setdefault(key, [])
+		bucket.append((item, fut))
+		if len(bucket) >= self.max_batch or self.window_ms == 0:
+			self._flush(key)
+		elif len(bucket) == 1:
+			self._timers[key] = loop.call_later(self.window_ms / 1000.0, self._flush, key)
+		return await fut
+
+	def queue_depth(self) -> int:
+		return sum(len(b) for b in self._pending.values())
+
+	def stats(self) -> dict:
+		return {
+			"max_batch": self.max_batch,
+			"window_ms": self.window_ms,
+			"batches": self.batches,
+			"items": self.items,
+			"avg_batch": (self.items / self.batches) if self.batches else 0.0,
+			"max_batch_seen": self.max_seen,
+			"queue_depth": self.queue_depth(),
+		}
+
+	def _flush(self, key: Hashable) -> None:
+		timer = self._timers.pop(key, None)
+		if timer is not None:
+			timer.cancel()
+		batch = self._pending.pop(key, None)
+		if batch:
+			asyncio.ensure_future(self._run(key, batch))
+
+	async def _run(self, key: Hashable, batch: list) -> None:
+		if self._running is None:
+			self._running = asyncio.Lock()
+		# One batch on the device at a time; new arrivals keep accumulating meanwhile
+		async with self._running:
+			self.batches += 1
+			self.items += len(batch)
+			self.max_seen = max(self.max_seen, len(batch))
+			items = [item for item, _ in batch]
+			try:
+				if self.executor is not None:
+					results = await self.executor.run(self.run_batch, key, items)
+				else:
+					results = await asyncio.get_running_loop().run_in_executor(None, self.run_batch, key, items)
+				if len(results) != len(batch):
+					raise RuntimeError(f"batch returned {len(results)} results for {len(batch)} items")
+			except Exception as e:
+				for _, fut in batch:
+					if not fut.done():
+						fut.set_exception(e)
+				return
+			for (_, fut), res in zip(batch, results):
+				if not fut.done():
+					fut.set_result(res)
+
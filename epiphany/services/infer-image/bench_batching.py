@@ -0,0 +1,69 @@
+import argparse
+import asyncio
+import json
+import time
+
+from batching import MicroBatcher
+
+
+class StubPipeline:
+	# Latency model for a batched UNet pass: fixed per-call cost plus a marginal per-image cost
+	def __init__(self, overhead_ms: float, per_image_ms: float):
+		self.overhead_ms = overhead_ms
+		self.per_image_ms = per_image_ms
+
+	def __call__(self, key, items):
+		time.sleep((self.overhead_ms + self.per_image_ms * len(items)) / 1000.0)
+		return [f"{it['prompt']}:{it['seed']}" for it in items]
+
+
+def percentile(values: list[float], pct: float) -> float:
+	if not values:
+		return 0.0
+	s = sorted(values)
+	return s[min(len(s) - 1, max(0, int(round(pct / 100.0 * (len(s) - 1)))))]
+
+
+async def run_once(batch_size: int, requests: int, concurrency: int, window_ms: float, stub: StubPipeline) -> dict:
+	batcher = MicroBatcher(stub, max_batch=batch_size, window_ms=window_ms if batch_size > 1 else 0)
+	key = (768, 768, 20, 7.0, 'stub')
+	latencies: list[float] = []
+	sem = asyncio.Semaphore(concurrency)
+
+	async def one(i: int):
+		async with sem:
+			t0 = time.perf_counter()
+			res = await batcher.submit(key, {"prompt": f"p{i}", "seed": i})
+			assert res == f"p{i}:{i}"
+			latencies.append((time.perf_counter() - t0) * 1000.0)
+
+	t0 = time.perf_counter()
+	await asyncio.gather(*(one(i) for i in range(requests)))
+	wall = time.perf_counter() - t0
+	return {
+		"batch_size": batch_size,
+		"requests": requests,
+		"concurrency": concurrency,
+		"images_per_sec": round(requests / wall, 2),
+		"p50_ms": round(percentile(latencies, 50), 1),
+		"p99_ms": round(percentile(latencies, 99), 1),
+		"avg_batch": round(batcher.stats()["avg_batch"], 2),
+	}
+
+
+def main():
+	ap = argparse.ArgumentParser(description="txt2img micro-batching benchmark against a CPU stub pipeline")
+	ap.add_argument('--sizes', default='1,2,4,8')
+	ap.add_argument('--requests', type=int, default=64)
+	ap.add_argument('--concurrency', type=int, default=8)
+	ap.add_argument('--window-ms', type=float, default=10.0)
+	ap.add_argument('--overhead-ms', type=float, default=40.0)
+	ap.add_argument('--per-image-ms', type=float, default=15.0)
+	args = ap.parse_args()
+	stub = StubPipeline(args.overhead_ms, args.per_image_ms)
+	results = [asyncio.run(run_once(int(b), args.requests, args.concurrency, args.window_ms, stub)) for b in args.sizes.split(',') if b.strip()]
+	print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+	main()
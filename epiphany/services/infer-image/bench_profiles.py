@@ -0,0 +1,71 @@
+import argparse
+import json
+import resource
+import time
+
+from optimize import PROFILES, OptimizationProfile
+
+
+def peak_memory_mb(device: str) -> float:
+	if device == 'cuda':
+		import torch
+		return torch.cuda.max_memory_allocated() / (1024 * 1024)
+	# ru_maxrss is KiB on Linux; it only grows, so CPU rows report the process high-water mark
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_profile(name: str, model: str, width: int, height: int, steps: int, runs: int) -> dict:
+	import torch
+	from diffusers import StableDiffusionXLPipeline
+
+	profile = OptimizationProfile.named(name)
+	device = profile.resolve_device('cuda' if torch.cuda.is_available() else 'cpu')
+	if device == 'cuda':
+		torch.cuda.empty_cache()
+		torch.cuda.reset_peak_memory_stats()
+	t0 = time.perf_counter()
+	pipe = StableDiffusionXLPipeline.from_pretrained(model, torch_dtype=profile.torch_dtype(device))
+	pipe = profile.finalize(profile.apply(profile.place(pipe, device)))
+	load_ms = (time.perf_counter() - t0) * 1000.0
+	tiled = profile.prepare_call(pipe, width, height)
+	latencies = []
+	# The first call includes compilation/allocator warmup and is reported separately
+	for i in range(runs + 1):
+		t0 = time.perf_counter()
+		pipe(prompt='a lighthouse at dusk, oil painting', num_inference_steps=steps, width=width, height=height, generator=torch.Generator(device='cpu').manual_seed(i))
+		latencies.append((time.perf_counter() - t0) * 1000.0)
+	steady = sorted(latencies[1:]) or latencies
+	return {
+		"profile": name,
+		"device": device,
+		"dtype": str(profile.torch_dtype(device)).replace('torch.', ''),
+		"size": f"{width}x{height}",
+		"steps": steps,
+		"vae_tiling": tiled,
+		"load_ms": round(load_ms, 1),
+		"first_ms": round(latencies[0], 1),
+		"p50_ms": round(steady[len(steady) // 2], 1),
+		"peak_mb": round(peak_memory_mb(device), 1),
+	}
+
+
+def main():
+	ap = argparse.ArgumentParser(description="Latency and peak memory of the SDXL optimization profiles")
+	ap.add_argument('--model', default='hf-internal-testing/tiny-stable-diffusion-xl-pipe', help="diffusers SDXL model id or path (a tiny test pipeline keeps CPU runs short)")
+	ap.add_argument('--profiles', default='cpu,cpu-bf16', help=f"comma-separated, from {','.join(PROFILES)}")
+	ap.add_argument('--width', type=int, default=256)
+	ap.add_argument('--height', type=int, default=256)
+	ap.add_argument('--steps', type=int, default=4)
+	ap.add_argument('--runs', type=int, default=3)
+	args = ap.parse_args()
+	# One JSON line per profile; a profile that cannot run here reports why instead of aborting the rest
+	for name in [p.strip() for p in args.profiles.split(',') if p.strip()]:
+		try:
+			row = run_profile(name, args.model, args.width, args.height, args.steps, args.runs)
+		except Exception as e:
+			row = {"profile": name, "error": f"{type(e).__name__}: {e}"}
+		print(json.dumps(row), flush=True)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,204 @@
+import hashlib
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any
+
+from common.metrics import stage
+from registry import module_bytes
+
+
+def _cat(tensors: list) -> Any:
+	if len(tensors) == 1:
+		return tensors[0]
+	import torch
+	return torch.cat(tensors)
+
+
+def _nbytes(*tensors) -> int:
+	return sum(int(t.numel()) * int(t.element_size()) for t in tensors)
+
+
+def _encoder_name(module: Any) -> str:
+	config = getattr(module, 'config', None)
+	return str(getattr(config, '_name_or_path', None) or getattr(module, 'name_or_path', None) or type(module).__name__)
+
+
+class _Entry:
+	def __init__(self, embeds: Any, pooled: Any, encode_ms: float):
+		self.embeds = embeds
+		self.pooled = pooled
+		self.encode_ms = encode_ms
+		self.nbytes = _nbytes(embeds, pooled)
+
+
+class PromptEmbeddingCache:
+	# Bounded LRU of SDXL text-encoder outputs (the 77-token hidden states of both CLIP encoders
+	# and the pooled embedding of the second). Entries are keyed by (text encoder hash, text):
+	# SDXL encodes a negative prompt exactly like a prompt, so one entry serves either side and
+	# a (prompt, negative prompt) pair is two lookups. A precomputed negative then applies to
+	# every prompt it is paired with. store='device' keeps entries where the encoder produced
+	# them; store='cpu' keeps them in pinned host memory and copies them over per call.
+	def __init__(self, max_entries: int = 512, max_bytes: int = 512 * 1024 * 1024, store: str = 'device', enabled: bool = True):
+		self.max_entries = max(0, int(max_entries))
+		self.max_bytes = max(0, int(max_bytes))
+		self.store = store if store in ('device', 'cpu') else 'device'
+		self.enabled = enabled and self.max_entries > 0
+		self._entries: 'OrderedDict[tuple[str, str], _Entry]' = OrderedDict()
+		self._lock = threading.Lock()
+		self._encoder_keys: 'weakref.WeakKeyDictionary[Any, str]' = weakref.WeakKeyDictionary()
+		self.bytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.encode_ms = 0.0
+		self.saved_ms = 0.0
+		self.precomputed = 0
+
+	@classmethod
+	def from_env(cls) -> 'PromptEmbeddingCache':
+		return cls(
+			max_entries=int(os.getenv('PROMPT_CACHE_SIZE', '512')),
+			max_bytes=int(float(os.getenv('PROMPT_CACHE_MB', '512') or 0) * 1024 * 1024),
+			store=os.getenv('PROMPT_CACHE_STORE', 'device').strip().lower(),
+			enabled=os.getenv('PROMPT_CACHE', 'true').lower() != 'false',
+		)
+
+	def supports(self, pipe: Any) -> bool:
+		return self.enabled and callable(getattr(pipe, 'encode_prompt', None)) and getattr(pipe, 'text_encoder_2', None) is not None
+
+	def encoder_key(self, pipe: Any) -> str:
+		# Checkpoint names, dtype and size of both text encoders; derived pipelines (img2img,
+		# ControlNet) share the txt2img encoders and therefore its entries
+		encoders = (getattr(pipe, 'text_encoder', None), pipe.text_encoder_2)
+		try:
+			return self._encoder_keys[encoders[1]]
+		except (KeyError, TypeError):
+			pass
+		parts = []
+		for module in encoders:
+			if module is None:
+				parts.append('none')
+				continue
+			parts.append(f"{_encoder_name(module)}:{getattr(module, 'dtype', '')}:{module_bytes(module)}")
+		key = hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()[:16]
+		try:
+			self._encoder_keys[encoders[1]] = key
+		except TypeError:
+			pass
+		return key
+
+	def _lookup(self, key: tuple[str, str]) -> _Entry | None:
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is None:
+				self.misses += 1
+				return None
+			self.hits += 1
+			self.saved_ms += entry.encode_ms
+			self._entries.move_to_end(key)
+			return entry
+
+	def _store(self, key: tuple[str, str], entry: _Entry) -> None:
+		if self.max_bytes and entry.nbytes > self.max_bytes:
+			return
+		with self._lock:
+			old = self._entries.pop(key, None)
+			if old is not None:
+				self.bytes -= old.nbytes
+			self._entries[key] = entry
+			self.bytes += entry.nbytes
+			while len(self._entries) > self.max_entries or (self.max_bytes and self.bytes > self.max_bytes):
+				_, dropped = self._entries.popitem(last=False)
+				self.bytes -= dropped.nbytes
+				self.evictions += 1
+
+	def _encode(self, pipe: Any, text: str, device: Any) -> _Entry:
+		t0 = time.perf_counter()
+		with stage('text_encode'):
+			embeds, _, pooled, _ = pipe.encode_prompt(prompt=text, device=device, num_images_per_prompt=1, do_classifier_free_guidance=False)
+		encode_ms = (time.perf_counter() - t0) * 1000.0
+		with self._lock:
+			self.encode_ms += encode_ms
+		if self.store == 'cpu':
+			embeds, pooled = self._to_host(embeds), self._to_host(pooled)
+		return _Entry(embeds, pooled, encode_ms)
+
+	@staticmethod
+	def _to_host(t: Any) -> Any:
+		t = t.to('cpu')
+		try:
+			return t.pin_memory()
+		except Exception:
+			# No CUDA here: plain host memory
+			return t
+
+	def get(self, pipe: Any, text: str, device: Any = None) -> tuple[Any, Any]:
+		# (prompt_embeds, pooled_prompt_embeds) for one text, each with a batch dimension of 1
+		key = (self.encoder_key(pipe), text)
+		entry = self._lookup(key)
+		if entry is None:
+			entry = self._encode(pipe, text, device)
+			self._store(key, entry)
+		if self.store == 'cpu' and device is not None:
+			return entry.embeds.to(device, non_blocking=True), entry.pooled.to(device, non_blocking=True)
+		return entry.embeds, entry.pooled
+
+	def precompute(self, pipe: Any, texts: list[str]) -> int:
+		# Encodes texts ahead of traffic (warmup); returns how many were new
+		if not self.supports(pipe):
+			return 0
+		device = getattr(pipe, '_execution_device', None)
+		added = 0
+		for text in texts:
+			key = (self.encoder_key(pipe), text)
+			with self._lock:
+				known = key in self._entries
+			if not known:
+				self._store(key, self._encode(pipe, text, device))
+				added += 1
+		with self._lock:
+			self.precomputed += added
+		return added
+
+	def pipe_kwargs(self, pipe: Any, prompts: str | list[str], negatives: str | list[str] | None) -> dict:
+		# prompt_embeds, negative_prompt_embeds and the pooled pair for a pipeline call, in place
+		# of prompt/negative_prompt. Without any negative prompt, SDXL checkpoints configured with
+		# force_zeros_for_empty_prompt get zero negatives, as the pipeline itself would do.
+		device = getattr(pipe, '_execution_device', None)
+		prompts = [prompts] if isinstance(prompts, str) else list(prompts)
+		if negatives is None or isinstance(negatives, str):
+			negatives = [negatives or ''] * len(prompts)
+		pos = [self.get(pipe, p, device) for p in prompts]
+		config = getattr(pipe, 'config', None)
+		if not any(negatives) and getattr(config, 'force_zeros_for_empty_prompt', False):
+			neg = [(e.new_zeros(e.shape), p.new_zeros(p.shape)) for e, p in pos]
+		else:
+			neg = [self.get(pipe, n or '', device) for n in negatives]
+		return {
+			"prompt_embeds": _cat([e for e, _ in pos]),
+			"pooled_prompt_embeds": _cat([p for _, p in pos]),
+			"negative_prompt_embeds": _cat([e for e, _ in neg]),
+			"negative_pooled_prompt_embeds": _cat([p for _, p in neg]),
+		}
+
+	def stats(self) -> dict:
+		with self._lock:
+			lookups = self.hits + self.misses
+			return {
+				"enabled": self.enabled,
+				"store": self.store,
+				"entries": len(self._entries),
+				"max_entries": self.max_entries,
+				"mb": round(self.bytes / (1024 * 1024), 1),
+				"max_mb": round(self.max_bytes / (1024 * 1024), 1),
+				"hits": self.hits,
+				"misses": self.misses,
+				"hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+				"evictions": self.evictions,
+				"precomputed": self.precomputed,
+				"encode_ms": round(self.encode_ms, 1),
+				"saved_ms": round(self.saved_ms, 1),
+			}
@@ -1,14 +1,38 @@
-﻿from fastapi import FastAPI, Request
+﻿from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
 import os
-from io import BytesIO
+import asyncio
 from PIL import Image
 import boto3
-import hashlib
+from botocore.config import Config
 import random
-import requests
+from contextlib import ExitStack, contextmanager
+from registry import ModelRegistry, module_bytes
+from embeddings import PromptEmbeddingCache
+from batching import MicroBatcher
+from common.executor import BoundedExecutor
+from optimize import OptimizationProfile
+from memory import MemoryPlanner, Plan, device_peak, is_out_of_memory
+from output import FORMATS, EncodedImage, OutputSettings, encode_image, encode_output, encode_preview
+from result_cache import ResultCache, cache_key, sha256_or_none
+from preprocess import CONTROL_TYPES, ControlPreprocessor, normalize_params
+from common.safety import NSFW_THRESHOLD, SafetyScorer
+from common.fetch import Fetcher
+from common.cancel import Canceled, CancelRegistry
+from common.warmup import Warmup
+from common.metrics import CONTENT_TYPE, Metrics, StepTimer, collect, current, label, stage
+from common.profiling import Profiler
+from attention import AttentionTap, encode_maps, prompt_tokens
+from progress import ProgressPublisher, StepReporter, latent_preview, on_steps, preview_data_url, step_kwargs
 
 app = FastAPI(title="Epiphany Infer Image")
 
+# Per-stage timings returned as `timings` and exported on /metrics
+metrics = Metrics('infer-image')
+
+# One diffusion job on the device at a time by default; downloads/uploads overlap on the I/O pool
+executor = BoundedExecutor.from_env('infer-image', workers=1, max_queue=8, io_workers=8)
+
 S3_ENDPOINT = os.getenv('S3_ENDPOINT', 'http://localhost:9000')
 S3_BUCKET = os.getenv('S3_BUCKET', 'epiphany-outputs')
 S3_REGION = os.getenv('S3_REGION', 'us-east-1')
@@ -17,9 +41,21 @@ S3_SECRET_KEY = os.getenv('S3_SECRET_KEY', 'minioadmin')
 
 MODEL_ID = os.getenv('MODEL_ID', 'sdxl-base')
 
-s3 = boto3.client('s3', endpoint_url=S3_ENDPOINT, aws_access_key_id=S3_ACCESS_KEY, aws_secret_access_key=S3_SECRET_KEY, region_name=S3_REGION)
+s3 = boto3.client('s3', endpoint_url=S3_ENDPOINT, aws_access_key_id=S3_ACCESS_KEY, aws_secret_access_key=S3_SECRET_KEY, region_name=S3_REGION, config=Config(max_pool_connections=executor.io_workers))
+
+# On-demand profiling (/debug/profile); off unless PROFILE_TOKEN is set
+profiler = Profiler.from_env('infer-image', s3, S3_BUCKET, S3_ENDPOINT)
+
+output_settings = OutputSettings.from_env()
+
+result_cache = ResultCache(
+	s3, S3_BUCKET, S3_ENDPOINT,
+	max_entries=int(os.getenv('RESULT_CACHE_MAX_ENTRIES', '4096')),
+	redis_url=os.getenv('RESULT_CACHE_REDIS_URL') or None,
+	enabled=(os.getenv('RESULT_CACHE', 'true').lower() != 'false'),
+	exts=(FORMATS[output_settings.fmt][2],),
+)
 
-_pipe = None
 _diffusers_available = False
 try:
     from diffusers import StableDiffusionXLPipeline, StableDiffusionXLImg2ImgPipeline, StableDiffusionXLInpaintPipeline
@@ -35,15 +71,6 @@ try:
 except Exception:
     _diffusers_available = False
 
-# Optional safety checker (best-effort)
-_safety_available = False
-try:
-    from transformers import AutoFeatureExtractor  # type: ignore
-    from diffusers.pipelines.stable_diffusion.safety_checker import StableDiffusionSafetyChecker  # type: ignore
-    _safety_available = True
-except Exception:
-    _safety_available = False
-
 ALLOWED_URL_PREFIXES = [p.strip() for p in (os.getenv('ALLOWED_URL_PREFIXES') or '').split(',') if p.strip()]
 
 def is_allowed_url(url: str) -> bool:
@@ -60,26 +87,36 @@ def is_allowed_url(url: str) -> bool:
             return True
     return False
 
-def upload_png(key: str, buf: BytesIO) -> str:
-	buf.seek(0)
-	s3.put_object(Bucket=S3_BUCKET, Key=key, Body=buf.getvalue(), ContentType='image/png')
+# Pooled, cached input fetches (init images, masks, ControlNet references)
+fetcher = Fetcher.from_env(s3, S3_ENDPOINT, is_allowed_url, buckets=[S3_BUCKET], pool_size=executor.io_workers)
+
+def upload_encoded(key: str, enc: EncodedImage, metadata: dict | None = None) -> str:
+	extra = {'Metadata': metadata} if metadata else {}
+	with stage('upload'):
+		s3.put_object(Bucket=S3_BUCKET, Key=key, Body=enc.reader(), ContentLength=enc.nbytes, ContentType=enc.content_type, **extra)
+	return f"{S3_ENDPOINT}/{S3_BUCKET}/{key}"
+
+# Cross-attention capture for explain: a tap on the UNet's attn2 processors sums head-averaged
+# attention over the steps of a call for layers with at most ATTENTION_CAPTURE_MAX_QUERIES queries
+ATTENTION_CAPTURE = os.getenv('ATTENTION_CAPTURE', 'true').lower() != 'false'
+attention_tap = AttentionTap(max_queries=int(os.getenv('ATTENTION_CAPTURE_MAX_QUERIES', '1024')))
+
+# Step progress for the API's job stream: every PROGRESS_EVERY denoising steps a latent preview
+# (linear latent->RGB, no VAE) is published to Redis under progress:{jobId}
+PROGRESS_EVERY = int(os.getenv('PROGRESS_EVERY', '5'))
+PROGRESS_PREVIEW_SIZE = int(os.getenv('PROGRESS_PREVIEW_SIZE', '256'))
+progress = ProgressPublisher(os.getenv('PROGRESS_REDIS_URL') or os.getenv('REDIS_URL') or None)
+
+def store_attention(generation_id: str | None, blob: bytes | None) -> str | None:
+	if not generation_id or blob is None:
+		return None
+	key = f"attention/{generation_id}.npz"
+	with stage('upload'):
+		s3.put_object(Bucket=S3_BUCKET, Key=key, Body=blob, ContentType='application/octet-stream')
 	return f"{S3_ENDPOINT}/{S3_BUCKET}/{key}"
 
-def make_image(width: int, height: int, color=(0, 0, 0)) -> BytesIO:
-	img = Image.new('RGB', (width, height), color=color)
-	buf = BytesIO()
-	img.save(buf, format='PNG')
-	return buf
-
-def image_meta(buf: BytesIO, width: int, height: int):
-	data = buf.getvalue()
-	sha256 = hashlib.sha256(data).hexdigest()
-	return {
-		"width": width,
-		"height": height,
-		"bytes": len(data),
-		"sha256": sha256,
-	}
+def make_image(width: int, height: int, color=(0, 0, 0)) -> Image.Image:
+	return Image.new('RGB', (width, height), color=color)
 
 def simple_safety_from_prompt(prompt: str):
 	p = (prompt or '').lower()
@@ -87,23 +124,8 @@ def simple_safety_from_prompt(prompt: str):
 	score = 1.0 if any(k in p for k in nsfw_keywords) else 0.0
 	return {"nsfw": score}
 
-def safety_score_image(img: Image.Image) -> float:
-    if not _safety_available:
-        return 0.0
-    try:
-        from numpy import array as np_array  # type: ignore
-        extractor = AutoFeatureExtractor.from_pretrained("CompVis/stable-diffusion-safety-checker")
-        checker = StableDiffusionSafetyChecker.from_pretrained("CompVis/stable-diffusion-safety-checker")
-        arr = np_array(img.convert('RGB'))[None, :]
-        inputs = extractor(arr, return_tensors="pt")
-        _, has_nsfw_concepts = checker(images=arr, clip_input=inputs.pixel_values)
-        if isinstance(has_nsfw_concepts, list) and len(has_nsfw_concepts) > 0:
-            return 1.0 if any(bool(x) for x in has_nsfw_concepts) else 0.0
-        if isinstance(has_nsfw_concepts, (int, float)):
-            return float(has_nsfw_concepts)
-        return 0.0
-    except Exception:
-        return 0.0
+# Resident safety checker, shared by every handler and scored per batch
+safety_scorer = SafetyScorer()
 
 def choose_dims(aspect: str | None, preview: bool | None):
 	if aspect not in ["1:1", "16:9", "9:16", "3:2", "2:3"]:
@@ -121,293 +143,549 @@ def choose_dims(aspect: str | None, preview: bool | None):
 		return base, base * 3 // 2
 	return base, base
 
-def load_pipe():
-    global _pipe
-    if _pipe is not None:
-        return _pipe
+SDXL_MODEL = os.getenv('SDXL_MODEL', 'stabilityai/stable-diffusion-xl-base-1.0')
+SDXL_INPAINT_MODEL = os.getenv('SDXL_INPAINT_MODEL', 'diffusers/stable-diffusion-xl-1.0-inpainting-0.1')
+CONTROLNET_MODELS = {
+    'canny': os.getenv('SDXL_CN_CANNY_MODEL', 'lllyasviel/sd-controlnet-canny'),
+    'depth': os.getenv('SDXL_CN_DEPTH_MODEL', 'lllyasviel/sd-controlnet-depth'),
+    'pose': os.getenv('SDXL_CN_POSE_MODEL', 'lllyasviel/sd-controlnet-openpose'),
+}
+
+def _release_device_memory():
+    try:
+        import gc
+        gc.collect()
+        if _diffusers_available and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    except Exception:
+        pass
+
+# dtype, attention, VAE, offload, layout and compile settings for every pipeline built below
+opt_profile = OptimizationProfile.from_env()
+
+# Chooses direct / tiled / chunked / downscaled runs from the device memory free per call
+memory_planner = MemoryPlanner.from_env()
+MEMORY_OOM_RETRIES = int(os.getenv('MEMORY_OOM_RETRIES', '1'))
+
+# Resident pipelines; MODEL_CACHE_BUDGET_MB=0 keeps everything loaded
+registry = ModelRegistry(budget_bytes=int(float(os.getenv('MODEL_CACHE_BUDGET_MB', '0') or 0) * 1024 * 1024), on_evict=_release_device_memory)
+
+# Cooperative cancellation by API job id: checked before a call starts and between steps
+cancels = CancelRegistry.from_env(on_abort=_release_device_memory)
+
+def resolve_device() -> str:
+    # Honor TORCH_DEVICE and CUDA_VISIBLE_DEVICES
+    device_env = os.getenv('TORCH_DEVICE', '').strip().lower()
+    if device_env in ('cuda','gpu') and 'CUDA_VISIBLE_DEVICES' not in os.environ:
+        os.environ['CUDA_VISIBLE_DEVICES'] = '0'
+    return 'cuda' if (device_env in ('cuda','gpu')) or (hasattr(torch, 'cuda') and torch.cuda.is_available()) else 'cpu'
+
+def _build_pipe(model_id: str, task: str, controlnet: str | None, device: str, dtype):
+    if task in ('txt2img', 'inpaint'):
+        cls = StableDiffusionXLInpaintPipeline if task == 'inpaint' else StableDiffusionXLPipeline
+        pipe = cls.from_pretrained(model_id, torch_dtype=dtype)
+        pipe = opt_profile.apply(opt_profile.place(pipe, device))
+        if ATTENTION_CAPTURE:
+            attention_tap.install(pipe.unet)
+        return opt_profile.finalize(pipe)
+    # img2img and ControlNet variants reuse the txt2img UNet, VAE and text encoders
+    base_key = (model_id, 'txt2img', None, str(dtype), device, opt_profile.name)
+    base = registry.get(base_key, lambda: _build_pipe(model_id, 'txt2img', None, device, dtype))
+    components = dict(base.components)
+    # Schedulers keep per-run state, so each variant gets its own instance
+    components['scheduler'] = base.scheduler.__class__.from_config(base.scheduler.config)
+    if task == 'img2img':
+        return StableDiffusionXLImg2ImgPipeline(**components), [base_key]
+    # The shared components are already placed by the base pipeline; only the ControlNet is new
+    cn = opt_profile.place_module(ControlNetModel.from_pretrained(CONTROLNET_MODELS[controlnet], torch_dtype=dtype), device)
+    pipe = StableDiffusionXLControlNetPipeline(**components, controlnet=cn)
+    return opt_profile.apply(pipe, derived=True), [base_key]
+
+# SDXL text-encoder outputs for recurring prompts and negative prompts, shared by every task
+prompt_cache = PromptEmbeddingCache.from_env()
+PROMPT_CACHE_NEGATIVES = [n.strip() for n in (os.getenv('PROMPT_CACHE_NEGATIVES') or '').split('|') if n.strip()]
+
+def prompt_kwargs(pipe, prompt, negative_prompt) -> dict:
+    # Cached embeddings in place of prompt/negative_prompt; the raw text when the cache is off
+    # or cannot encode for this pipeline (the pipeline then encodes as before)
+    if prompt_cache.supports(pipe):
+        try:
+            return prompt_cache.pipe_kwargs(pipe, prompt, negative_prompt)
+        except Canceled:
+            raise
+        except Exception as e:
+            if is_out_of_memory(e):
+                raise
+    return {"prompt": prompt, "negative_prompt": negative_prompt}
+
+def make_generator(seed: int | None):
+    if seed is None or not _diffusers_available:
+        return None
+    # CPU generators give the same latents on any device
+    return torch.Generator(device='cpu').manual_seed(int(seed))
+
+def load_pipe(task: str = 'txt2img', controlnet: str | None = None):
     if not _diffusers_available:
         return None
     try:
-        # Honor TORCH_DEVICE and CUDA_VISIBLE_DEVICES
-        device_env = os.getenv('TORCH_DEVICE', '').strip().lower()
-        if device_env in ('cuda','gpu') and 'CUDA_VISIBLE_DEVICES' not in os.environ:
-            os.environ['CUDA_VISIBLE_DEVICES'] = '0'
-        device = 'cuda' if (device_env in ('cuda','gpu')) or (hasattr(torch, 'cuda') and torch.cuda.is_available()) else 'cpu'
-        _pipe = StableDiffusionXLPipeline.from_pretrained(
-            os.getenv('SDXL_MODEL', 'stabilityai/stable-diffusion-xl-base-1.0'),
-            torch_dtype=torch.float16 if device == 'cuda' else torch.float32
-        )
-        if device == 'cuda':
-            _pipe = _pipe.to(device)
-        return _pipe
+        device = opt_profile.resolve_device(resolve_device())
+        dtype = opt_profile.torch_dtype(device)
+        model_id = SDXL_INPAINT_MODEL if task == 'inpaint' else SDXL_MODEL
+        key = (model_id, task, controlnet, str(dtype), device, opt_profile.name)
+        with stage('model_load'):
+            return registry.get(key, lambda: _build_pipe(model_id, task, controlnet, device, dtype))
     except Exception:
         return None
 
-def try_generate_with_diffusers(prompt: str, width: int, height: int, steps: int, cfg: float) -> BytesIO | None:
+def try_generate_batch_with_diffusers(prompts: list[str], seeds: list[int], width: int, height: int, steps: int, cfg: float, negative_prompts: list[str | None] | None = None, plan: Plan | None = None) -> list[Image.Image | None]:
     pipe = load_pipe()
     if pipe is None:
-        return None
+        return [None] * len(prompts)
     try:
-        g = pipe(prompt=prompt, num_inference_steps=max(1, min(steps, 20)), guidance_scale=max(1.0, min(cfg, 12.0)), height=height, width=width)
-        im = g.images[0]
-        buf = BytesIO()
-        im.save(buf, format='PNG')
-        return buf
-    except Exception:
-        return None
+        opt_profile.prepare_call(pipe, width, height, plan.tiling if plan else None, plan.slicing if plan else None)
+        # One generator per item keeps each image reproducible regardless of its batch neighbours
+        generators = [make_generator(s) for s in seeds]
+        negatives = [n or '' for n in negative_prompts] if negative_prompts and any(negative_prompts) else None
+        g = pipe(**prompt_kwargs(pipe, prompts, negatives), generator=generators, num_inference_steps=max(1, min(steps, 20)), guidance_scale=max(1.0, min(cfg, 12.0)), height=height, width=width, **step_kwargs())
+        return list(g.images)
+    except Canceled:
+        raise
+    except Exception as e:
+        # Out-of-memory goes back to the planner; anything else becomes a placeholder
+        if is_out_of_memory(e):
+            raise
+        return [None] * len(prompts)
+
+def try_generate_with_diffusers(prompt: str, width: int, height: int, steps: int, cfg: float, seed: int | None = None, negative_prompt: str | None = None) -> Image.Image | None:
+    if seed is None:
+        seed = random.randint(0, 2**32 - 1)
+    return try_generate_batch_with_diffusers([prompt], [seed], width, height, steps, cfg, [negative_prompt])[0]
+
+def attention_blobs(cap, prompts: list[str], ids: list[str | None]) -> list[bytes | None]:
+    # One attention/{generationId}.npz payload per item that asked for it
+    pipe = load_pipe()
+    out = []
+    for i, (prompt, gid) in enumerate(zip(prompts, ids)):
+        try:
+            tokens = prompt_tokens(pipe.tokenizer, prompt) if gid and pipe is not None else []
+            maps = cap.maps(i, len(tokens)) if tokens else None
+            out.append(encode_maps(maps, tokens) if maps is not None else None)
+        except Exception:
+            out.append(None)
+    return out
+
+def hook_ids(body: dict) -> dict:
+    # generationId (attention capture) and jobId (step progress) as sent by the API worker
+    return {"generation_id": body.get('generationId'), "job_id": str(body['jobId']) if body.get('jobId') is not None else None}
+
+def render_progress(latents) -> dict:
+    im = latent_preview(latents, PROGRESS_PREVIEW_SIZE)
+    # Partial results are screened like final ones; above the threshold only the step is sent
+    if safety_scorer.score_one(im) >= NSFW_THRESHOLD:
+        return {"redacted": True}
+    enc = encode_preview(im, output_settings)
+    return {"preview": preview_data_url(bytes(enc.view()), enc.content_type)}
+
+@contextmanager
+def pipeline_hooks(prompts: list[str], generation_ids: list[str | None], job_ids: list[str | None], width: int, height: int, steps: int):
+    # Per-call hooks on the denoising loop: cross-attention capture for explain and step
+    # progress/previews for the API; yields the attention capture (or None)
+    # A batch is only abandoned when every request in it has been canceled; a canceled
+    # request sharing a batch is dropped by its handler once the batch returns
+    tracked = [j for j in job_ids if j]
+    def check_canceled(pipe=None, step=None, timestep=None, kwargs=None):
+        if tracked and len(tracked) == len(job_ids) and all(cancels.is_canceled(j) for j in tracked):
+            cancels.check(tracked[0])
+        return kwargs
+    check_canceled()
+    with ExitStack() as stack:
+        # Everything in the call not covered by a nested stage (load, decode) counts as inference
+        stack.enter_context(stage('inference'))
+        timings = current()
+        if timings is not None:
+            stack.enter_context(on_steps(StepTimer(timings)))
+        if tracked:
+            stack.enter_context(on_steps(check_canceled))
+        cap = None
+        if ATTENTION_CAPTURE and _diffusers_available and any(generation_ids):
+            cap = stack.enter_context(attention_tap.capture(len(prompts), width, height))
+        if progress.enabled and PROGRESS_EVERY > 0 and any(job_ids):
+            stack.enter_context(on_steps(StepReporter(progress, job_ids, steps, PROGRESS_EVERY, render_progress, executor.io_pool.submit)))
+        yield cap
+
+def with_hooks(ids: dict, prompt: str, width: int, height: int, steps: int, fn, *args) -> tuple[Image.Image | None, bytes | None]:
+    # Runs a single-image try_* function with the pipeline hooks active on this thread
+    with pipeline_hooks([prompt], [ids.get('generation_id')], [ids.get('job_id')], width, height, steps) as cap:
+        im = fn(*args)
+    return im, (attention_blobs(cap, [prompt], [ids.get('generation_id')])[0] if cap is not None and im is not None else None)
+
+def plan_txt2img(width: int, height: int, batch: int) -> tuple[Plan, dict]:
+    # Plans against the memory free once the pipeline is resident; returns the plan and the
+    # keyword arguments used to feed measurements back to the planner
+    pipe = load_pipe()
+    if pipe is None:
+        return memory_planner.placeholder(width, height, batch, 'unavailable'), {}
+    device = opt_profile.resolve_device(resolve_device())
+    # Offloaded UNets are moved onto the device for the call itself
+    extra = module_bytes(pipe.unet) if device == 'cuda' and opt_profile.offload != 'none' else 0
+    model = {"dtype_bytes": opt_profile.dtype_bytes(device), "attention_slicing": opt_profile.attention == 'slicing', "extra_bytes": extra}
+    return memory_planner.plan(width, height, batch, memory_planner.available(device), **model), {"device": device, **model}
+
+def generate_planned(items: list[dict], width: int, height: int, steps: int, cfg: float) -> tuple[list[Image.Image | None], list[bytes | None], Plan]:
+    # Runs a txt2img batch the way the memory planner decides: in chunks, at a lower resolution
+    # (upscaled to the request's size) or not at all. An OOM lowers the estimate's trust and
+    # replans; the placeholder is the last resort.
+    for attempt in range(MEMORY_OOM_RETRIES + 1):
+        plan, model = plan_txt2img(width, height, len(items))
+        if plan.degraded:
+            return [None] * len(items), [None] * len(items), plan
+        images, blobs = [], []
+        try:
+            for start in range(0, len(items), plan.chunk):
+                chunk = items[start:start + plan.chunk]
+                prompts = [it['prompt'] for it in chunk]
+                ids = [it.get('generation_id') for it in chunk]
+                with pipeline_hooks(prompts, ids, [it.get('job_id') for it in chunk], plan.width, plan.height, steps) as cap:
+                    with device_peak(model['device']) as peak:
+                        out = try_generate_batch_with_diffusers(prompts, [it['seed'] for it in chunk], plan.width, plan.height, steps, cfg, [it.get('negative_prompt') for it in chunk], plan)
+                if peak['peak_bytes'] and any(im is not None for im in out):
+                    memory_planner.observe(plan, len(chunk), peak['peak_bytes'], model['dtype_bytes'], model['attention_slicing'], model['extra_bytes'])
+                blobs += attention_blobs(cap, prompts, ids) if cap is not None else [None] * len(chunk)
+                images += out
+        except Exception as e:
+            if not is_out_of_memory(e):
+                raise
+            memory_planner.out_of_memory(plan)
+            _release_device_memory()
+            continue
+        if all(im is None for im in images):
+            return images, blobs, memory_planner.placeholder(width, height, len(items), 'error', plan.estimate_bytes, plan.budget_bytes)
+        if plan.upscaled:
+            images = [im.resize((width, height), Image.LANCZOS) if im is not None else None for im in images]
+        return images, blobs, plan
+    return [None] * len(items), [None] * len(items), memory_planner.placeholder(width, height, len(items), 'oom', plan.estimate_bytes, plan.budget_bytes)
+
+def _run_txt2img_batch(key, items: list[dict]) -> list[tuple[Image.Image | None, float | None, bytes | None, dict, object]]:
+    width, height, steps, cfg, _model = key
+    # Stage timings of the shared call; every request in the batch reports them
+    with collect() as shared:
+        images, blobs, plan = generate_planned(items, width, height, steps, cfg)
+        # Score the whole batch in one safety forward pass while it is still on the worker
+        real = [im for im in images if im is not None]
+        scores = iter(safety_scorer.score(real))
+    decision = plan.describe()
+    return [(im, next(scores) if im is not None else None, blob, decision, shared) for im, blob in zip(images, blobs)]
 
-def try_img2img_with_diffusers(prompt: str, init_bytes: bytes | None, strength: float, steps: int, cfg: float, width: int, height: int) -> BytesIO | None:
+# Concurrent txt2img requests with matching (w, h, steps, cfg, model) share one pipeline call
+txt2img_batcher = MicroBatcher(_run_txt2img_batch, max_batch=int(os.getenv('TXT2IMG_BATCH_MAX', '4')), window_ms=float(os.getenv('TXT2IMG_BATCH_WINDOW_MS', '25')), executor=executor)
+
+def try_img2img_with_diffusers(prompt: str, init_bytes: bytes | None, strength: float, steps: int, cfg: float, width: int, height: int, seed: int | None = None, negative_prompt: str | None = None) -> Image.Image | None:
     if not _diffusers_available or not init_bytes:
         return None
     try:
-        device_env = os.getenv('TORCH_DEVICE', '').strip().lower()
-        if device_env in ('cuda','gpu') and 'CUDA_VISIBLE_DEVICES' not in os.environ:
-            os.environ['CUDA_VISIBLE_DEVICES'] = '0'
-        device = 'cuda' if (device_env in ('cuda','gpu')) or (hasattr(torch, 'cuda') and torch.cuda.is_available()) else 'cpu'
-        pipe = StableDiffusionXLImg2ImgPipeline.from_pretrained(os.getenv('SDXL_MODEL', 'stabilityai/stable-diffusion-xl-base-1.0'))
-        if device == 'cuda':
-            pipe = pipe.to(device)
-        from PIL import Image as PILImage
-        init_im = PILImage.open(BytesIO(init_bytes)).convert('RGB').resize((width, height))
-        g = pipe(prompt=prompt, image=init_im, strength=max(0.05, min(strength, 0.99)), num_inference_steps=max(1, min(steps, 30)), guidance_scale=max(1.0, min(cfg, 12.0)))
-        im = g.images[0]
-        buf = BytesIO(); im.save(buf, format='PNG'); return buf
+        pipe = load_pipe('img2img')
+        if pipe is None:
+            return None
+        opt_profile.prepare_call(pipe, width, height)
+        init_im = fetcher.decode(init_bytes, 'RGB').resize((width, height))
+        g = pipe(**prompt_kwargs(pipe, prompt, negative_prompt or None), image=init_im, strength=max(0.05, min(strength, 0.99)), num_inference_steps=max(1, min(steps, 30)), guidance_scale=max(1.0, min(cfg, 12.0)), generator=make_generator(seed), **step_kwargs())
+        return g.images[0]
+    except Canceled:
+        raise
     except Exception:
         return None
 
-def try_inpaint_with_diffusers(prompt: str, init_bytes: bytes | None, mask_bytes: bytes | None, steps: int, cfg: float, width: int, height: int) -> BytesIO | None:
+def try_inpaint_with_diffusers(prompt: str, init_bytes: bytes | None, mask_bytes: bytes | None, steps: int, cfg: float, width: int, height: int, seed: int | None = None, negative_prompt: str | None = None) -> Image.Image | None:
     if not _diffusers_available or not init_bytes or not mask_bytes:
         return None
     try:
-        device_env = os.getenv('TORCH_DEVICE', '').strip().lower()
-        if device_env in ('cuda','gpu') and 'CUDA_VISIBLE_DEVICES' not in os.environ:
-            os.environ['CUDA_VISIBLE_DEVICES'] = '0'
-        device = 'cuda' if (device_env in ('cuda','gpu')) or (hasattr(torch, 'cuda') and torch.cuda.is_available()) else 'cpu'
-        pipe = StableDiffusionXLInpaintPipeline.from_pretrained(os.getenv('SDXL_INPAINT_MODEL', 'diffusers/stable-diffusion-xl-1.0-inpainting-0.1'))
-        if device == 'cuda':
-            pipe = pipe.to(device)
-        from PIL import Image as PILImage
-        init_im = PILImage.open(BytesIO(init_bytes)).convert('RGB').resize((width, height))
-        mask_im = PILImage.open(BytesIO(mask_bytes)).convert('L').resize((width, height))
-        g = pipe(prompt=prompt, image=init_im, mask_image=mask_im, num_inference_steps=max(1, min(steps, 30)), guidance_scale=max(1.0, min(cfg, 12.0)))
-        im = g.images[0]
-        buf = BytesIO(); im.save(buf, format='PNG'); return buf
+        pipe = load_pipe('inpaint')
+        if pipe is None:
+            return None
+        opt_profile.prepare_call(pipe, width, height)
+        init_im = fetcher.decode(init_bytes, 'RGB').resize((width, height))
+        mask_im = fetcher.decode(mask_bytes, 'L').resize((width, height))
+        g = pipe(**prompt_kwargs(pipe, prompt, negative_prompt or None), image=init_im, mask_image=mask_im, num_inference_steps=max(1, min(steps, 30)), guidance_scale=max(1.0, min(cfg, 12.0)), generator=make_generator(seed), **step_kwargs())
+        return g.images[0]
+    except Canceled:
+        raise
     except Exception:
         return None
 
-def try_controlnet_canny_with_diffusers(prompt: str, ctrl_bytes: bytes | None, strength: float, steps: int, cfg: float, width: int, height: int) -> BytesIO | None:
-	if not _diffusers_available or not ctrl_bytes:
-		return None
-	try:
-		from diffusers import ControlNetModel, StableDiffusionXLControlNetPipeline
-		import torch
-		from PIL import Image as PILImage
-		import cv2  # type: ignore
-		import numpy as np
-		device_env = os.getenv('TORCH_DEVICE', '').strip().lower()
-		if device_env in ('cuda','gpu') and 'CUDA_VISIBLE_DEVICES' not in os.environ:
-			os.environ['CUDA_VISIBLE_DEVICES'] = '0'
-		device = 'cuda' if (device_env in ('cuda','gpu')) or (hasattr(torch, 'cuda') and torch.cuda.is_available()) else 'cpu'
-		# Prepare canny edge image
-		im = PILImage.open(BytesIO(ctrl_bytes)).convert('RGB').resize((width, height))
-		arr = np.array(im)
-		edges = cv2.Canny(arr, 100, 200)
-		edges_rgb = np.stack([edges, edges, edges], axis=-1)
-		edges_im = PILImage.fromarray(edges_rgb)
-		# Load ControlNet and pipeline
-		cn = ControlNetModel.from_pretrained(os.getenv('SDXL_CN_CANNY_MODEL', 'lllyasviel/sd-controlnet-canny'))
-		pipe = StableDiffusionXLControlNetPipeline.from_pretrained(os.getenv('SDXL_MODEL', 'stabilityai/stable-diffusion-xl-base-1.0'), controlnet=cn)
-		if device == 'cuda':
-			pipe = pipe.to(device)
-		g = pipe(prompt=prompt, image=edges_im, controlnet_conditioning_scale=max(0.0, min(strength, 2.0)), num_inference_steps=max(1, min(steps, 30)), guidance_scale=max(1.0, min(cfg, 12.0)), height=height, width=width)
-		out = g.images[0]
-		buf = BytesIO(); out.save(buf, format='PNG'); return buf
-	except Exception:
-		return None
+def _midas_detector():
+	from controlnet_aux import MidasDetector  # type: ignore
+	return MidasDetector.from_pretrained('intel-isl/MiDaS')
 
-def try_controlnet_depth_with_diffusers(prompt: str, ctrl_bytes: bytes | None, strength: float, steps: int, cfg: float, width: int, height: int) -> BytesIO | None:
-	if not _diffusers_available or not ctrl_bytes:
-		return None
-	try:
-		from diffusers import ControlNetModel, StableDiffusionXLControlNetPipeline
-		import torch
-		from PIL import Image as PILImage
-		import numpy as np
-		# Build depth map via controlnet_aux if available
-		try:
-			from controlnet_aux import MidasDetector  # type: ignore
-			midas = MidasDetector.from_pretrained('intel-isl/MiDaS')
-			im = PILImage.open(BytesIO(ctrl_bytes)).convert('RGB').resize((width, height))
-			depth_im = midas(im)
-		except Exception:
-			# fallback: grayscale as pseudo depth
-			im = PILImage.open(BytesIO(ctrl_bytes)).convert('L').resize((width, height))
-			depth_im = im.convert('RGB')
-		device_env = os.getenv('TORCH_DEVICE', '').strip().lower()
-		if device_env in ('cuda','gpu') and 'CUDA_VISIBLE_DEVICES' not in os.environ:
-			os.environ['CUDA_VISIBLE_DEVICES'] = '0'
-		device = 'cuda' if (device_env in ('cuda','gpu')) or (hasattr(torch, 'cuda') and torch.cuda.is_available()) else 'cpu'
-		cn = ControlNetModel.from_pretrained(os.getenv('SDXL_CN_DEPTH_MODEL', 'lllyasviel/sd-controlnet-depth'))
-		pipe = StableDiffusionXLControlNetPipeline.from_pretrained(os.getenv('SDXL_MODEL', 'stabilityai/stable-diffusion-xl-base-1.0'), controlnet=cn)
-		if device == 'cuda':
-			pipe = pipe.to(device)
-		g = pipe(prompt=prompt, image=depth_im, controlnet_conditioning_scale=max(0.0, min(strength, 2.0)), num_inference_steps=max(1, min(steps, 30)), guidance_scale=max(1.0, min(cfg, 12.0)), height=height, width=width)
-		out = g.images[0]
-		buf = BytesIO(); out.save(buf, format='PNG'); return buf
-	except Exception:
-		return None
+def _openpose_detector():
+	from controlnet_aux import OpenposeDetector  # type: ignore
+	return OpenposeDetector.from_pretrained('lllyasviel/ControlNet')
+
+# Resident ControlNet detectors and an LRU of the control maps they produced
+preprocessors = ControlPreprocessor.from_env({'depth': _midas_detector, 'pose': _openpose_detector}, fetcher.decode)
 
-def try_controlnet_pose_with_diffusers(prompt: str, ctrl_bytes: bytes | None, strength: float, steps: int, cfg: float, width: int, height: int) -> BytesIO | None:
+def try_controlnet_with_diffusers(ctype: str, prompt: str, ctrl_bytes: bytes | None, strength: float, steps: int, cfg: float, width: int, height: int, seed: int | None = None, negative_prompt: str | None = None, params: dict | None = None, preprocessed: bool = False) -> Image.Image | None:
 	if not _diffusers_available or not ctrl_bytes:
 		return None
 	try:
-		from diffusers import ControlNetModel, StableDiffusionXLControlNetPipeline
-		import torch
-		from PIL import Image as PILImage
-		# Build openpose annotation via controlnet_aux if available
-		try:
-			from controlnet_aux import OpenposeDetector  # type: ignore
-			op = OpenposeDetector.from_pretrained('lllyasviel/ControlNet')
-			pose_im = op(PILImage.open(BytesIO(ctrl_bytes)).convert('RGB').resize((width, height)))
-		except Exception:
-			# fallback: use the original image
-			pose_im = PILImage.open(BytesIO(ctrl_bytes)).convert('RGB').resize((width, height))
-		device_env = os.getenv('TORCH_DEVICE', '').strip().lower()
-		if device_env in ('cuda','gpu') and 'CUDA_VISIBLE_DEVICES' not in os.environ:
-			os.environ['CUDA_VISIBLE_DEVICES'] = '0'
-		device = 'cuda' if (device_env in ('cuda','gpu')) or (hasattr(torch, 'cuda') and torch.cuda.is_available()) else 'cpu'
-		cn = ControlNetModel.from_pretrained(os.getenv('SDXL_CN_POSE_MODEL', 'lllyasviel/sd-controlnet-openpose'))
-		pipe = StableDiffusionXLControlNetPipeline.from_pretrained(os.getenv('SDXL_MODEL', 'stabilityai/stable-diffusion-xl-base-1.0'), controlnet=cn)
-		if device == 'cuda':
-			pipe = pipe.to(device)
-		g = pipe(prompt=prompt, image=pose_im, controlnet_conditioning_scale=max(0.0, min(strength, 2.0)), num_inference_steps=max(1, min(steps, 30)), guidance_scale=max(1.0, min(cfg, 12.0)), height=height, width=width)
-		out = g.images[0]
-		buf = BytesIO(); out.save(buf, format='PNG'); return buf
+		ctrl_im = preprocessors.run(ctype, ctrl_bytes, width, height, params, preprocessed)[0].image
+		pipe = load_pipe('controlnet', ctype)
+		if pipe is None:
+			return None
+		opt_profile.prepare_call(pipe, width, height)
+		g = pipe(**prompt_kwargs(pipe, prompt, negative_prompt or None), image=ctrl_im, controlnet_conditioning_scale=max(0.0, min(strength, 2.0)), num_inference_steps=max(1, min(steps, 30)), guidance_scale=max(1.0, min(cfg, 12.0)), height=height, width=width, generator=make_generator(seed), **step_kwargs())
+		return g.images[0]
+	except Canceled:
+		raise
 	except Exception:
 		return None
 
 def fetch_bytes(url: str) -> bytes | None:
-    try:
-        if not is_allowed_url(url):
-            return None
-        if url and (url.startswith('http://') or url.startswith('https://')):
-            r = requests.get(url, timeout=10)
-            r.raise_for_status()
-            return r.content
-    except Exception:
-        return None
-    return None
+	return fetcher.fetch(url)
+
+@app.post('/cancel/{job_id}')
+async def cancel(job_id: str):
+	# Local flag for this replica; the API also sets cancel:{jobId} in Redis for all of them
+	cancels.cancel(job_id)
+	return {"job_id": job_id, "canceled": True}
+
+WARMUP_STEPS = int(os.getenv('WARMUP_STEPS', '2'))
+
+def warm_txt2img(pipe):
+	# One short call at the default size: CUDA context, cuDNN autotune and torch.compile
+	# graphs are set up here instead of on the first request
+	width, height = choose_dims(None, False)
+	opt_profile.prepare_call(pipe, width, height)
+	prompt_cache.precompute(pipe, PROMPT_CACHE_NEGATIVES)
+	pipe(**prompt_kwargs(pipe, 'warmup', None), num_inference_steps=WARMUP_STEPS, guidance_scale=5.0, width=width, height=height)
+
+# Models loaded (and warmed) at startup; /ready turns true once all of them are
+warmup = Warmup.from_env({
+	'txt2img': load_pipe,
+	'img2img': lambda: load_pipe('img2img'),
+	'inpaint': lambda: load_pipe('inpaint'),
+	'controlnet-canny': lambda: load_pipe('controlnet', 'canny'),
+	'controlnet-depth': lambda: load_pipe('controlnet', 'depth'),
+	'controlnet-pose': lambda: load_pipe('controlnet', 'pose'),
+	'preprocess-depth': lambda: preprocessors.detector('depth'),
+	'preprocess-pose': lambda: preprocessors.detector('pose'),
+	'safety': lambda: safety_scorer if safety_scorer.load() else None,
+}, {
+	'txt2img': warm_txt2img,
+	'inpaint': lambda pipe: prompt_cache.precompute(pipe, PROMPT_CACHE_NEGATIVES),
+	'safety': lambda scorer: scorer.score_one(make_image(256, 256)),
+}, default='txt2img,safety')
+
+@app.on_event('startup')
+async def warm_models():
+	# Loads in the background so /health answers while weights download
+	asyncio.ensure_future(warmup.serve(executor.run))
+
+@app.get('/ready')
+async def ready():
+	status = warmup.status()
+	return JSONResponse(status, status_code=200 if status['ready'] else 503)
+
+@app.post('/debug/profile')
+async def debug_profile(request: Request):
+	return await profiler.post(request, executor.io)
+
+@app.get('/debug/profile')
+async def debug_profile_status(request: Request):
+	return profiler.get(request)
+
+@app.get('/metrics')
+async def metrics_endpoint():
+	return Response(metrics.render(), media_type=CONTENT_TYPE)
 
 @app.get('/health')
 async def health():
-	return {"ok": True, "model": MODEL_ID}
+	return {"ok": True, "model": MODEL_ID, "models": registry.stats(), "batching": txt2img_batcher.stats(), "executor": executor.stats(), "result_cache": result_cache.stats(), "safety": safety_scorer.stats(), "fetch": fetcher.stats(), "attention": {"enabled": ATTENTION_CAPTURE, **attention_tap.stats()}, "progress": {"every": PROGRESS_EVERY, **progress.stats()}, "cancel": cancels.stats(), "optimization": opt_profile.describe(), "memory": memory_planner.stats(), "prompt_cache": prompt_cache.stats(), "preprocess": preprocessors.stats(), "warmup": warmup.status()}
+
+def control_options(ctrl: dict) -> dict:
+	# Preprocessor params and the preprocessed flag, only when a request sets them
+	out = {}
+	if ctrl.get('params') and ctrl.get('type') in CONTROL_TYPES:
+		out["params"] = normalize_params(ctrl['type'], ctrl['params'])
+	if ctrl.get('preprocessed'):
+		out["preprocessed"] = True
+	return out
+
+def request_cache_key(task: str, body: dict, w: int, h: int, inputs: list[bytes | None]) -> str | None:
+	# Only seeded requests are deterministic; everything else is recomputed
+	seed = body.get('seed')
+	if seed is None or not result_cache.enabled:
+		return None
+	ctrl = body.get('controlnet') or {}
+	model = SDXL_INPAINT_MODEL if task == 'inpaint' else SDXL_MODEL
+	if task == 'controlnet':
+		model = f"{model}+{CONTROLNET_MODELS.get(ctrl.get('type'), '')}"
+	# Results differ by precision, and the index is shared by replicas that may run other profiles
+	device = opt_profile.resolve_device(resolve_device()) if _diffusers_available else 'cpu'
+	return cache_key({
+		"task": task,
+		"model_hash": f"{MODEL_ID}:{model}",
+		"profile": opt_profile.name,
+		"dtype": opt_profile.dtype_name(device),
+		"prompt": body.get('prompt', ''),
+		"negative_prompt": body.get('negativePrompt') or '',
+		"width": w,
+		"height": h,
+		"steps": int(body.get('steps', 20) or 20),
+		"cfg": float(body.get('cfg', 7.0) or 7.0),
+		"seed": int(seed),
+		"strength": float(body.get('strength', 0.6)) if task == 'img2img' else None,
+		"controlnet": {"type": ctrl.get('type'), "strength": float(ctrl.get('strength') or 1.0), **control_options(ctrl)} if task == 'controlnet' else None,
+		"inputs": [sha256_or_none(b) for b in inputs],
+		"format": output_settings.fmt,
+	})
+
+def cache_info(ckey: str | None, hit: bool) -> dict:
+	return {"hit": hit, "key": ckey, "hit_rate": result_cache.hit_rate()}
+
+async def redacted_previews(mode: int, safety: dict) -> list[dict]:
+	if mode == 2 or not safety.get('nsfw', 0) >= NSFW_THRESHOLD:
+		return []
+	enc = await executor.run(encode_preview, make_image(64, 64, color=(64, 64, 64)), output_settings)
+	pkey = f"gen/redacted_{random.randint(0, 1_000_000)}.{enc.ext}"
+	return [{"url": await executor.io(upload_encoded, pkey, enc), **enc.meta()}]
+
+async def cached_result(ckey: str | None, mode: int) -> dict | None:
+	if ckey is None:
+		return None
+	entry = await executor.io(result_cache.lookup, ckey)
+	if entry is None:
+		return None
+	safety = entry.get('safety_scores') or {}
+	previews = await redacted_previews(mode, safety)
+	return {"output_url": entry.get('output_url'), "preview_urls": [p['url'] for p in previews], "preview_meta": previews, "model_hash": entry.get('model_hash', MODEL_ID), "safety_scores": safety, "image_meta": entry.get('image_meta'), "cache": cache_info(ckey, True)}
+
+async def image_safety(im: Image.Image, score_img: float | None) -> float:
+	if score_img is not None:
+		return score_img
+	return await executor.run(safety_scorer.score_one, im)
+
+async def publish_image(task: str, im: Image.Image, prompt: str, ckey: str | None, score_img: float | None = None) -> tuple[str, dict, dict]:
+	# Encode once (hashing as the encoder writes); safety scores the decoded image already in hand
+	# unless the batch runner already scored it
+	enc = await executor.run(encode_output, im, output_settings)
+	meta = enc.meta()
+	safety = simple_safety_from_prompt(prompt)
+	if ckey is None:
+		key = f"gen/{task}_{random.randint(0, 1_000_000)}.{enc.ext}"
+		url, score_img = await asyncio.gather(executor.io(upload_encoded, key, enc), image_safety(im, score_img))
+		safety["nsfw"] = max(float(safety.get("nsfw", 0.0)), float(score_img))
+		return url, meta, safety
+	# Cached objects carry their full response as metadata, so score before uploading
+	score_img = await image_safety(im, score_img)
+	safety["nsfw"] = max(float(safety.get("nsfw", 0.0)), float(score_img))
+	entry = {"output_url": result_cache.url(ckey, enc.ext), "image_meta": meta, "safety_scores": safety, "model_hash": MODEL_ID}
+	url = await executor.io(upload_encoded, result_cache.object_key(ckey, enc.ext), enc, result_cache.metadata(entry))
+	result_cache.store(ckey, entry)
+	return url, meta, safety
 
 @app.post('/infer/txt2img')
+@executor.admitted_handler
+@cancels.handler
+@metrics.instrument('txt2img')
 async def txt2img(request: Request):
 	body = await request.json()
+	cancels.check(hook_ids(body)['job_id'])
 	prompt = body.get('prompt', '')
+	negative = body.get('negativePrompt')
+	seed = body.get('seed')
 	steps = int(body.get('steps', 20))
 	cfg = float(body.get('cfg', 7.0))
 	aspect = body.get('aspect')
 	preview = bool(body.get('preview', False))
 	mode = int(body.get('mode', 1))
 	w, h = choose_dims(aspect, preview)
-	attempt = 0
-	while True:
-		try:
-			buf = try_generate_with_diffusers(prompt, w, h, steps, cfg) or make_image(w, h, color=(0, 0, 0))
-			break
-		except RuntimeError:
-			attempt += 1
-			if attempt > 2:
-				raise
-			w //= 2
-			h //= 2
-	key = f"gen/txt2img_{random.randint(0, 1_000_000)}.png"
-	url = upload_png(key, buf)
-	meta = image_meta(buf, w, h)
-	safety = simple_safety_from_prompt(prompt)
-	try:
-		buf.seek(0)
-		img_chk = Image.open(buf).convert('RGB')
-		score_img = safety_score_image(img_chk)
-		safety["nsfw"] = max(float(safety.get("nsfw", 0.0)), float(score_img))
-	except Exception:
-		pass
-	previews = []
-	if mode != 2 and safety.get('nsfw', 0) > 0:
-		red = make_image(64, 64, color=(64, 64, 64))
-		pkey = f"gen/redacted_{random.randint(0, 1_000_000)}.png"
-		purl = upload_png(pkey, red)
-		previews = [purl]
-	return {"output_url": url, "preview_urls": previews, "model_hash": MODEL_ID, "duration_ms": 1, "safety_scores": safety, "image_meta": meta, "echo": {"prompt": prompt, "steps": steps, "cfg": cfg}}
+	label(model=MODEL_ID, resolution=f"{w}x{h}")
+	echo = {"prompt": prompt, "steps": steps, "cfg": cfg, "seed": seed}
+	ckey = request_cache_key('txt2img', body, w, h, [])
+	hit = await cached_result(ckey, mode)
+	if hit is not None:
+		return {**hit, "echo": echo}
+	batch_key = (w, h, max(1, min(steps, 20)), max(1.0, min(cfg, 12.0)), SDXL_MODEL)
+	item_seed = int(seed) if seed is not None else random.randint(0, 2**32 - 1)
+	im, score_img, attn, plan, shared = await txt2img_batcher.submit(batch_key, {"prompt": prompt, "negative_prompt": negative, "seed": item_seed, **hook_ids(body)})
+	current().merge(shared)
+	# Canceled while sharing a batch with requests that were not
+	cancels.check(hook_ids(body)['job_id'])
+	echo["memory"] = plan
+	degraded = im is None
+	# Placeholders and upscaled lower-resolution results are never cached
+	if degraded or plan['upscaled']:
+		ckey = None
+	if degraded:
+		im, score_img = make_image(w, h, color=(0, 0, 0)), 0.0
+	(url, meta, safety), _ = await asyncio.gather(publish_image('txt2img', im, prompt, ckey, score_img), executor.io(store_attention, body.get('generationId'), attn))
+	previews = await redacted_previews(mode, safety)
+	return {"output_url": url, "preview_urls": [p['url'] for p in previews], "preview_meta": previews, "model_hash": MODEL_ID, "safety_scores": safety, "image_meta": meta, "cache": cache_info(ckey, False), "degraded": degraded, "echo": echo}
 
 @app.post('/infer/img2img')
+@executor.admitted_handler
+@cancels.handler
+@metrics.instrument('img2img')
 async def img2img(request: Request):
 	body = await request.json()
+	cancels.check(hook_ids(body)['job_id'])
 	prompt = body.get('prompt', '')
 	init_url = body.get('initImageUrl')
 	aspect = body.get('aspect')
 	preview = bool(body.get('preview', False))
 	mode = int(body.get('mode', 1))
 	w, h = choose_dims(aspect, preview)
-	init_bytes = fetch_bytes(init_url or '')
-	buf = try_img2img_with_diffusers(prompt, init_bytes, float(body.get('strength', 0.6)), int(body.get('steps', 20)), float(body.get('cfg', 7.0)), w, h) or make_image(w, h, color=(10, 10, 10))
-	key = f"gen/img2img_{random.randint(0, 1_000_000)}.png"
-	url = upload_png(key, buf)
-	meta = image_meta(buf, w, h)
-	safety = simple_safety_from_prompt(prompt)
-	try:
-		buf.seek(0)
-		img_chk = Image.open(buf).convert('RGB')
-		score_img = safety_score_image(img_chk)
-		safety["nsfw"] = max(float(safety.get("nsfw", 0.0)), float(score_img))
-	except Exception:
-		pass
-	previews = []
-	if mode != 2 and safety.get('nsfw', 0) > 0:
-		red = make_image(64, 64, color=(64, 64, 64))
-		pkey = f"gen/redacted_{random.randint(0, 1_000_000)}.png"
-		purl = upload_png(pkey, red)
-		previews = [purl]
-	init_bytes = fetch_bytes(init_url or '')
-	return {"output_url": url, "preview_urls": previews, "safety_scores": safety, "image_meta": meta, "echo": {"initImageUrl": init_url, "initImageBytes": bool(init_bytes)}}
+	label(model=MODEL_ID, resolution=f"{w}x{h}")
+	init_bytes = await executor.io(fetch_bytes, init_url or '')
+	echo = {"initImageUrl": init_url, "initImageBytes": bool(init_bytes)}
+	ckey = request_cache_key('img2img', body, w, h, [init_bytes])
+	hit = await cached_result(ckey, mode)
+	if hit is not None:
+		return {**hit, "echo": echo}
+	im, attn = await executor.run(with_hooks, hook_ids(body), prompt, w, h, int(body.get('steps', 20) or 20), try_img2img_with_diffusers, prompt, init_bytes, float(body.get('strength', 0.6)), int(body.get('steps', 20)), float(body.get('cfg', 7.0)), w, h, body.get('seed'), body.get('negativePrompt'))
+	if im is None:
+		ckey = None
+		im = make_image(w, h, color=(10, 10, 10))
+	(url, meta, safety), _ = await asyncio.gather(publish_image('img2img', im, prompt, ckey), executor.io(store_attention, body.get('generationId'), attn))
+	previews = await redacted_previews(mode, safety)
+	return {"output_url": url, "preview_urls": [p['url'] for p in previews], "preview_meta": previews, "safety_scores": safety, "image_meta": meta, "cache": cache_info(ckey, False), "echo": echo}
 
 @app.post('/infer/inpaint')
+@executor.admitted_handler
+@cancels.handler
+@metrics.instrument('inpaint')
 async def inpaint(request: Request):
 	body = await request.json()
+	cancels.check(hook_ids(body)['job_id'])
 	prompt = body.get('prompt', '')
 	mask_url = body.get('maskUrl')
 	aspect = body.get('aspect')
 	preview = bool(body.get('preview', False))
 	mode = int(body.get('mode', 1))
 	w, h = choose_dims(aspect, preview)
+	label(model=f"{MODEL_ID}-inpaint", resolution=f"{w}x{h}")
 	init_url = body.get('initImageUrl')
-	init_bytes = fetch_bytes(init_url or '')
-	mask_bytes = fetch_bytes(mask_url or '')
-	buf = try_inpaint_with_diffusers(prompt, init_bytes, mask_bytes, int(body.get('steps', 20)), float(body.get('cfg', 7.0)), w, h) or make_image(w, h, color=(20, 20, 20))
-	key = f"gen/inpaint_{random.randint(0, 1_000_000)}.png"
-	url = upload_png(key, buf)
-	meta = image_meta(buf, w, h)
-	safety = simple_safety_from_prompt(prompt)
-	try:
-		buf.seek(0)
-		img_chk = Image.open(buf).convert('RGB')
-		score_img = safety_score_image(img_chk)
-		safety["nsfw"] = max(float(safety.get("nsfw", 0.0)), float(score_img))
-	except Exception:
-		pass
-	previews = []
-	if mode != 2 and safety.get('nsfw', 0) > 0:
-		red = make_image(64, 64, color=(64, 64, 64))
-		pkey = f"gen/redacted_{random.randint(0, 1_000_000)}.png"
-		purl = upload_png(pkey, red)
-		previews = [purl]
-	return {"output_url": url, "preview_urls": previews, "safety_scores": safety, "image_meta": meta, "echo": {"maskUrl": mask_url, "initImageUrl": init_url, "usedDiffusers": buf is not None}}
+	init_bytes, mask_bytes = await asyncio.gather(executor.io(fetch_bytes, init_url or ''), executor.io(fetch_bytes, mask_url or ''))
+	ckey = request_cache_key('inpaint', body, w, h, [init_bytes, mask_bytes])
+	hit = await cached_result(ckey, mode)
+	if hit is not None:
+		return {**hit, "echo": {"maskUrl": mask_url, "initImageUrl": init_url, "usedDiffusers": True}}
+	im, attn = await executor.run(with_hooks, hook_ids(body), prompt, w, h, int(body.get('steps', 20) or 20), try_inpaint_with_diffusers, prompt, init_bytes, mask_bytes, int(body.get('steps', 20)), float(body.get('cfg', 7.0)), w, h, body.get('seed'), body.get('negativePrompt'))
+	used = im is not None
+	if im is None:
+		ckey = None
+		im = make_image(w, h, color=(20, 20, 20))
+	(url, meta, safety), _ = await asyncio.gather(publish_image('inpaint', im, prompt, ckey), executor.io(store_attention, body.get('generationId'), attn))
+	previews = await redacted_previews(mode, safety)
+	return {"output_url": url, "preview_urls": [p['url'] for p in previews], "preview_meta": previews, "safety_scores": safety, "image_meta": meta, "cache": cache_info(ckey, False), "echo": {"maskUrl": mask_url, "initImageUrl": init_url, "usedDiffusers": used}}
 
 @app.post('/infer/controlnet')
+@executor.admitted_handler
+@cancels.handler
+@metrics.instrument('controlnet')
 async def controlnet(request: Request):
 	body = await request.json()
+	cancels.check(hook_ids(body)['job_id'])
 	prompt = body.get('prompt', '')
 	ctrl = body.get('controlnet', {})
 	ctype = ctrl.get('type')
@@ -415,44 +693,50 @@ async def controlnet(request: Request):
 	preview = bool(body.get('preview', False))
 	mode = int(body.get('mode', 1))
 	w, h = choose_dims(aspect, preview)
-	buf = None
+	label(model=f"{MODEL_ID}+{ctype}", resolution=f"{w}x{h}")
+	im, attn = None, None
 	ctrl_img_url = (ctrl or {}).get('imageUrl')
-	if ctype == 'canny':
-		ctrl_bytes = fetch_bytes(ctrl_img_url or '')
+	ctrl_bytes = await executor.io(fetch_bytes, ctrl_img_url or '') if ctype in CONTROL_TYPES else None
+	ckey = request_cache_key('controlnet', body, w, h, [ctrl_bytes]) if ctype in CONTROL_TYPES else None
+	hit = await cached_result(ckey, mode)
+	if hit is not None:
+		return {**hit, "echo": {"controlnet": ctrl, "usedDiffusers": True}}
+	if ctype in CONTROL_TYPES:
 		try:
 			# will return None if unavailable
-			buf = try_controlnet_canny_with_diffusers(prompt, ctrl_bytes, float((ctrl or {}).get('strength') or 1.0), int(body.get('steps', 20) or 20), float(body.get('cfg', 7.0) or 7.0), w, h)
+			im, attn = await executor.run(with_hooks, hook_ids(body), prompt, w, h, int(body.get('steps', 20) or 20), try_controlnet_with_diffusers, ctype, prompt, ctrl_bytes, float((ctrl or {}).get('strength') or 1.0), int(body.get('steps', 20) or 20), float(body.get('cfg', 7.0) or 7.0), w, h, body.get('seed'), body.get('negativePrompt'), ctrl.get('params'), bool(ctrl.get('preprocessed')))
 		except Exception:
-			buf = None
-	elif ctype == 'depth':
-		ctrl_bytes = fetch_bytes(ctrl_img_url or '')
-		try:
-			buf = try_controlnet_depth_with_diffusers(prompt, ctrl_bytes, float((ctrl or {}).get('strength') or 1.0), int(body.get('steps', 20) or 20), float(body.get('cfg', 7.0) or 7.0), w, h)
-		except Exception:
-			buf = None
-	elif ctype == 'pose':
-		ctrl_bytes = fetch_bytes(ctrl_img_url or '')
-		try:
-			buf = try_controlnet_pose_with_diffusers(prompt, ctrl_bytes, float((ctrl or {}).get('strength') or 1.0), int(body.get('steps', 20) or 20), float(body.get('cfg', 7.0) or 7.0), w, h)
-		except Exception:
-			buf = None
-	# Fallback placeholder
-	buf = buf or make_image(w, h, color=(30, 30, 30))
-	key = f"gen/controlnet_{ctype or 'none'}_{random.randint(0, 1_000_000)}.png"
-	url = upload_png(key, buf)
-	meta = image_meta(buf, w, h)
-	safety = simple_safety_from_prompt(prompt)
+			im = None
+	used = im is not None
+	if im is None:
+		ckey = None
+		# Fallback placeholder
+		im = make_image(w, h, color=(30, 30, 30))
+	(url, meta, safety), _ = await asyncio.gather(publish_image(f"controlnet_{ctype or 'none'}", im, prompt, ckey), executor.io(store_attention, body.get('generationId'), attn))
+	previews = await redacted_previews(mode, safety)
+	return {"output_url": url, "preview_urls": [p['url'] for p in previews], "preview_meta": previews, "safety_scores": safety, "image_meta": meta, "cache": cache_info(ckey, False), "echo": {"controlnet": ctrl, "usedDiffusers": used}}
+
+@app.post('/preprocess')
+@executor.admitted_handler
+@metrics.instrument('preprocess')
+async def preprocess(request: Request):
+	# The control map /infer/controlnet would compute, uploaded for reuse: send its map_url back as
+	# controlnet.imageUrl with "preprocessed": true (same aspect/preview) to skip preprocessing
+	body = await request.json()
+	ctype = body.get('type')
+	if ctype not in CONTROL_TYPES:
+		raise HTTPException(status_code=400, detail=f"type must be one of {', '.join(CONTROL_TYPES)}")
+	w, h = choose_dims(body.get('aspect'), bool(body.get('preview', False)))
+	label(model=ctype, resolution=f"{w}x{h}")
+	data = await executor.io(fetch_bytes, body.get('imageUrl') or '')
+	if not data:
+		raise HTTPException(status_code=400, detail="imageUrl could not be fetched")
 	try:
-		buf.seek(0)
-		img_chk = Image.open(buf).convert('RGB')
-		score_img = safety_score_image(img_chk)
-		safety["nsfw"] = max(float(safety.get("nsfw", 0.0)), float(score_img))
-	except Exception:
-		pass
-	previews = []
-	if mode != 2 and safety.get('nsfw', 0) > 0:
-		red = make_image(64, 64, color=(64, 64, 64))
-		pkey = f"gen/redacted_{random.randint(0, 1_000_000)}.png"
-		purl = upload_png(pkey, red)
-		previews = [purl]
-	return {"output_url": url, "preview_urls": previews, "safety_scores": safety, "image_meta": meta, "echo": {"controlnet": ctrl, "usedDiffusers": buf is not None}}
+		cmap, hit = await executor.run(preprocessors.run, ctype, data, w, h, body.get('params'))
+	except Exception as e:
+		raise HTTPException(status_code=422, detail=f"{type(e).__name__}: {e}"[:200])
+	if cmap.url is None:
+		# Content-addressed, so replicas computing the same map write the same object
+		enc = await executor.run(encode_image, cmap.image, 'png', output_settings.png_compress_level)
+		cmap.url = await executor.io(upload_encoded, f"gen/preprocess/{cmap.digest}.png", enc)
+	return {"map_url": cmap.url, **cmap.describe(), "cache": {"hit": hit}}
@@ -0,0 +1,225 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+from common.metrics import gpu_high_water
+
+# Activation memory of one SDXL call, on top of whatever weights are already resident. The
+# UNet phase scales with batch x latent pixels (x2 for classifier-free guidance); the VAE
+# decode phase scales with decoded pixels, capped at one tile when tiling and at one image
+# when slicing. Denoising steps do not change the peak, only the time.
+DEFAULT_COEFFICIENTS = {
+	# bytes per latent pixel per UNet row at 2-byte precision (SDPA attention): ~2.5 GB at 1024px
+	'unet_bytes_per_latent_px': 80_000,
+	# sliced attention trades speed for a smaller UNet working set
+	'attention_slicing_factor': 0.6,
+	# bytes per output pixel in the VAE decoder; the SDXL VAE upcasts to fp32
+	'vae_bytes_per_px': 3_500,
+	# decoded pixels per VAE tile
+	'vae_tile_px': 512 * 512,
+}
+
+# Decisions in the order they are tried; 'placeholder' means nothing fitted
+ACTIONS = ('direct', 'tiled', 'chunked', 'downscaled', 'placeholder')
+
+
+class Plan:
+	def __init__(self, action: str, width: int, height: int, target_width: int, target_height: int, chunk: int, tiling: bool | None, slicing: bool | None, estimate_bytes: int, budget_bytes: int | None, reason: str | None = None):
+		self.action = action
+		# Why a placeholder is served: memory, oom, unavailable (no pipeline) or error
+		self.reason = reason
+		# Dimensions to generate at; the result is resized to the target afterwards
+		self.width = width
+		self.height = height
+		self.target_width = target_width
+		self.target_height = target_height
+		# Items per pipeline call
+		self.chunk = chunk
+		# VAE tiling/slicing for the call; None leaves the optimization profile's choice
+		self.tiling = tiling
+		self.slicing = slicing
+		self.estimate_bytes = estimate_bytes
+		self.budget_bytes = budget_bytes
+
+	@property
+	def upscaled(self) -> bool:
+		return (self.width, self.height) != (self.target_width, self.target_height)
+
+	@property
+	def degraded(self) -> bool:
+		return self.action == 'placeholder'
+
+	def describe(self) -> dict:
+		mb = lambda b: None if b is None else round(b / (1024 * 1024), 1)
+		return {
+			"action": self.action,
+			"reason": self.reason,
+			"width": self.width,
+			"height": self.height,
+			"upscaled": self.upscaled,
+			"chunk": self.chunk,
+			"vae_tiling": self.tiling,
+			"vae_slicing": self.slicing,
+			"estimate_mb": mb(self.estimate_bytes),
+			"budget_mb": mb(self.budget_bytes),
+		}
+
+
+class MemoryPlanner:
+	# Chooses how to run a txt2img batch within the device memory that is free right now:
+	# directly, with a tiled/sliced VAE decode, in smaller chunks, or at a lower resolution
+	# (upscaled afterwards). Estimates come from DEFAULT_COEFFICIENTS (optionally replaced by
+	# a calibration file) times a correction factor learned from measured peaks and OOMs.
+	def __init__(self, coefficients: dict | None = None, headroom_bytes: int = 512 * 1024 * 1024, budget_bytes: int | None = None, min_side: int = 512, multiple: int = 64):
+		self.coefficients = {**DEFAULT_COEFFICIENTS, **(coefficients or {})}
+		self.headroom_bytes = headroom_bytes
+		self.budget_bytes = budget_bytes
+		self.min_side = min_side
+		self.multiple = multiple
+		self._lock = threading.Lock()
+		# observed/estimated peak, per (tiled, slicing) decode mode
+		self._correction: dict[tuple, float] = {}
+		self.decisions = {a: 0 for a in ACTIONS}
+		self.observed = 0
+		self.ooms = 0
+
+	@classmethod
+	def from_env(cls) -> 'MemoryPlanner':
+		coefficients = {}
+		path = os.getenv('MEMORY_CALIBRATION')
+		if path:
+			try:
+				with open(path) as f:
+					coefficients = {k: float(v) for k, v in json.load(f).items() if k in DEFAULT_COEFFICIENTS}
+			except Exception:
+				coefficients = {}
+		budget = os.getenv('MEMORY_BUDGET_MB')
+		return cls(
+			coefficients,
+			headroom_bytes=int(float(os.getenv('MEMORY_HEADROOM_MB', '512')) * 1024 * 1024),
+			budget_bytes=int(float(budget) * 1024 * 1024) if budget else None,
+			min_side=int(os.getenv('MEMORY_MIN_SIDE', '512')),
+		)
+
+	def estimate(self, width: int, height: int, batch: int, dtype_bytes: int = 2, attention_slicing: bool = False, tiling: bool = False, slicing: bool = False) -> int:
+		c = self.coefficients
+		unet = 2 * batch * (width // 8) * (height // 8) * c['unet_bytes_per_latent_px'] * (dtype_bytes / 2)
+		if attention_slicing:
+			unet *= c['attention_slicing_factor']
+		decoded = (1 if slicing else batch) * min(width * height, c['vae_tile_px'] if tiling else width * height)
+		vae = decoded * c['vae_bytes_per_px']
+		return int(max(unet, vae) * self._correction.get((tiling, slicing), 1.0))
+
+	def available(self, device: str) -> int | None:
+		# Free device memory for activations (None: no limit known, e.g. on CPU)
+		if self.budget_bytes is not None:
+			return self.budget_bytes
+		if device != 'cuda':
+			return None
+		try:
+			import torch
+			free, _total = torch.cuda.mem_get_info()
+			# Blocks cached by the allocator but not in use are free to this process too
+			cached = torch.cuda.memory_reserved() - torch.cuda.memory_allocated()
+			return max(0, int(free + cached - self.headroom_bytes))
+		except Exception:
+			return None
+
+	def _scaled(self, width: int, height: int, scale: float) -> tuple[int, int]:
+		m = self.multiple
+		return max(m, int(width * scale) // m * m), max(m, int(height * scale) // m * m)
+
+	def plan(self, width: int, height: int, batch: int, budget: int | None, dtype_bytes: int = 2, attention_slicing: bool = False, extra_bytes: int = 0) -> Plan:
+		# extra_bytes: weights that are moved onto the device for the call (CPU offload)
+		est = lambda w, h, n, tiled: self.estimate(w, h, n, dtype_bytes, attention_slicing, tiled, tiled) + extra_bytes
+		plan = None
+		if budget is None or est(width, height, batch, False) <= budget:
+			plan = Plan('direct', width, height, width, height, batch, None, None, est(width, height, batch, False), budget)
+		elif est(width, height, batch, True) <= budget:
+			plan = Plan('tiled', width, height, width, height, batch, True, True, est(width, height, batch, True), budget)
+		if plan is None:
+			for n in range(batch - 1, 0, -1):
+				if est(width, height, n, True) <= budget:
+					plan = Plan('chunked', width, height, width, height, n, True, True, est(width, height, n, True), budget)
+					break
+		if plan is None:
+			# Largest multiple-of-64 size with the requested aspect ratio that fits one item
+			scale = 1.0
+			while plan is None:
+				scale *= 0.875
+				w, h = self._scaled(width, height, scale)
+				if min(w, h) < min(self.min_side, min(width, height)):
+					break
+				if est(w, h, 1, True) <= budget:
+					plan = Plan('downscaled', w, h, width, height, 1, True, True, est(w, h, 1, True), budget)
+		if plan is None:
+			return self.placeholder(width, height, batch, 'memory', est(width, height, 1, True), budget)
+		with self._lock:
+			self.decisions[plan.action] += 1
+		return plan
+
+	def placeholder(self, width: int, height: int, batch: int, reason: str, estimate_bytes: int = 0, budget: int | None = None) -> Plan:
+		with self._lock:
+			self.decisions['placeholder'] += 1
+		return Plan('placeholder', width, height, width, height, batch, None, None, estimate_bytes, budget, reason)
+
+	def observe(self, plan: Plan, batch: int, peak_bytes: int, dtype_bytes: int = 2, attention_slicing: bool = False, extra_bytes: int = 0) -> None:
+		# Measured peak of a finished call above what was allocated before it; moves the
+		# correction for its decode mode a quarter of the way towards observed/estimated
+		mode = (bool(plan.tiling), bool(plan.slicing))
+		raw = self.estimate(plan.width, plan.height, batch, dtype_bytes, attention_slicing, *mode) / self._correction.get(mode, 1.0)
+		peak_bytes -= extra_bytes
+		if raw <= 0 or peak_bytes <= 0:
+			return
+		with self._lock:
+			current = self._correction.get(mode, 1.0)
+			self._correction[mode] = min(4.0, max(0.25, current + 0.25 * (peak_bytes / raw - current)))
+			self.observed += 1
+
+	def out_of_memory(self, plan: Plan) -> None:
+		# The call needed more than the budget it was planned against: raise the correction so
+		# the same request plans one step further down next time
+		mode = (bool(plan.tiling), bool(plan.slicing))
+		with self._lock:
+			current = self._correction.get(mode, 1.0)
+			ratio = (plan.budget_bytes or 0) / plan.estimate_bytes if plan.estimate_bytes else 1.0
+			self._correction[mode] = min(4.0, max(current * 1.25, current * ratio * 1.1))
+			self.ooms += 1
+
+	def stats(self) -> dict:
+		return {
+			"decisions": dict(self.decisions),
+			"observed": self.observed,
+			"ooms": self.ooms,
+			"correction": {f"{'tiled' if t else 'full'}{'+sliced' if s else ''}": round(v, 3) for (t, s), v in self._correction.items()},
+			"budget_mb": None if self.budget_bytes is None else round(self.budget_bytes / (1024 * 1024), 1),
+		}
+
+
+def is_out_of_memory(exc: BaseException) -> bool:
+	# torch.cuda.OutOfMemoryError (a RuntimeError subclass) or an allocator RuntimeError
+	if isinstance(exc, MemoryError) or type(exc).__name__ == 'OutOfMemoryError':
+		return True
+	return isinstance(exc, RuntimeError) and 'out of memory' in str(exc).lower()
+
+
+@contextmanager
+def device_peak(device: str):
+	# Yields a dict whose peak_bytes is set to the CUDA allocation high-water mark above the
+	# memory allocated when the block started (0 off-CUDA or if the block raised)
+	out = {"peak_bytes": 0}
+	if device != 'cuda':
+		yield out
+		return
+	try:
+		import torch
+		before = torch.cuda.memory_allocated()
+		# Keep the process-wide high-water mark reported on /metrics before resetting it
+		gpu_high_water.sample()
+		torch.cuda.reset_peak_memory_stats()
+	except Exception:
+		yield out
+		return
+	yield out
+	out["peak_bytes"] = max(0, torch.cuda.max_memory_allocated() - before)
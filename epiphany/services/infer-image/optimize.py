@@ -0,0 +1,174 @@
+import os
+from typing import Any
+
+# Named optimization profiles for the SDXL pipelines. Every pipeline the service builds goes
+# through one profile: dtype at load, then attention/VAE/offload/layout settings, then
+# (optionally) torch.compile once any processor changes (such as the attention tap) are in.
+PROFILES: dict[str, dict] = {
+	# fp16 on CUDA, fp32 on CPU, SDPA attention; VAE tiling only for large outputs
+	'default': {},
+	# Throughput on cards with headroom: channels-last UNet/VAE and a compiled UNet
+	'fast': {'dtype': 'fp16', 'channels_last': True, 'compile': True},
+	# 8-12 GB cards: sliced attention and VAE, models moved to the GPU one at a time
+	'low-vram': {'dtype': 'fp16', 'attention': 'slicing', 'vae_slicing': True, 'vae_tiling': 'on', 'offload': 'model'},
+	# Smallest footprint: layers streamed to the GPU as they run (slow)
+	'minimal-vram': {'dtype': 'fp16', 'attention': 'slicing', 'vae_slicing': True, 'vae_tiling': 'on', 'offload': 'sequential'},
+	# CPU-only reference profiles; cpu-bf16 is what CI benchmarks
+	'cpu': {'device': 'cpu', 'dtype': 'fp32'},
+	'cpu-bf16': {'device': 'cpu', 'dtype': 'bf16', 'channels_last': True},
+}
+
+DTYPES = ('auto', 'fp32', 'fp16', 'bf16')
+ATTENTION = ('sdpa', 'slicing')
+VAE_TILING = ('auto', 'on', 'off')
+OFFLOAD = ('none', 'model', 'sequential')
+
+
+def _flag(value: Any) -> bool:
+	return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+class OptimizationProfile:
+	def __init__(self, name: str = 'default', device: str = 'auto', dtype: str = 'auto', attention: str = 'sdpa', vae_slicing: bool = False, vae_tiling: str = 'auto', offload: str = 'none', channels_last: bool = False, compile: bool = False, tiling_min_pixels: int = 1536 * 1536):
+		self.name = name
+		self.device = device if device in ('auto', 'cpu', 'cuda') else 'auto'
+		self.dtype = dtype if dtype in DTYPES else 'auto'
+		self.attention = attention if attention in ATTENTION else 'sdpa'
+		self.vae_slicing = bool(vae_slicing)
+		self.vae_tiling = vae_tiling if vae_tiling in VAE_TILING else 'auto'
+		self.offload = offload if offload in OFFLOAD else 'none'
+		self.channels_last = bool(channels_last)
+		self.compile = bool(compile)
+		self.tiling_min_pixels = int(tiling_min_pixels)
+
+	@classmethod
+	def named(cls, name: str, **overrides) -> 'OptimizationProfile':
+		if name not in PROFILES:
+			raise ValueError(f"unknown optimization profile {name!r}; expected one of {sorted(PROFILES)}")
+		return cls(name=name, **{**PROFILES[name], **{k: v for k, v in overrides.items() if v is not None}})
+
+	@classmethod
+	def from_env(cls) -> 'OptimizationProfile':
+		# OPT_PROFILE picks the base; OPT_* variables override single settings
+		name = os.getenv('OPT_PROFILE', 'default')
+		env = lambda k: os.getenv(k) or None
+		flag = lambda k: _flag(os.environ[k]) if os.getenv(k) else None
+		return cls.named(
+			name if name in PROFILES else 'default',
+			dtype=env('OPT_DTYPE'),
+			attention=env('OPT_ATTENTION'),
+			vae_slicing=flag('OPT_VAE_SLICING'),
+			vae_tiling=env('OPT_VAE_TILING'),
+			offload=env('OPT_OFFLOAD'),
+			channels_last=flag('OPT_CHANNELS_LAST'),
+			compile=flag('OPT_COMPILE'),
+			tiling_min_pixels=int(os.getenv('OPT_VAE_TILING_MIN_PIXELS', str(1536 * 1536))),
+		)
+
+	def resolve_device(self, detected: str) -> str:
+		return detected if self.device == 'auto' else self.device
+
+	def dtype_name(self, device: str) -> str:
+		if self.dtype == 'auto':
+			return 'fp16' if device == 'cuda' else 'fp32'
+		return self.dtype
+
+	def torch_dtype(self, device: str):
+		import torch
+		return {'fp32': torch.float32, 'fp16': torch.float16, 'bf16': torch.bfloat16}[self.dtype_name(device)]
+
+	def place(self, pipe: Any, device: str) -> Any:
+		# Offloaded pipelines keep weights on the CPU and move them per call, so they are
+		# never moved to the device wholesale
+		if device == 'cuda' and self.offload == 'model':
+			pipe.enable_model_cpu_offload()
+		elif device == 'cuda' and self.offload == 'sequential':
+			pipe.enable_sequential_cpu_offload()
+		elif device == 'cuda':
+			pipe = pipe.to(device)
+		return pipe
+
+	def place_module(self, module: Any, device: str) -> Any:
+		# For a module added to a derived pipeline (the ControlNet). Pipeline-level offload
+		# would first strip the hooks from the UNet/VAE/text encoders it shares with the base
+		# pipeline, so only this module is offloaded. It alternates with the UNet on every
+		# step, so under model offload it gets its own unchained hook and stays on the device
+		# once used, as diffusers does for its ControlNet pipelines.
+		if device != 'cuda':
+			return module
+		if self.offload == 'model':
+			from accelerate import cpu_offload_with_hook
+			module, _ = cpu_offload_with_hook(module, device)
+		elif self.offload == 'sequential':
+			from accelerate import cpu_offload
+			cpu_offload(module, execution_device=device)
+		else:
+			module = module.to(device)
+		return module
+
+	def apply(self, pipe: Any, derived: bool = False) -> Any:
+		# Runs before attention-processor hooks are installed (slicing replaces processors).
+		# Derived pipelines share the base UNet/VAE, which are already set up; only their own
+		# modules (the ControlNet) are touched.
+		if not derived:
+			if self.attention == 'slicing':
+				pipe.enable_attention_slicing()
+			vae = getattr(pipe, 'vae', None)
+			if vae is not None:
+				if self.vae_slicing:
+					vae.enable_slicing()
+				if self.vae_tiling == 'on':
+					vae.enable_tiling()
+		if self.channels_last:
+			import torch
+			for name in (('controlnet',) if derived else ('unet', 'vae', 'controlnet')):
+				module = getattr(pipe, name, None)
+				if module is not None:
+					module.to(memory_format=torch.channels_last)
+		return pipe
+
+	def finalize(self, pipe: Any) -> Any:
+		# torch.compile last: wrapping the UNet earlier would make later processor changes
+		# recompile it
+		if self.compile and not getattr(pipe.unet, '_epiphany_compiled', False):
+			import torch
+			pipe.unet = torch.compile(pipe.unet, mode=os.getenv('OPT_COMPILE_MODE', 'reduce-overhead'), fullgraph=False)
+			pipe.unet._epiphany_compiled = True
+		return pipe
+
+	def dtype_bytes(self, device: str) -> int:
+		name = self.dtype if self.dtype != 'auto' else ('fp16' if device == 'cuda' else 'fp32')
+		return 4 if name == 'fp32' else 2
+
+	def prepare_call(self, pipe: Any, width: int, height: int, tiling: bool | None = None, slicing: bool | None = None) -> bool:
+		# Per-call VAE tiling under 'auto': only outputs above tiling_min_pixels pay for tiles.
+		# `tiling`/`slicing` force the decode mode for one call (used by the memory planner);
+		# slicing otherwise returns to the profile's setting. Returns whether tiling is on.
+		vae = getattr(pipe, 'vae', None)
+		if vae is None:
+			return False
+		if (slicing if slicing is not None else self.vae_slicing):
+			vae.enable_slicing()
+		else:
+			vae.disable_slicing()
+		if self.vae_tiling == 'on':
+			return True
+		on = bool(tiling) if tiling is not None else (self.vae_tiling == 'auto' and width * height >= self.tiling_min_pixels)
+		if on:
+			vae.enable_tiling()
+		else:
+			vae.disable_tiling()
+		return on
+
+	def describe(self) -> dict:
+		return {
+			"name": self.name,
+			"device": self.device,
+			"dtype": self.dtype,
+			"attention": self.attention,
+			"vae_slicing": self.vae_slicing,
+			"vae_tiling": self.vae_tiling,
+			"offload": self.offload,
+			"channels_last": self.channels_last,
+			"compile": self.compile,
+		}
@@ -0,0 +1,101 @@
+import hashlib
+import os
+from io import BytesIO
+from PIL import Image
+
+from common.metrics import stage
+
+# format name -> (PIL format, content type, file extension)
+FORMATS = {
+	'png': ('PNG', 'image/png', 'png'),
+	'webp': ('WEBP', 'image/webp', 'webp'),
+	'jpeg': ('JPEG', 'image/jpeg', 'jpg'),
+	'jpg': ('JPEG', 'image/jpeg', 'jpg'),
+}
+
+
+class OutputSettings:
+	def __init__(self, fmt: str = 'png', png_compress_level: int = 6, quality: int = 90, preview_fmt: str = 'jpeg', preview_quality: int = 80):
+		self.fmt = fmt if fmt in FORMATS else 'png'
+		self.png_compress_level = max(0, min(9, int(png_compress_level)))
+		self.quality = max(1, min(100, int(quality)))
+		self.preview_fmt = preview_fmt if preview_fmt in FORMATS else 'jpeg'
+		self.preview_quality = max(1, min(100, int(preview_quality)))
+
+	@classmethod
+	def from_env(cls) -> 'OutputSettings':
+		return cls(
+			fmt=(os.getenv('OUTPUT_FORMAT') or 'png').lower(),
+			png_compress_level=int(os.getenv('PNG_COMPRESS_LEVEL') or 6),
+			quality=int(os.getenv('OUTPUT_QUALITY') or 90),
+			preview_fmt=(os.getenv('PREVIEW_FORMAT') or 'jpeg').lower(),
+			preview_quality=int(os.getenv('PREVIEW_QUALITY') or 80),
+		)
+
+	def describe(self) -> dict:
+		return {"format": self.fmt, "png_compress_level": self.png_compress_level, "quality": self.quality, "preview_format": self.preview_fmt}
+
+
+class _HashingWriter:
+	# File object handed to PIL: every chunk the encoder emits is hashed as it is written
+	def __init__(self):
+		self.buf = BytesIO()
+		self.sha = hashlib.sha256()
+
+	def write(self, data) -> int:
+		with stage('hash'):
+			self.sha.update(data)
+		return self.buf.write(data)
+
+	def flush(self) -> None:
+		pass
+
+
+class EncodedImage:
+	# One encode per output: the decoded image stays in hand for safety/thumbnails,
+	# the encoded bytes are exposed as a view over the encoder's buffer.
+	def __init__(self, image: Image.Image, buf: BytesIO, sha256: str, fmt: str):
+		self.image = image
+		self.width, self.height = image.size
+		self.fmt = fmt
+		_, self.content_type, self.ext = FORMATS[fmt]
+		self.sha256 = sha256
+		self._buf = buf
+		self.nbytes = buf.getbuffer().nbytes
+
+	def view(self) -> memoryview:
+		return self._buf.getbuffer()
+
+	def reader(self) -> BytesIO:
+		# Rewound file object over the same memory; used as the S3 upload body
+		self._buf.seek(0)
+		return self._buf
+
+	def meta(self) -> dict:
+		return {"width": self.width, "height": self.height, "bytes": self.nbytes, "sha256": self.sha256, "mime": self.content_type}
+
+
+def encode_image(im: Image.Image, fmt: str = 'png', png_compress_level: int = 6, quality: int = 90) -> EncodedImage:
+	fmt = fmt if fmt in FORMATS else 'png'
+	pil_fmt = FORMATS[fmt][0]
+	w = _HashingWriter()
+	# Hashing happens inside the encoder's writes; its time is reported separately
+	with stage('encode'):
+		if pil_fmt == 'PNG':
+			im.save(w, format='PNG', compress_level=png_compress_level)
+		elif pil_fmt == 'JPEG':
+			(im if im.mode in ('RGB', 'L') else im.convert('RGB')).save(w, format='JPEG', quality=quality)
+		else:
+			im.save(w, format='WEBP', quality=quality)
+	return EncodedImage(im, w.buf, w.sha.hexdigest(), fmt)
+
+
+def encode_output(im: Image.Image, settings: OutputSettings) -> EncodedImage:
+	return encode_image(im, settings.fmt, settings.png_compress_level, settings.quality)
+
+
+def encode_preview(im: Image.Image, settings: OutputSettings, max_side: int = 0) -> EncodedImage:
+	if max_side and max(im.size) > max_side:
+		im = im.copy()
+		im.thumbnail((max_side, max_side))
+	return encode_image(im, settings.preview_fmt, settings.png_compress_level, settings.preview_quality)
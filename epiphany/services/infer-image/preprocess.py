@@ -0,0 +1,183 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Iterable
+
+import numpy as np
+from PIL import Image
+
+from common.metrics import stage
+from result_cache import cache_key, sha256_or_none
+
+# Control map types and the parameters each accepts, with their defaults
+DEFAULT_PARAMS = {
+	'canny': {'low_threshold': 100, 'high_threshold': 200},
+	'depth': {'detect_resolution': 512},
+	'pose': {'detect_resolution': 512},
+}
+CONTROL_TYPES = tuple(DEFAULT_PARAMS)
+
+
+def normalize_params(kind: str, params: dict | None) -> dict:
+	# Defaults filled in and unknown keys dropped, so equivalent requests share a cache entry
+	out = dict(DEFAULT_PARAMS[kind])
+	for k, v in (params or {}).items():
+		if k in out:
+			out[k] = max(1, min(int(v), 2048))
+	return out
+
+
+def canny_map(im: Image.Image, low_threshold: int, high_threshold: int) -> Image.Image:
+	import cv2  # type: ignore
+	edges = cv2.Canny(np.array(im), low_threshold, high_threshold)
+	return Image.fromarray(np.stack([edges, edges, edges], axis=-1))
+
+
+class ControlMap:
+	def __init__(self, image: Image.Image, kind: str, params: dict, width: int, height: int, source: str, digest: str, compute_ms: float):
+		self.image = image
+		self.kind = kind
+		self.params = params
+		self.width = width
+		self.height = height
+		# cv2, midas, openpose, fallback, or input for maps supplied preprocessed
+		self.source = source
+		self.digest = digest
+		self.compute_ms = compute_ms
+		self.nbytes = width * height * 3
+		# Set once /preprocess has uploaded the map
+		self.url: str | None = None
+
+	def describe(self) -> dict:
+		return {"type": self.kind, "params": self.params, "width": self.width, "height": self.height, "source": self.source, "key": self.digest, "compute_ms": round(self.compute_ms, 1)}
+
+
+class ControlPreprocessor:
+	# Control maps for the ControlNet runners. Detectors (MiDaS depth, OpenPose) are built once
+	# and stay resident; a detector that cannot be built is not retried per request and its
+	# fallback is served instead (grayscale as pseudo depth, the image itself as pose). Maps are
+	# cached in an LRU keyed by (input sha256, type, params, width, height), so iterating prompts
+	# on one reference image preprocesses it once. Cached maps are shared: treat them as read-only.
+	def __init__(self, builders: dict[str, Callable[[], Any]], decode: Callable[[bytes, str], Image.Image], max_entries: int = 64, max_bytes: int = 256 * 1024 * 1024):
+		self.builders = dict(builders)
+		self.decode = decode
+		self.max_entries = max(0, int(max_entries))
+		self.max_bytes = max(0, int(max_bytes))
+		self._detectors: dict[str, Any] = {}
+		self._failed: dict[str, str] = {}
+		self._load_locks = {name: threading.Lock() for name in self.builders}
+		self.load_ms = {name: 0.0 for name in self.builders}
+		self._maps: 'OrderedDict[str, ControlMap]' = OrderedDict()
+		self._lock = threading.Lock()
+		self.bytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.compute_ms = 0.0
+		self.saved_ms = 0.0
+		self.detector_failures = 0
+		self.last_failure: str | None = None
+
+	@classmethod
+	def from_env(cls, builders: dict[str, Callable[[], Any]], decode: Callable[[bytes, str], Image.Image]) -> 'ControlPreprocessor':
+		return cls(
+			builders, decode,
+			max_entries=int(os.getenv('PREPROCESS_CACHE_SIZE', '64')),
+			max_bytes=int(float(os.getenv('PREPROCESS_CACHE_MB', '256') or 0) * 1024 * 1024),
+		)
+
+	def detector(self, kind: str) -> Any | None:
+		model = self._detectors.get(kind)
+		if model is not None or kind not in self.builders or kind in self._failed:
+			return model
+		with self._load_locks[kind]:
+			model = self._detectors.get(kind)
+			if model is None and kind not in self._failed:
+				t0 = time.perf_counter()
+				try:
+					with stage('model_load'):
+						model = self.builders[kind]()
+				except Exception as e:
+					self._failed[kind] = f"{type(e).__name__}: {e}"[:200]
+					return None
+				self.load_ms[kind] = (time.perf_counter() - t0) * 1000.0
+				self._detectors[kind] = model
+			return model
+
+	def preload(self, kinds: Iterable[str]) -> list[str]:
+		return [k for k in kinds if self.detector(k) is not None]
+
+	def _compute(self, kind: str, data: bytes, width: int, height: int, params: dict) -> tuple[Image.Image, str, bool]:
+		# (map, source, whether a loaded detector failed on this input)
+		if kind == 'canny':
+			return canny_map(self.decode(data, 'RGB').resize((width, height)), params['low_threshold'], params['high_threshold']), 'cv2', False
+		model = self.detector(kind)
+		failed = False
+		if model is not None:
+			try:
+				out = model(self.decode(data, 'RGB').resize((width, height)), detect_resolution=params['detect_resolution'])
+				return out.convert('RGB').resize((width, height)), 'midas' if kind == 'depth' else 'openpose', False
+			except Exception as e:
+				failed = True
+				with self._lock:
+					self.detector_failures += 1
+					self.last_failure = f"{kind}: {type(e).__name__}: {e}"[:200]
+		if kind == 'depth':
+			return self.decode(data, 'L').resize((width, height)).convert('RGB'), 'fallback', failed
+		return self.decode(data, 'RGB').resize((width, height)), 'fallback', failed
+
+	def run(self, kind: str, data: bytes, width: int, height: int, params: dict | None = None, preprocessed: bool = False) -> tuple[ControlMap, bool]:
+		# (control map, cache hit) for an input image; preprocessed inputs (a map from
+		# /preprocess) are only resized
+		params = normalize_params(kind, params)
+		digest = cache_key({"input": sha256_or_none(data), "type": kind, "params": params, "width": width, "height": height, "preprocessed": preprocessed})
+		with self._lock:
+			cmap = self._maps.get(digest)
+			if cmap is not None:
+				self.hits += 1
+				self.saved_ms += cmap.compute_ms
+				self._maps.move_to_end(digest)
+		if cmap is not None:
+			return cmap, True
+		t0 = time.perf_counter()
+		with stage('preprocess'):
+			if preprocessed:
+				image, source, failed = self.decode(data, 'RGB').resize((width, height)), 'input', False
+			else:
+				image, source, failed = self._compute(kind, data, width, height, params)
+		cmap = ControlMap(image, kind, params, width, height, source, digest, (time.perf_counter() - t0) * 1000.0)
+		with self._lock:
+			self.misses += 1
+			self.compute_ms += cmap.compute_ms
+			# A fallback served because a loaded detector failed (e.g. out of memory) is not cached,
+			# so the next request for this image tries the detector again
+			if self.max_entries and not failed and not (self.max_bytes and cmap.nbytes > self.max_bytes):
+				self._maps[digest] = cmap
+				self.bytes += cmap.nbytes
+				while len(self._maps) > self.max_entries or (self.max_bytes and self.bytes > self.max_bytes):
+					_, dropped = self._maps.popitem(last=False)
+					self.bytes -= dropped.nbytes
+					self.evictions += 1
+		return cmap, False
+
+	def stats(self) -> dict:
+		with self._lock:
+			lookups = self.hits + self.misses
+			return {
+				"detectors": {
+					name: {"loaded": name in self._detectors, "load_ms": round(self.load_ms[name], 1), "error": self._failed.get(name)}
+					for name in self.builders
+				},
+				"entries": len(self._maps),
+				"max_entries": self.max_entries,
+				"mb": round(self.bytes / (1024 * 1024), 1),
+				"hits": self.hits,
+				"misses": self.misses,
+				"hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+				"evictions": self.evictions,
+				"detector_failures": self.detector_failures,
+				"last_failure": self.last_failure,
+				"compute_ms": round(self.compute_ms, 1),
+				"saved_ms": round(self.saved_ms, 1),
+			}
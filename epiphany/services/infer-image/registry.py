@@ -0,0 +1,176 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Iterable
+
+
+def module_bytes(module: Any) -> int:
+	# Sum parameter + buffer storage of a torch module (0 for tokenizers, schedulers, ...)
+	total = 0
+	for attr in ('parameters', 'buffers'):
+		fn = getattr(module, attr, None)
+		if not callable(fn):
+			continue
+		try:
+			for t in fn():
+				total += int(t.numel()) * int(t.element_size())
+		except Exception:
+			pass
+	return total
+
+
+def pipeline_components(pipe: Any) -> dict:
+	comps = getattr(pipe, 'components', None)
+	if isinstance(comps, dict):
+		return {k: v for k, v in comps.items() if v is not None}
+	return {'module': pipe}
+
+
+def _fmt_key(key: Hashable) -> list:
+	parts = key if isinstance(key, tuple) else (key,)
+	return [None if k is None else str(k) for k in parts]
+
+
+class _Entry:
+	def __init__(self, key: Hashable, pipe: Any, parents: Iterable[Hashable], load_ms: float):
+		self.key = key
+		self.pipe = pipe
+		self.parents = tuple(parents)
+		self.load_ms = load_ms
+		self.hits = 0
+		self.modules = {id(m): (m, module_bytes(m)) for m in pipeline_components(pipe).values()}
+
+
+class ModelRegistry:
+	# Keeps pipelines resident, keyed by (model id, task, controlnet type, dtype, device).
+	# Derived pipelines (img2img, controlnet) are built from a parent's components, so
+	# memory is accounted per unique module and evicting a parent also drops its children.
+	def __init__(self, budget_bytes: int = 0, on_evict: Callable[[], None] | None = None):
+		self.budget_bytes = max(0, int(budget_bytes))
+		self.on_evict = on_evict
+		self._entries: 'OrderedDict[Hashable, _Entry]' = OrderedDict()
+		self._lock = threading.RLock()
+		self._load_locks: dict[Hashable, threading.Lock] = {}
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.load_ms_total = 0.0
+
+	def get(self, key: Hashable, builder: Callable[[], Any]) -> Any:
+		# builder returns either a pipeline or (pipeline, parent_keys). Loads run under a per-key
+		# lock, so hits on other keys, stats() and evictions never wait for a from_pretrained.
+		entry = self._hit(key)
+		if entry is not None:
+			return entry.pipe
+		with self._lock:
+			load_lock = self._load_locks.setdefault(key, threading.Lock())
+		with load_lock:
+			# Another thread may have finished this load while we waited
+			entry = self._hit(key)
+			if entry is not None:
+				return entry.pipe
+			with self._lock:
+				self.misses += 1
+			t0 = time.perf_counter()
+			built = builder()
+			load_ms = (time.perf_counter() - t0) * 1000.0
+			pipe, parents = built if isinstance(built, tuple) else (built, ())
+			entry = _Entry(key, pipe, parents, load_ms)
+			with self._lock:
+				self.load_ms_total += load_ms
+				self._entries[key] = entry
+				self._touch(entry)
+				evicted = self._enforce_budget(key)
+		if evicted:
+			self._evicted()
+		return pipe
+
+	def _hit(self, key: Hashable) -> _Entry | None:
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is not None:
+				self.hits += 1
+				entry.hits += 1
+				self._touch(entry)
+			return entry
+
+	def __contains__(self, key: Hashable) -> bool:
+		with self._lock:
+			return key in self._entries
+
+	def evict(self, key: Hashable) -> bool:
+		with self._lock:
+			removed = self._drop(key)
+		if removed:
+			self._evicted()
+		return removed
+
+	def _evicted(self) -> None:
+		if self.on_evict is not None:
+			try:
+				self.on_evict()
+			except Exception:
+				pass
+
+	def clear(self) -> None:
+		with self._lock:
+			self._entries.clear()
+
+	def resident_bytes(self) -> int:
+		with self._lock:
+			return self._resident_bytes(self._entries.values())
+
+	def stats(self) -> dict:
+		with self._lock:
+			total = self.hits + self.misses
+			return {
+				"entries": [
+					{"key": _fmt_key(e.key), "load_ms": round(e.load_ms, 1), "hits": e.hits, "shared_with": [_fmt_key(p) for p in e.parents]}
+					for e in self._entries.values()
+				],
+				"hits": self.hits,
+				"misses": self.misses,
+				"hit_rate": (self.hits / total) if total else 0.0,
+				"evictions": self.evictions,
+				"load_ms_total": round(self.load_ms_total, 1),
+				"resident_bytes": self._resident_bytes(self._entries.values()),
+				"budget_bytes": self.budget_bytes,
+			}
+
+	def _touch(self, entry: _Entry) -> None:
+		# Parents are used whenever a child is, so keep them at least as fresh
+		for p in entry.parents:
+			parent = self._entries.get(p)
+			if parent is not None:
+				self._touch(parent)
+		self._entries.move_to_end(entry.key)
+
+	def _resident_bytes(self, entries: Iterable[_Entry]) -> int:
+		seen: dict[int, int] = {}
+		for e in entries:
+			for mid, (_, nbytes) in e.modules.items():
+				seen[mid] = nbytes
+		return sum(seen.values())
+
+	def _drop(self, key: Hashable) -> bool:
+		if key not in self._entries:
+			return False
+		del self._entries[key]
+		self.evictions += 1
+		for child in [k for k, e in self._entries.items() if key in e.parents]:
+			self._drop(child)
+		return True
+
+	def _enforce_budget(self, keep: Hashable) -> bool:
+		# Called under the lock; the caller runs on_evict once it is released
+		if not self.budget_bytes:
+			return False
+		protected = {keep} | set(self._entries[keep].parents)
+		evicted = False
+		while self._resident_bytes(self._entries.values()) > self.budget_bytes:
+			victim = next((k for k in self._entries if k not in protected), None)
+			if victim is None:
+				break
+			self._drop(victim)
+			evicted = True
+		return evicted
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any
+
+_redis_available = False
+try:
+	import redis  # type: ignore
+	_redis_available = True
+except Exception:
+	_redis_available = False
+
+META_KEY = 'epiphany-result'
+
+
+def cache_key(params: dict) -> str:
+	# Canonical JSON so dict ordering / int-vs-float noise never splits a key
+	canon = json.dumps(params, sort_keys=True, separators=(',', ':'), default=str)
+	return hashlib.sha256(canon.encode('utf-8')).hexdigest()
+
+
+def sha256_or_none(data: bytes | None) -> str | None:
+	return hashlib.sha256(data).hexdigest() if data else None
+
+
+class ResultCache:
+	# Content-addressed results for deterministic (seeded) generations. Outputs are written to
+	# a key derived from the request hash and carry their response fields as S3 object
+	# metadata, so the S3 object itself is the source of truth; the in-process LRU (or Redis,
+	# when RESULT_CACHE_REDIS_URL is set) only saves the HEAD round trip.
+	def __init__(self, s3: Any, bucket: str, endpoint: str, prefix: str = 'gen/cache/', max_entries: int = 4096, redis_url: str | None = None, enabled: bool = True, exts: tuple = ('png',)):
+		self.s3 = s3
+		self.bucket = bucket
+		self.endpoint = endpoint
+		self.prefix = prefix
+		self.max_entries = max(1, int(max_entries))
+		self.enabled = enabled
+		self.exts = exts
+		self._index: 'OrderedDict[str, dict]' = OrderedDict()
+		self._lock = threading.Lock()
+		self._redis = None
+		if redis_url and _redis_available:
+			try:
+				self._redis = redis.Redis.from_url(redis_url, socket_timeout=0.5)
+			except Exception:
+				self._redis = None
+		self.hits = 0
+		self.misses = 0
+		self.s3_hits = 0
+
+	def object_key(self, key: str, ext: str = 'png') -> str:
+		return f"{self.prefix}{key}.{ext}"
+
+	def url(self, key: str, ext: str = 'png') -> str:
+		return f"{self.endpoint}/{self.bucket}/{self.object_key(key, ext)}"
+
+	def hit_rate(self) -> float:
+		total = self.hits + self.misses
+		return (self.hits / total) if total else 0.0
+
+	def lookup(self, key: str) -> dict | None:
+		if not self.enabled:
+			return None
+		entry = self._index_get(key)
+		if entry is None:
+			entry = self._s3_get(key)
+			if entry is not None:
+				self.s3_hits += 1
+				self._index_put(key, entry)
+		with self._lock:
+			if entry is None:
+				self.misses += 1
+			else:
+				self.hits += 1
+		return entry
+
+	def metadata(self, entry: dict) -> dict:
+		return {META_KEY: json.dumps(entry, separators=(',', ':'))}
+
+	def store(self, key: str, entry: dict) -> None:
+		if self.enabled:
+			self._index_put(key, entry)
+
+	def stats(self) -> dict:
+		with self._lock:
+			return {
+				"enabled": self.enabled,
+				"backend": "redis" if self._redis is not None else "memory",
+				"entries": len(self._index),
+				"hits": self.hits,
+				"misses": self.misses,
+				"s3_hits": self.s3_hits,
+				"hit_rate": self.hit_rate(),
+			}
+
+	def _index_get(self, key: str) -> dict | None:
+		with self._lock:
+			entry = self._index.get(key)
+			if entry is not None:
+				self._index.move_to_end(key)
+				return entry
+		if self._redis is not None:
+			try:
+				raw = self._redis.get(f"epiphany:result:{key}")
+				if raw:
+					entry = json.loads(raw)
+					self._index_put(key, entry, remote=False)
+					return entry
+			except Exception:
+				pass
+		return None
+
+	def _index_put(self, key: str, entry: dict, remote: bool = True) -> None:
+		with self._lock:
+			self._index[key] = entry
+			self._index.move_to_end(key)
+			while len(self._index) > self.max_entries:
+				self._index.popitem(last=False)
+		if remote and self._redis is not None:
+			try:
+				self._redis.set(f"epiphany:result:{key}", json.dumps(entry, separators=(',', ':')))
+			except Exception:
+				pass
+
+	def _s3_get(self, key: str) -> dict | None:
+		for ext in self.exts:
+			try:
+				head = self.s3.head_object(Bucket=self.bucket, Key=self.object_key(key, ext))
+				raw = (head.get('Metadata') or {}).get(META_KEY)
+				if raw:
+					return json.loads(raw)
+			except Exception:
+				continue
+		return None
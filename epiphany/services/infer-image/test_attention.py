@@ -0,0 +1,59 @@
+from io import BytesIO
+
+import numpy as np
+import pytest
+
+from attention import AttentionTap, Capture, _TapProcessor, encode_maps, prompt_tokens
+
+
+def test_grid_follows_aspect_ratio():
+	cap = Capture(1, 1024, 512)
+	assert cap.grid(512) == (16, 32)
+	assert cap.grid(2048) == (32, 64)
+
+
+def test_encode_maps_round_trip():
+	maps = np.random.rand(2, 4, 8).astype(np.float32)
+	with np.load(BytesIO(encode_maps(maps, ['red', 'fox']))) as z:
+		assert z['maps'].dtype == np.float16 and z['maps'].shape == (2, 4, 8)
+		assert list(z['tokens']) == ['red', 'fox']
+
+
+def test_prompt_tokens_drop_specials():
+	class Tok:
+		model_max_length = 77
+		def __call__(self, text, truncation, max_length):
+			return type('Enc', (), {'input_ids': [0] + list(range(1, len(text.split()) + 1)) + [9]})
+		def convert_ids_to_tokens(self, ids):
+			return [f't{i}</w>' for i in ids]
+	assert prompt_tokens(Tok(), 'a red fox') == ['t1', 't2', 't3']
+
+
+def test_tap_accumulates_prompt_half_per_thread():
+	torch = pytest.importorskip('torch')
+
+	class Attn:
+		heads = 2
+		def to_q(self, x):
+			return x
+		def to_k(self, x):
+			return x
+		def head_to_batch_dim(self, x):
+			b, n, d = x.shape
+			return x.reshape(b, n, self.heads, d // self.heads).permute(0, 2, 1, 3).reshape(b * self.heads, n, d // self.heads)
+		def get_attention_scores(self, q, k, mask):
+			return (q @ k.transpose(1, 2)).softmax(dim=-1)
+
+	calls = []
+	tap = AttentionTap(max_queries=64)
+	proc = _TapProcessor(lambda attn, h, e, m, *a, **k: calls.append(h.shape) or h, tap)
+	hidden, context = torch.randn(2, 16, 4), torch.randn(2, 5, 4)
+	proc(Attn(), hidden, context)
+	assert calls and tap.captures == 0
+	with tap.capture(1, 32, 32) as cap:
+		for _ in range(3):
+			proc(Attn(), hidden, context)
+		proc(Attn(), torch.randn(2, 256, 4), context)  # above max_queries: not captured
+	assert list(cap.sums) == [16] and cap.counts[16] == 3 and cap.sums[16].shape == (1, 16, 5)
+	maps = cap.maps(0, 3)
+	assert maps.shape == (3, 4, 4) and maps.dtype == np.float16 and float(maps.max()) == pytest.approx(1.0, abs=1e-3)
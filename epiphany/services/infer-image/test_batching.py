@@ -0,0 +1,54 @@
+import asyncio
+
+from batching import MicroBatcher
+from common import profiling
+from common.executor import BoundedExecutor
+from common.profiling import Profiler
+
+
+def test_concurrent_requests_share_one_batch():
+	calls = []
+	def run(key, items):
+		calls.append(len(items))
+		return [it * 10 for it in items]
+	async def go():
+		b = MicroBatcher(run, max_batch=4, window_ms=50)
+		return await asyncio.gather(*(b.submit('k', i) for i in range(4)))
+	assert asyncio.run(go()) == [0, 10, 20, 30]
+	assert calls == [4]
+
+
+def test_incompatible_keys_are_not_mixed():
+	calls = []
+	def run(key, items):
+		calls.append((key, len(items)))
+		return items
+	async def go():
+		b = MicroBatcher(run, max_batch=8, window_ms=5)
+		return await asyncio.gather(b.submit('a', 1), b.submit('b', 2), b.submit('a', 3))
+	assert asyncio.run(go()) == [1, 2, 3]
+	assert sorted(calls) == [('a', 2), ('b', 1)]
+
+
+def test_batch_failure_reaches_every_caller():
+	def run(key, items):
+		raise RuntimeError('oom')
+	async def go():
+		b = MicroBatcher(run, max_batch=2, window_ms=5)
+		return await asyncio.gather(b.submit('k', 1), b.submit('k', 2), return_exceptions=True)
+	res = asyncio.run(go())
+	assert all(isinstance(r, RuntimeError) for r in res)
+
+
+def test_batches_run_as_executor_jobs_seen_by_a_profile_capture():
+	ex = BoundedExecutor('t', workers=1, io_workers=1)
+	profiler = Profiler('svc', None, 'bucket', 'http://s3', engine='cprofile')
+	async def go():
+		b = MicroBatcher(lambda key, items: [ex.stats()['compute_running'] for _ in items], max_batch=2, window_ms=5, executor=ex)
+		capture = profiler.arm(requests=1, use_torch=False)
+		try:
+			return await asyncio.gather(b.submit('k', 1), b.submit('k', 2)), capture.describe()
+		finally:
+			profiling._active = None
+	results, capture = asyncio.run(go())
+	assert results == [1, 1] and capture['jobs'] == 1
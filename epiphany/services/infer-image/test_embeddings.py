@@ -0,0 +1,75 @@
+import embeddings
+from embeddings import PromptEmbeddingCache
+
+
+class FakeTensor:
+	def __init__(self, value, n=1000, shape=(1, 77, 2048)):
+		self.value = value
+		self.n = n
+		self.shape = shape
+		self.device = 'cuda'
+	def numel(self):
+		return self.n
+	def element_size(self):
+		return 2
+	def new_zeros(self, shape):
+		return FakeTensor(0, self.n, shape)
+	def to(self, device, non_blocking=False):
+		t = FakeTensor(self.value, self.n, self.shape)
+		t.device = device
+		return t
+
+
+class FakeEncoder:
+	def __init__(self, name):
+		self.config = type('Config', (), {'_name_or_path': name})()
+		self.dtype = 'float16'
+
+
+class FakePipe:
+	def __init__(self, name='sdxl', force_zeros=True):
+		self.text_encoder = FakeEncoder(name)
+		self.text_encoder_2 = FakeEncoder(name + '-2')
+		self.config = type('Config', (), {'force_zeros_for_empty_prompt': force_zeros})()
+		self._execution_device = 'cuda'
+		self.encoded = []
+	def encode_prompt(self, prompt, device=None, num_images_per_prompt=1, do_classifier_free_guidance=True):
+		self.encoded.append(prompt)
+		return FakeTensor(prompt), None, FakeTensor(prompt, 10, (1, 1280)), None
+
+
+def test_repeats_and_shared_negatives_are_hits(monkeypatch):
+	monkeypatch.setattr(embeddings, '_cat', lambda ts: [t.value for t in ts])
+	cache = PromptEmbeddingCache()
+	pipe = FakePipe(force_zeros=False)
+	out = cache.pipe_kwargs(pipe, ['a cat', 'a dog'], ['blurry', 'blurry'])
+	assert out['prompt_embeds'] == ['a cat', 'a dog'] and out['negative_pooled_prompt_embeds'] == ['blurry', 'blurry']
+	cache.pipe_kwargs(pipe, 'a cat', None)
+	assert pipe.encoded == ['a cat', 'a dog', 'blurry', '']
+	st = cache.stats()
+	assert (st['hits'], st['misses'], st['entries']) == (2, 4, 4) and st['hit_rate'] == 0.333
+
+
+def test_empty_negatives_are_zeros_and_warmup_precomputes():
+	cache = PromptEmbeddingCache()
+	pipe = FakePipe()
+	assert cache.precompute(pipe, ['lowres, watermark']) == 1 and cache.precompute(pipe, ['lowres, watermark']) == 0
+	out = cache.pipe_kwargs(pipe, 'portrait', None)
+	assert out['negative_prompt_embeds'].value == 0 and out['negative_prompt_embeds'].shape == (1, 77, 2048)
+	out = cache.pipe_kwargs(pipe, 'portrait', 'lowres, watermark')
+	assert out['negative_prompt_embeds'].value == 'lowres, watermark'
+	assert pipe.encoded == ['lowres, watermark', 'portrait'] and cache.stats()['precomputed'] == 1
+
+
+def test_lru_bounds_encoder_keys_and_host_store():
+	cache = PromptEmbeddingCache(max_entries=2, store='cpu')
+	pipe, other = FakePipe(), FakePipe('sdxl-inpainting')
+	for text in ('a', 'b', 'a', 'c'):
+		cache.get(pipe, text, 'cuda')
+	assert [k[1] for k in cache._entries] == ['a', 'c'] and cache.stats()['evictions'] == 1
+	embeds, pooled = cache.get(pipe, 'a', 'cuda')
+	assert embeds.device == 'cuda' and cache._entries[(cache.encoder_key(pipe), 'a')].embeds.device == 'cpu'
+	assert cache.encoder_key(pipe) != cache.encoder_key(other)
+	cache.get(other, 'a')
+	assert other.encoded == ['a'] and cache.stats()['saved_ms'] >= 0
+	assert not PromptEmbeddingCache(max_entries=0).supports(pipe) and not cache.supports(object())
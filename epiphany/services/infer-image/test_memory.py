@@ -0,0 +1,57 @@
+from memory import MemoryPlanner, is_out_of_memory
+
+MB = 1024 * 1024
+
+
+def test_ladder_from_direct_to_placeholder():
+	planner = MemoryPlanner()
+	full = planner.estimate(1024, 1024, 2)
+	tiled = planner.estimate(1024, 1024, 2, tiling=True, slicing=True)
+	assert tiled < full
+	assert planner.plan(1024, 1024, 2, None).action == 'direct'
+	assert planner.plan(1024, 1024, 2, full).action == 'direct'
+	p = planner.plan(1024, 1024, 2, tiled)
+	assert (p.action, p.tiling, p.slicing, p.chunk) == ('tiled', True, True, 2)
+	p = planner.plan(1024, 1024, 2, planner.estimate(1024, 1024, 1, tiling=True, slicing=True))
+	assert (p.action, p.chunk) == ('chunked', 1)
+	p = planner.plan(1024, 1024, 1, 2000 * MB)
+	assert p.action == 'downscaled' and p.upscaled and not p.degraded
+	assert (p.target_width, p.target_height) == (1024, 1024) and p.width % 64 == 0 and p.height == p.width
+	assert 512 <= p.width < 1024 and planner.estimate(p.width, p.height, 1, tiling=True, slicing=True) <= 2000 * MB
+	p = planner.plan(1024, 1024, 1, 100 * MB)
+	assert p.degraded and p.reason == 'memory' and p.describe()['action'] == 'placeholder'
+	assert planner.stats()['decisions'] == {'direct': 2, 'tiled': 1, 'chunked': 1, 'downscaled': 1, 'placeholder': 1}
+
+
+def test_downscale_keeps_the_aspect_ratio_and_offload_weights_count():
+	planner = MemoryPlanner()
+	p = planner.plan(1344, 768, 1, 1400 * MB)
+	assert p.action == 'downscaled' and abs(p.width / p.height - 1344 / 768) < 0.1
+	budget = planner.estimate(1024, 1024, 1) + 10 * MB
+	assert planner.plan(1024, 1024, 1, budget).action == 'direct'
+	assert planner.plan(1024, 1024, 1, budget, extra_bytes=5000 * MB).action != 'direct'
+
+
+def test_measurements_and_ooms_recalibrate_the_estimate():
+	planner = MemoryPlanner()
+	budget = planner.estimate(1024, 1024, 1)
+	p = planner.plan(1024, 1024, 1, budget)
+	assert p.action == 'direct'
+	# the call needed more than planned: the same request now plans further down
+	planner.out_of_memory(p)
+	assert planner.plan(1024, 1024, 1, budget).action != 'direct'
+	assert planner.stats()['ooms'] == 1
+	# peaks well under the estimate pull it back
+	for _ in range(20):
+		planner.observe(p, 1, budget // 4)
+	assert planner.estimate(1024, 1024, 1) < budget
+	assert planner.plan(1024, 1024, 1, budget).action == 'direct'
+
+
+def test_out_of_memory_detection():
+	class OutOfMemoryError(RuntimeError):
+		pass
+	assert is_out_of_memory(OutOfMemoryError('boom'))
+	assert is_out_of_memory(RuntimeError('CUDA out of memory. Tried to allocate 2.00 GiB'))
+	assert not is_out_of_memory(RuntimeError('shape mismatch'))
+	assert not is_out_of_memory(ValueError('out of memory'))
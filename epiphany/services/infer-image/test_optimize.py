@@ -0,0 +1,88 @@
+import pytest
+
+from optimize import PROFILES, OptimizationProfile
+
+
+class Vae:
+	def __init__(self):
+		self.calls = []
+	def enable_slicing(self):
+		self.calls.append('slicing')
+	def disable_slicing(self):
+		self.calls.append('no-slicing')
+	def enable_tiling(self):
+		self.calls.append('tiling')
+	def disable_tiling(self):
+		self.calls.append('no-tiling')
+
+
+class Pipe:
+	def __init__(self):
+		self.vae = Vae()
+		self.calls = []
+	def enable_attention_slicing(self):
+		self.calls.append('attention-slicing')
+	def enable_model_cpu_offload(self):
+		self.calls.append('model-offload')
+	def enable_sequential_cpu_offload(self):
+		self.calls.append('sequential-offload')
+	def to(self, device):
+		self.calls.append(f"to:{device}")
+		return self
+
+
+def test_named_profiles_and_env_overrides(monkeypatch):
+	assert set(PROFILES) >= {'default', 'low-vram', 'cpu-bf16'}
+	with pytest.raises(ValueError):
+		OptimizationProfile.named('turbo')
+	monkeypatch.setenv('OPT_PROFILE', 'low-vram')
+	monkeypatch.setenv('OPT_OFFLOAD', 'sequential')
+	monkeypatch.setenv('OPT_VAE_SLICING', 'false')
+	p = OptimizationProfile.from_env()
+	assert (p.name, p.attention, p.offload, p.vae_slicing, p.vae_tiling) == ('low-vram', 'slicing', 'sequential', False, 'on')
+	# unknown names fall back to the default profile rather than failing startup
+	monkeypatch.setenv('OPT_PROFILE', 'nope')
+	assert OptimizationProfile.from_env().name == 'default'
+	assert OptimizationProfile.named('cpu').resolve_device('cuda') == 'cpu'
+	assert OptimizationProfile.named('default').resolve_device('cuda') == 'cuda'
+	assert OptimizationProfile.named('default').dtype_name('cuda') == 'fp16' and OptimizationProfile.named('cpu-bf16').dtype_name('cpu') == 'bf16'
+
+
+def test_place_and_apply_follow_the_profile():
+	pipe = OptimizationProfile.named('low-vram').place(Pipe(), 'cuda')
+	OptimizationProfile.named('low-vram').apply(pipe)
+	assert pipe.calls == ['model-offload', 'attention-slicing'] and pipe.vae.calls == ['slicing', 'tiling']
+	# offload is a CUDA-only concern; derived pipelines leave the shared VAE alone
+	pipe = OptimizationProfile.named('low-vram').place(Pipe(), 'cpu')
+	OptimizationProfile.named('low-vram').apply(pipe, derived=True)
+	assert pipe.calls == [] and pipe.vae.calls == []
+	assert OptimizationProfile.named('default').place(Pipe(), 'cuda').calls == ['to:cuda']
+	# a derived pipeline's own module is moved alone; offload is not re-applied to shared parts
+	module = Pipe()
+	assert OptimizationProfile.named('default').place_module(module, 'cuda') is module and module.calls == ['to:cuda']
+	assert OptimizationProfile.named('low-vram').place_module(module, 'cpu') is module and module.calls == ['to:cuda']
+
+
+def test_auto_vae_tiling_is_decided_per_call():
+	p = OptimizationProfile.named('default', tiling_min_pixels=1024 * 1024)
+	pipe = Pipe()
+	assert not p.prepare_call(pipe, 768, 768)
+	assert p.prepare_call(pipe, 1024, 1024)
+	assert p.prepare_call(pipe, 512, 512, tiling=True, slicing=True)
+	# a planner-forced slicing is undone by the next call that does not ask for it
+	p.prepare_call(pipe, 512, 512, slicing=False)
+	assert pipe.vae.calls == ['no-slicing', 'no-tiling', 'no-slicing', 'tiling', 'slicing', 'tiling', 'no-slicing', 'no-tiling']
+	assert not OptimizationProfile.named('default', vae_tiling='off').prepare_call(pipe, 4096, 4096)
+
+
+def test_forced_slicing_returns_to_the_profile_setting():
+	pipe = Pipe()
+	p = OptimizationProfile.named('default')
+	p.prepare_call(pipe, 1024, 1024, True, True)
+	p.prepare_call(pipe, 1024, 1024, None, None)
+	assert [c for c in pipe.vae.calls if 'slicing' in c] == ['slicing', 'no-slicing']
+	sliced = OptimizationProfile.named('low-vram')
+	pipe = Pipe()
+	sliced.prepare_call(pipe, 512, 512, slicing=False)
+	sliced.prepare_call(pipe, 512, 512)
+	assert [c for c in pipe.vae.calls if 'slicing' in c] == ['no-slicing', 'slicing']
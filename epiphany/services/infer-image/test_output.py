@@ -0,0 +1,22 @@
+import hashlib
+
+from PIL import Image
+
+from output import OutputSettings, encode_image, encode_preview
+
+
+def test_hash_is_computed_while_encoding():
+	enc = encode_image(Image.new('RGB', (32, 16), (200, 10, 10)), 'png', png_compress_level=1)
+	data = bytes(enc.view())
+	assert enc.sha256 == hashlib.sha256(data).hexdigest()
+	assert enc.meta() == {"width": 32, "height": 16, "bytes": len(data), "sha256": enc.sha256, "mime": "image/png"}
+	assert enc.reader().read() == data
+
+
+def test_formats_and_previews():
+	im = Image.new('RGBA', (64, 64), (0, 0, 255, 128))
+	assert encode_image(im, 'webp').content_type == 'image/webp'
+	jpg = encode_image(im, 'jpeg')
+	assert jpg.ext == 'jpg' and Image.open(jpg.reader()).format == 'JPEG'
+	thumb = encode_preview(im, OutputSettings(preview_fmt='jpeg'), max_side=16)
+	assert (thumb.width, thumb.height) == (16, 16) and im.size == (64, 64)
@@ -0,0 +1,68 @@
+from io import BytesIO
+
+from PIL import Image
+
+from preprocess import ControlPreprocessor, normalize_params
+
+
+def png(color) -> bytes:
+	buf = BytesIO()
+	Image.new('RGB', (96, 64), color).save(buf, format='PNG')
+	return buf.getvalue()
+
+
+def decode(data: bytes, mode: str) -> Image.Image:
+	return Image.open(BytesIO(data)).convert(mode)
+
+
+def test_detectors_load_once_and_maps_are_cached_by_input_params_and_dims():
+	builds, calls = [], []
+	def build():
+		builds.append(1)
+		return lambda im, detect_resolution=512: calls.append(detect_resolution) or im.convert('L')
+	pre = ControlPreprocessor({'depth': build}, decode)
+	a, b = png((200, 10, 10)), png((10, 200, 10))
+	first, hit = pre.run('depth', a, 64, 32)
+	assert not hit and first.source == 'midas' and first.image.size == (64, 32) and first.image.mode == 'RGB'
+	assert pre.run('depth', a, 64, 32, {'detect_resolution': 512, 'unknown': 1}) == (first, True)
+	pre.run('depth', a, 64, 32, {'detect_resolution': 256})
+	pre.run('depth', a, 32, 32)
+	pre.run('depth', b, 64, 32)
+	assert builds == [1] and calls == [512, 256, 512, 512]
+	st = pre.stats()
+	assert (st['hits'], st['misses'], st['entries']) == (1, 4, 4) and st['detectors']['depth']['loaded']
+
+
+def test_missing_detector_falls_back_without_retrying_and_lru_is_bounded():
+	builds = []
+	def build():
+		builds.append(1)
+		raise ImportError('controlnet_aux')
+	pre = ControlPreprocessor({'pose': build, 'depth': build}, decode, max_entries=2)
+	data = png((10, 10, 200))
+	pose, _ = pre.run('pose', data, 64, 64)
+	depth, _ = pre.run('depth', data, 64, 64)
+	assert pose.source == depth.source == 'fallback' and depth.image.getpixel((0, 0))[0] == depth.image.getpixel((0, 0))[2]
+	canny, _ = pre.run('canny', data, 64, 64, {'low_threshold': 50})
+	assert canny.source == 'cv2' and canny.params == normalize_params('canny', {'low_threshold': 50}) == {'low_threshold': 50, 'high_threshold': 200}
+	given, _ = pre.run('pose', data, 64, 64, preprocessed=True)
+	assert given.source == 'input' and given.digest != pose.digest
+	assert len(builds) == 2 and pre.stats()['entries'] == 2 and pre.stats()['evictions'] == 2
+	assert pre.stats()['detectors']['pose']['error'] == 'ImportError: controlnet_aux'
+
+
+def test_a_detector_failure_is_served_but_not_cached():
+	calls = []
+	def detect(im, detect_resolution=512):
+		calls.append(1)
+		if len(calls) == 1:
+			raise RuntimeError('CUDA out of memory')
+		return im.convert('L')
+	pre = ControlPreprocessor({'depth': lambda: detect}, decode)
+	data = png((10, 120, 10))
+	first, hit = pre.run('depth', data, 64, 64)
+	assert first.source == 'fallback' and not hit and pre.stats()['entries'] == 0
+	second, hit = pre.run('depth', data, 64, 64)
+	assert second.source == 'midas' and not hit and pre.run('depth', data, 64, 64) == (second, True)
+	st = pre.stats()
+	assert st['detector_failures'] == 1 and st['last_failure'] == 'depth: RuntimeError: CUDA out of memory' and len(calls) == 2
@@ -0,0 +1,63 @@
+import numpy as np
+
+from progress import ProgressPublisher, StepReporter, latent_preview, on_steps, step_kwargs
+
+
+class Latents:
+	# Stands in for a torch tensor: indexing plus detach().float().cpu().numpy()
+	def __init__(self, arr):
+		self.arr = arr
+		self.shape = arr.shape
+	def __getitem__(self, i):
+		return Latents(self.arr[i])
+	def detach(self):
+		return self
+	def float(self):
+		return self
+	def cpu(self):
+		return self
+	def numpy(self):
+		return self.arr
+
+
+class Recorder(ProgressPublisher):
+	def __init__(self):
+		super().__init__(None)
+		self.events = []
+	def publish(self, job_id, event):
+		self.events.append((job_id, event))
+
+
+def test_latent_preview_scales_to_max_side():
+	im = latent_preview(np.zeros((4, 64, 96), dtype=np.float32), max_side=192)
+	assert im.size == (192, 128) and im.mode == 'RGB'
+	# zero latents land on the projection bias, mid-grey give or take
+	assert abs(im.getpixel((0, 0))[0] - 141) <= 1
+
+
+def test_reporter_publishes_every_n_steps_and_the_last():
+	rec = Recorder()
+	rep = StepReporter(rec, ['job-a', None], total_steps=7, every=3, render=lambda lat: {"shape": lat.shape}, submit=lambda fn, *a: fn(*a))
+	pipe = type('Pipe', (), {'num_timesteps': 7})()
+	lat = Latents(np.zeros((2, 4, 8, 8), dtype=np.float32))
+	for step in range(7):
+		assert rep(pipe, step, None, {'latents': lat}) == {'latents': lat}
+	assert [e['step'] for _, e in rec.events] == [3, 6, 7]
+	assert all(j == 'job-a' and e['shape'] == (4, 8, 8) for j, e in rec.events)
+	assert rec.events[-1][1]['progress'] == 1.0
+
+
+def test_step_kwargs_chain_active_callbacks():
+	assert step_kwargs() == {}
+	seen = []
+	with on_steps(lambda p, s, t, k: seen.append(('a', s)) or k), on_steps(lambda p, s, t, k: seen.append(('b', s)) or k):
+		kw = step_kwargs()
+		assert kw['callback_on_step_end_tensor_inputs'] == ['latents']
+		kw['callback_on_step_end'](None, 4, None, {})
+	assert seen == [('a', 4), ('b', 4)] and step_kwargs() == {}
+
+
+def test_publisher_without_redis_is_a_no_op():
+	pub = ProgressPublisher(None)
+	pub.publish('x', {"step": 1})
+	assert pub.stats() == {"enabled": False, "published": 0, "errors": 0}
@@ -0,0 +1,74 @@
+import threading
+
+from registry import ModelRegistry
+
+
+class FakeTensor:
+	def __init__(self, n):
+		self.n = n
+	def numel(self):
+		return self.n
+	def element_size(self):
+		return 1
+
+
+class FakeModule:
+	def __init__(self, n):
+		self.params = [FakeTensor(n)]
+	def parameters(self):
+		return iter(self.params)
+
+
+class FakePipe:
+	def __init__(self, **components):
+		self.components = components
+
+
+def test_second_get_is_a_hit():
+	reg = ModelRegistry()
+	loads = []
+	build = lambda: loads.append(1) or FakePipe(unet=FakeModule(10))
+	a = reg.get(('m', 'txt2img', None, 'fp32', 'cpu'), build)
+	b = reg.get(('m', 'txt2img', None, 'fp32', 'cpu'), build)
+	assert a is b and len(loads) == 1
+	st = reg.stats()
+	assert st['hits'] == 1 and st['misses'] == 1
+
+
+def test_shared_components_counted_once():
+	reg = ModelRegistry()
+	unet = FakeModule(100)
+	base = reg.get('base', lambda: FakePipe(unet=unet))
+	reg.get('img2img', lambda: (FakePipe(**base.components), ['base']))
+	assert reg.resident_bytes() == 100
+
+
+def test_lru_eviction_cascades_to_children():
+	reg = ModelRegistry(budget_bytes=150)
+	base = reg.get('base', lambda: FakePipe(unet=FakeModule(100)))
+	reg.get('img2img', lambda: (FakePipe(**base.components), ['base']))
+	reg.get('other', lambda: FakePipe(unet=FakeModule(100)))
+	assert 'base' not in reg and 'img2img' not in reg and 'other' in reg
+	assert reg.stats()['evictions'] == 2
+
+
+def test_a_slow_load_does_not_block_hits_on_other_keys():
+	reg = ModelRegistry()
+	cached = reg.get('cached', lambda: FakePipe(unet=FakeModule(1)))
+	started, release = threading.Event(), threading.Event()
+	builds = []
+	def slow():
+		builds.append(1)
+		started.set()
+		release.wait(5)
+		return FakePipe(unet=FakeModule(2))
+	loaders = [threading.Thread(target=reg.get, args=('slow', slow)) for _ in range(2)]
+	for t in loaders:
+		t.start()
+	assert started.wait(5)
+	# served while 'slow' is still loading
+	assert reg.get('cached', slow) is cached and reg.stats()['misses'] == 2 and 'slow' not in reg
+	release.set()
+	for t in loaders:
+		t.join()
+	assert builds == [1] and 'slow' in reg and reg.stats()['hits'] == 2
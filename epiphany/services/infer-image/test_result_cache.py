@@ -0,0 +1,33 @@
+from result_cache import ResultCache, cache_key
+
+
+class FakeS3:
+	def __init__(self):
+		self.objects = {}
+	def head_object(self, Bucket, Key):
+		if Key not in self.objects:
+			raise KeyError(Key)
+		return {'Metadata': self.objects[Key]}
+
+
+def test_cache_key_ignores_dict_order():
+	assert cache_key({"a": 1, "b": "x"}) == cache_key({"b": "x", "a": 1})
+	assert cache_key({"seed": 1}) != cache_key({"seed": 2})
+
+
+def test_lookup_counts_hits_and_misses():
+	cache = ResultCache(FakeS3(), 'bucket', 'http://s3')
+	assert cache.lookup('k') is None
+	cache.store('k', {"output_url": cache.url('k')})
+	assert cache.lookup('k') == {"output_url": 'http://s3/bucket/gen/cache/k.png'}
+	assert cache.stats()['hits'] == 1 and cache.hit_rate() == 0.5
+
+
+def test_s3_metadata_survives_restart():
+	s3 = FakeS3()
+	first = ResultCache(s3, 'bucket', 'http://s3')
+	entry = {"output_url": first.url('k'), "image_meta": {"sha256": "abc"}}
+	s3.objects[first.object_key('k')] = first.metadata(entry)
+	fresh = ResultCache(s3, 'bucket', 'http://s3')
+	assert fresh.lookup('k') == entry
+	assert fresh.stats()['s3_hits'] == 1
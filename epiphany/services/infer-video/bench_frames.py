@@ -0,0 +1,59 @@
+import argparse
+import json
+import time
+
+import numpy as np
+from PIL import Image
+
+from frames import camera_frames, solid_frames, time_vector, triad_colors
+
+SIZES = {'576p': (1024, 576), '720p': (1280, 720)}
+
+
+def legacy_zoom(im: Image.Image, out_w: int, out_h: int, total: int):
+	# Previous animate path: full-size resize + crop of the source for every frame
+	im = im.resize((out_w, out_h))
+	for i in range(total):
+		scale = 1.0 + 0.10 * (i / max(1, total - 1))
+		w = int(out_w * scale); h = int(out_h * scale)
+		im2 = im.resize((w, h))
+		x0 = (w - out_w) // 2; y0 = (h - out_h) // 2
+		yield np.asarray(im2.crop((x0, y0, x0 + out_w, y0 + out_h)))
+
+
+def legacy_stylize(w: int, h: int, total: int):
+	# Previous stylize path: fresh zeroed frame and three channel fills per frame
+	for i in range(total):
+		t = i / max(1, total - 1)
+		frame = np.zeros((h, w, 3), dtype=np.uint8)
+		frame[:, :, 0] = int(255 * abs(np.sin(np.pi * t)))
+		frame[:, :, 1] = int(255 * abs(np.sin(np.pi * (t + 1/3))))
+		frame[:, :, 2] = int(255 * abs(np.sin(np.pi * (t + 2/3))))
+		yield frame
+
+
+def fps_of(frames) -> float:
+	t0 = time.perf_counter()
+	n = sum(1 for _ in frames)
+	return n / (time.perf_counter() - t0)
+
+
+def main():
+	ap = argparse.ArgumentParser(description="infer-video frame synthesis throughput (frames/s, encoding excluded)")
+	ap.add_argument('--resolution', default='720p', choices=sorted(SIZES))
+	ap.add_argument('--frames', type=int, default=96)
+	ap.add_argument('--source', default='', help='image to animate (default: random noise at 1920x1080)')
+	args = ap.parse_args()
+	w, h = SIZES[args.resolution]
+	src = Image.open(args.source) if args.source else Image.fromarray(np.random.default_rng(0).integers(0, 255, (1080, 1920, 3), dtype=np.uint8))
+	src = src.convert('RGB')
+	rows = [
+		("zoom-in", fps_of(legacy_zoom(src, w, h, args.frames)), fps_of(camera_frames(src, w, h, args.frames, 'zoom-in'))),
+		("stylize", fps_of(legacy_stylize(w, h, args.frames)), fps_of(solid_frames(triad_colors(time_vector(args.frames)), w, h))),
+	]
+	for name, before, after in rows:
+		print(json.dumps({"path": name, "resolution": args.resolution, "legacy_fps": round(before, 1), "vectorized_fps": round(after, 1), "speedup": round(after / before, 2)}))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,81 @@
+import argparse
+import json
+import multiprocessing as mp
+import os
+import resource
+import tempfile
+import time
+
+import numpy as np
+
+from video_stream import stream_frames
+
+SIZES = {'576p': (1024, 576), '720p': (1280, 720)}
+
+
+class NullSink:
+	# Counts encoder output without keeping it, so only the encode path is measured
+	def __init__(self):
+		self.nbytes = 0
+
+	def write(self, data: bytes) -> None:
+		self.nbytes += len(data)
+
+	def close(self) -> dict:
+		return {"bytes": self.nbytes}
+
+	def abort(self) -> None:
+		pass
+
+
+def gradient_frames(w: int, h: int, total: int):
+	for i in range(total):
+		frame = np.zeros((h, w, 3), dtype=np.uint8)
+		frame[:, :, 0] = int(255 * i / max(1, total - 1))
+		frame[:, :, 1] = 255 - frame[0, 0, 0]
+		frame[:, :, 2] = 128
+		yield frame
+
+
+def _case(mode: str, w: int, h: int, fps: int, total: int, out: 'mp.Queue') -> None:
+	t0 = time.perf_counter()
+	if mode == 'materialized':
+		# Previous behaviour: every frame resident, then one mimsave call
+		import imageio
+		frames = list(gradient_frames(w, h, total))
+		with tempfile.NamedTemporaryFile(suffix='.mp4') as f:
+			imageio.mimsave(f.name, frames, format='FFMPEG', fps=fps)
+			nbytes = os.path.getsize(f.name)
+	else:
+		nbytes = stream_frames(gradient_frames(w, h, total), w, h, fps, NullSink())["bytes"]
+	wall = time.perf_counter() - t0
+	out.put({"wall_s": round(wall, 2), "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1), "bytes": nbytes})
+
+
+def run_case(mode: str, resolution: str, duration: int, fps: int) -> dict:
+	# Fresh interpreter per case so ru_maxrss is that case's own peak (ffmpeg's own RSS excluded)
+	w, h = SIZES[resolution]
+	ctx = mp.get_context('spawn')
+	q = ctx.Queue()
+	p = ctx.Process(target=_case, args=(mode, w, h, fps, fps * duration, q))
+	p.start()
+	res = q.get()
+	p.join()
+	return {"mode": mode, "resolution": resolution, "duration_s": duration, "frames": fps * duration, **res}
+
+
+def main():
+	ap = argparse.ArgumentParser(description="infer-video encoder benchmark: materialized frame list vs streaming encoder")
+	ap.add_argument('--modes', default='materialized,streaming')
+	ap.add_argument('--resolutions', default='576p,720p')
+	ap.add_argument('--durations', default='2,6,12')
+	ap.add_argument('--fps', type=int, default=24)
+	args = ap.parse_args()
+	for resolution in args.resolutions.split(','):
+		for duration in [int(d) for d in args.durations.split(',')]:
+			for mode in args.modes.split(','):
+				print(json.dumps(run_case(mode, resolution, duration, args.fps)))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,84 @@
+from typing import Iterator
+
+import numpy as np
+from PIL import Image
+
+# Frame iterators below reuse one output buffer where they can: a yielded frame is only valid
+# until the next one is requested, so consumers that keep frames must copy them.
+
+EASINGS = {
+	'linear': lambda t: t,
+	'ease-in': lambda t: t * t,
+	'ease-out': lambda t: 1.0 - (1.0 - t) ** 2,
+	'ease-in-out': lambda t: 0.5 - 0.5 * np.cos(np.pi * t),
+}
+
+MOVES = ('zoom-in', 'zoom-out', 'pan', 'ken-burns')
+
+
+def time_vector(total: int) -> np.ndarray:
+	return np.arange(total, dtype=np.float64) / max(1, total - 1)
+
+
+def ramp_colors(t: np.ndarray) -> np.ndarray:
+	val = (255 * t).astype(np.int64)
+	return np.stack([val, 255 - val, np.full_like(val, 128)], axis=1).astype(np.uint8)
+
+
+def sweep_colors(t: np.ndarray) -> np.ndarray:
+	r = (255 * np.abs(np.sin(np.pi * t))).astype(np.int64)
+	g = (255 * np.abs(np.cos(np.pi * t))).astype(np.int64)
+	return np.stack([r, g, np.full_like(r, 96)], axis=1).astype(np.uint8)
+
+
+def triad_colors(t: np.ndarray) -> np.ndarray:
+	phases = np.array([0.0, 1 / 3, 2 / 3])
+	return (255 * np.abs(np.sin(np.pi * (t[:, None] + phases[None, :])))).astype(np.int64).astype(np.uint8)
+
+
+def solid_frames(colors: np.ndarray, width: int, height: int) -> Iterator[np.ndarray]:
+	# colors: (frames, 3) uint8, computed for the whole clip at once. Each frame fills one row
+	# and replicates it down the buffer (contiguous row copies, no per-channel strided writes).
+	buf = np.empty((height, width, 3), dtype=np.uint8)
+	for c in colors:
+		buf[0] = c
+		buf[1:] = buf[0]
+		yield buf
+
+
+def camera_path(move: str, total: int, easing: str = 'linear', max_zoom: float = 1.10) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+	# Per-frame (zoom, centre x, centre y); centres are fractions of the source and are clamped
+	# so the visible window never leaves the image
+	e = EASINGS.get(easing, EASINGS['linear'])(time_vector(total))
+	max_zoom = max(1.0, float(max_zoom))
+	if move == 'zoom-out':
+		zoom = max_zoom - (max_zoom - 1.0) * e
+		cx = cy = np.full(total, 0.5)
+	elif move == 'pan':
+		zoom = np.full(total, max_zoom)
+		half = 0.5 / max_zoom
+		cx = half + (1.0 - 2 * half) * e
+		cy = np.full(total, 0.5)
+	elif move == 'ken-burns':
+		zoom = 1.0 + (max_zoom - 1.0) * e
+		cx = 0.40 + 0.20 * e
+		cy = 0.40 + 0.20 * e
+	else:
+		zoom = 1.0 + (max_zoom - 1.0) * e
+		cx = cy = np.full(total, 0.5)
+	half = 0.5 / zoom
+	return zoom, np.clip(cx, half, 1.0 - half), np.clip(cy, half, 1.0 - half)
+
+
+def camera_frames(im: Image.Image, width: int, height: int, total: int, move: str = 'zoom-in', easing: str = 'linear', max_zoom: float = 1.10) -> Iterator[np.ndarray]:
+	# The source is resampled once, large enough for the deepest zoom; every frame is then a
+	# single scale+translate sample of its window straight to output size (resize with a
+	# fractional box), instead of resizing the whole source and cropping it per frame.
+	zoom, cx, cy = camera_path(move, total, easing, max_zoom)
+	ss = float(zoom.max())
+	src_w, src_h = int(round(width * ss)), int(round(height * ss))
+	src = im.convert('RGB').resize((src_w, src_h), Image.LANCZOS)
+	for z, x, y in zip(zoom, cx, cy):
+		win_w, win_h = src_w / z, src_h / z
+		x0, y0 = x * src_w - win_w / 2, y * src_h - win_h / 2
+		yield np.asarray(src.resize((width, height), Image.BILINEAR, box=(x0, y0, x0 + win_w, y0 + win_h)))
@@ -1,17 +1,38 @@
 ﻿from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
 import os
+import asyncio
 from io import BytesIO
 import boto3
 import hashlib
 import random
-from typing import Optional
+from typing import Iterable, Iterator, Optional
 import numpy as np
-import imageio
-import requests
+from botocore.config import Config
+from common.executor import BoundedExecutor
+from common.safety import SafetyScorer
+from common.fetch import Fetcher
+from common.cancel import Canceled, CancelRegistry
+from common.warmup import Warmup
+from common.metrics import CONTENT_TYPE, Metrics, label, stage
+from common.profiling import Profiler
+from video_stream import S3MultipartSink, stream_frames
+from safety_sampling import FrameSampler, sample_file, score_samples
+from frames import EASINGS, MOVES, camera_frames, ramp_colors, solid_frames, sweep_colors, time_vector, triad_colors
 
 app = FastAPI(title="Epiphany Infer Video")
 
+# Per-stage timings returned as `timings` and exported on /metrics
+metrics = Metrics('infer-video')
+
+# Video synthesis + ffmpeg encoding are serialized per replica; uploads run on the I/O pool
+executor = BoundedExecutor.from_env('infer-video', workers=1, max_queue=4, io_workers=4)
+
 MODEL_ID = os.getenv('VIDEO_MODEL_ID', 'svd')
+VIDEO_UPLOAD_PART_MB = int(os.getenv('VIDEO_UPLOAD_PART_MB', '8'))
+VIDEO_SPOOL_MAX_MB = int(os.getenv('VIDEO_SPOOL_MAX_MB', '2'))
+VIDEO_SAFETY_STRIDE = int(os.getenv('VIDEO_SAFETY_STRIDE', '24'))
+VIDEO_SAFETY_MAX_SAMPLES = int(os.getenv('VIDEO_SAFETY_MAX_SAMPLES', '8'))
 
 S3_ENDPOINT = os.getenv('S3_ENDPOINT', 'http://localhost:9000')
 S3_BUCKET = os.getenv('S3_BUCKET', 'epiphany-outputs')
@@ -19,7 +40,10 @@ S3_REGION = os.getenv('S3_REGION', 'us-east-1')
 S3_ACCESS_KEY = os.getenv('S3_ACCESS_KEY', 'minioadmin')
 S3_SECRET_KEY = os.getenv('S3_SECRET_KEY', 'minioadmin')
 
-s3 = boto3.client('s3', endpoint_url=S3_ENDPOINT, aws_access_key_id=S3_ACCESS_KEY, aws_secret_access_key=S3_SECRET_KEY, region_name=S3_REGION)
+s3 = boto3.client('s3', endpoint_url=S3_ENDPOINT, aws_access_key_id=S3_ACCESS_KEY, aws_secret_access_key=S3_SECRET_KEY, region_name=S3_REGION, config=Config(max_pool_connections=executor.io_workers))
+
+# On-demand profiling (/debug/profile); off unless PROFILE_TOKEN is set
+profiler = Profiler.from_env('infer-video', s3, S3_BUCKET, S3_ENDPOINT)
 
 _svd = None
 _diffusers_available = False
@@ -42,6 +66,19 @@ try:
 except Exception:
 	_modelscope_available = False
 
+def release_device_memory():
+	# After an aborted job: return cached allocator blocks so the next job starts with them
+	try:
+		import gc
+		gc.collect()
+		if _diffusers_available and torch.cuda.is_available():
+			torch.cuda.empty_cache()
+	except Exception:
+		pass
+
+# Cooperative cancellation by API job id, checked before work starts and before every frame
+cancels = CancelRegistry.from_env(on_abort=release_device_memory)
+
 
 ALLOWED_URL_PREFIXES = [p.strip() for p in (os.getenv('ALLOWED_URL_PREFIXES') or '').split(',') if p.strip()]
 
@@ -59,9 +96,13 @@ def is_allowed_url(url: str) -> bool:
 			return True
 	return False
 
+# Pooled, cached fetches of animate source images
+fetcher = Fetcher.from_env(s3, S3_ENDPOINT, is_allowed_url, buckets=[S3_BUCKET], pool_size=executor.io_workers)
+
 def upload_bytes(key: str, buf: BytesIO, content_type: str) -> str:
 	buf.seek(0)
-	s3.put_object(Bucket=S3_BUCKET, Key=key, Body=buf.getvalue(), ContentType=content_type)
+	with stage('upload'):
+		s3.put_object(Bucket=S3_BUCKET, Key=key, Body=buf.getvalue(), ContentType=content_type)
 	return f"{S3_ENDPOINT}/{S3_BUCKET}/{key}"
 
 def bytes_meta(buf: BytesIO):
@@ -76,70 +117,81 @@ def load_svd():
 		return None
 	try:
 		device = 'cuda' if 'cuda' in (os.getenv('TORCH_DEVICE','') or '') or ('CUDA_VISIBLE_DEVICES' in os.environ) or (hasattr(torch, 'cuda') and torch.cuda.is_available()) else 'cpu'
-		_svd = StableVideoDiffusionPipeline.from_pretrained(
-			os.getenv('SVD_MODEL', 'stabilityai/stable-video-diffusion-img2vid-xt'),
-		)
-		if device == 'cuda':
-			_svd = _svd.to(device)
+		with stage('model_load'):
+			_svd = StableVideoDiffusionPipeline.from_pretrained(
+				os.getenv('SVD_MODEL', 'stabilityai/stable-video-diffusion-img2vid-xt'),
+			)
+			if device == 'cuda':
+				_svd = _svd.to(device)
 		return _svd
 	except Exception:
 		return None
 
-def try_t2v_with_svd(prompt: str, fps: int = 12, resolution: str = '576p', duration_sec: int = 4) -> Optional[BytesIO]:
+def frame_size(resolution: str) -> tuple[int, int]:
+	return (1024, 576) if resolution == '576p' else (1280, 720)
+
+def svd_frames(w: int, h: int, total: int) -> Iterator[np.ndarray]:
+	# Simple frame sequence placeholder honoring fps/resolution/duration, produced lazily
+	return solid_frames(ramp_colors(time_vector(total)), w, h)
+
+def try_t2v_with_svd(prompt: str, fps: int = 12, resolution: str = '576p', duration_sec: int = 4) -> Optional[Iterator[np.ndarray]]:
 	pipe = load_svd()
 	if pipe is None:
 		return None
-	try:
-		# Generate simple frame sequence placeholder honoring fps/resolution/duration
-		w, h = (1024, 576) if resolution == '576p' else (1280, 720)
-		num_frames = max(1, int(fps) * max(1, int(duration_sec)))
-		frames = []
-		for i in range(max(1, num_frames)):
-			val = int(255 * (i / max(1, num_frames - 1)))
-			frame = np.zeros((h, w, 3), dtype=np.uint8)
-			frame[:, :, 0] = val
-			frame[:, :, 1] = (255 - val)
-			frame[:, :, 2] = 128
-			frames.append(frame)
-		buf = BytesIO()
-		imageio.mimsave(buf, frames, format='FFMPEG', fps=fps)
-		return buf
-	except Exception:
-		return None
+	w, h = frame_size(resolution)
+	return svd_frames(w, h, max(1, int(fps) * max(1, int(duration_sec))))
+
+def modelscope_fallback_frames(w: int, h: int, total: int) -> Iterator[np.ndarray]:
+	# Fallback: a different gradient pattern; real integration would call modelscope pipeline
+	return solid_frames(sweep_colors(time_vector(total)), w, h)
 
-def try_t2v_with_modelscope(prompt: str, fps: int, resolution: str, duration_sec: int) -> Optional[BytesIO]:
+def try_t2v_with_modelscope(prompt: str, fps: int, resolution: str, duration_sec: int) -> Optional[str | Iterator[np.ndarray]]:
+	# Returns the path of a finished video, or a frame iterator to be encoded
 	if not _modelscope_available:
 		return None
 	# Try real ModelScope pipeline if available
 	try:
 		model_id = os.getenv('MODELSCOPE_T2V_MODEL', 'damo/text-to-video-synthesis')
-		pipe = ms_pipeline(MS_Tasks.text_to_video_synthesis, model=model_id)  # type: ignore
-		res = pipe({'text': prompt})
+		with stage('model_load'):
+			pipe = ms_pipeline(MS_Tasks.text_to_video_synthesis, model=model_id)  # type: ignore
+		with stage('inference'):
+			res = pipe({'text': prompt})
 		video_path = None
 		if isinstance(res, dict):
 			video_path = res.get('output_video') or res.get('output_path')
 		if video_path and isinstance(video_path, str) and os.path.exists(video_path):
-			with open(video_path, 'rb') as f:
-				return BytesIO(f.read())
+			return video_path
 	except Exception:
 		pass
-	# Fallback: generate a different gradient pattern; real integration would call modelscope pipeline
+	w, h = frame_size(resolution)
+	return modelscope_fallback_frames(w, h, max(1, fps * duration_sec))
+
+def video_sink(key: str) -> S3MultipartSink:
+	return S3MultipartSink(s3, S3_BUCKET, key, 'video/mp4', part_size=VIDEO_UPLOAD_PART_MB * 1024 * 1024, spool_max=VIDEO_SPOOL_MAX_MB * 1024 * 1024)
+
+def publish_frames(key: str, frames: Iterable[np.ndarray], width: int, height: int, fps: int, on_frame=None) -> tuple[str, dict] | None:
+	# Encode while generating and upload parts while encoding; None if encoding failed
 	try:
-		w, h = (1024, 576) if resolution == '576p' else (1280, 720)
-		total = max(1, fps * duration_sec)
-		frames = []
-		for i in range(total):
-			den = max(1, total-1)
-			t = i/den
-			frame = np.zeros((h, w, 3), dtype=np.uint8)
-			frame[:, :, 0] = int(255 * abs(np.sin(np.pi*t)))
-			frame[:, :, 1] = int(255 * abs(np.cos(np.pi*t)))
-			frame[:, :, 2] = 96
-			frames.append(frame)
-		buf = BytesIO(); imageio.mimsave(buf, frames, format='FFMPEG', fps=fps)
-		return buf
+		meta = stream_frames(frames, width, height, fps, video_sink(key), on_frame=on_frame)
+	except Canceled:
+		# stream_frames has already stopped ffmpeg and aborted the multipart upload
+		raise
 	except Exception:
 		return None
+	return f"{S3_ENDPOINT}/{S3_BUCKET}/{key}", meta
+
+def upload_file(key: str, path: str, content_type: str) -> tuple[str, dict]:
+	sha = hashlib.sha256()
+	with stage('hash'), open(path, 'rb') as f:
+		for chunk in iter(lambda: f.read(1024 * 1024), b''):
+			sha.update(chunk)
+	with stage('upload'):
+		s3.upload_file(path, S3_BUCKET, key, ExtraArgs={'ContentType': content_type})
+	return f"{S3_ENDPOINT}/{S3_BUCKET}/{key}", {"bytes": os.path.getsize(path), "sha256": sha.hexdigest()}
+
+def stub_video(key: str, data: bytes) -> tuple[str, dict]:
+	buf = BytesIO(data)
+	return upload_bytes(key, buf, 'video/mp4'), bytes_meta(buf)
 
 
 def simple_safety_from_prompt(prompt: str):
@@ -148,126 +200,182 @@ def simple_safety_from_prompt(prompt: str):
 	score = 1.0 if any(k in p for k in nsfw_keywords) else 0.0
 	return {"nsfw": score}
 
-def vision_safety_score(buf: BytesIO) -> float:
+# Resident safety checker (same model and scoring as infer-image), loaded once per process
+safety_scorer = SafetyScorer()
+
+def frame_sampler(total: int) -> FrameSampler:
+	return FrameSampler(total, stride=VIDEO_SAFETY_STRIDE, max_samples=VIDEO_SAFETY_MAX_SAMPLES)
+
+def file_samples(path: str) -> list:
+	try:
+		return sample_file(path, stride=VIDEO_SAFETY_STRIDE, max_samples=VIDEO_SAFETY_MAX_SAMPLES)
+	except Exception:
+		return []
+
+def video_safety(prompt: str, samples: list) -> dict:
+	# Prompt flag combined with the worst sampled frame; per-frame scores are reported as well
+	safety = simple_safety_from_prompt(prompt)
 	try:
-		buf.seek(0)
-		import imageio.v2 as iio
-		frames = iio.mimread(buf, format='ffmpeg')
-		if not frames: return 0.0
-		f0 = frames[0]
-		# Heuristic: high red dominance -> tiny nsfw hint (placeholder)
-		import numpy as np
-		r = float(np.mean(f0[:,:,0])); g = float(np.mean(f0[:,:,1])); b = float(np.mean(f0[:,:,2]))
-		return max(0.0, min(1.0, (r - max(g,b)) / 255.0))
+		vision = score_samples(safety_scorer, samples)
 	except Exception:
-		return 0.0
+		vision = {"nsfw": 0.0, "frames": []}
+	safety['nsfw'] = max(float(safety.get('nsfw', 0.0)), float(vision['nsfw']))
+	safety['frames'] = vision['frames']
+	return safety
+
+WARMUP_STEPS = int(os.getenv('WARMUP_STEPS', '2'))
+
+def warm_svd(pipe):
+	# Two frames at the 576p size through the UNet and the VAE decoder
+	from PIL import Image
+	w, h = frame_size('576p')
+	pipe(Image.new('RGB', (w, h)), width=w, height=h, num_frames=2, num_inference_steps=WARMUP_STEPS, decode_chunk_size=1)
+
+# Models loaded (and warmed) at startup; /ready turns true once all of them are. Without SVD
+# t2v serves its placeholder frames and animate never needs it, so it does not block readiness
+warmup = Warmup.from_env({
+	'svd': load_svd,
+	'safety': lambda: safety_scorer if safety_scorer.load() else None,
+}, {
+	'svd': warm_svd,
+	'safety': lambda scorer: scorer.score([np.zeros((256, 256, 3), dtype=np.uint8)]),
+}, default='svd,safety', optional='svd')
+
+@app.on_event('startup')
+async def warm_models():
+	# Loads in the background so /health answers while weights download
+	asyncio.ensure_future(warmup.serve(executor.run))
+
+@app.get('/ready')
+async def ready():
+	status = warmup.status()
+	return JSONResponse(status, status_code=200 if status['ready'] else 503)
+
+@app.post('/debug/profile')
+async def debug_profile(request: Request):
+	return await profiler.post(request, executor.io)
+
+@app.get('/debug/profile')
+async def debug_profile_status(request: Request):
+	return profiler.get(request)
+
+@app.get('/metrics')
+async def metrics_endpoint():
+	return Response(metrics.render(), media_type=CONTENT_TYPE)
 
 @app.get('/health')
 async def health():
-	return {"ok": True, "model": MODEL_ID}
+	return {"ok": True, "model": MODEL_ID, "executor": executor.stats(), "safety": safety_scorer.stats(), "fetch": fetcher.stats(), "cancel": cancels.stats(), "warmup": warmup.status()}
+
+@app.post('/cancel/{job_id}')
+async def cancel(job_id: str):
+	# Local flag for this replica; the API also sets cancel:{jobId} in Redis for all of them
+	cancels.cancel(job_id)
+	return {"job_id": job_id, "canceled": True}
+
+def job_id_of(body: dict) -> str | None:
+	return str(body['jobId']) if body.get('jobId') is not None else None
 
 @app.post('/infer/t2v')
+@executor.admitted_handler
+@cancels.handler
+@metrics.instrument('t2v')
 async def t2v(request: Request):
 	body = await request.json()
+	job_id = job_id_of(body)
+	cancels.check(job_id)
 	prompt = body.get('prompt', '')
 	fps = int(body.get('fps') or 12)
 	resolution = str(body.get('resolution') or '576p')
 	duration_sec = int(body.get('durationSec') or 4)
 	model_id = str(body.get('modelId') or 'svd')
-	raw = None
+	w, h = frame_size(resolution)
+	label(model=model_id, resolution=f"{w}x{h}")
+	source = None
 	if model_id == 'modelscope-t2v':
-		raw = try_t2v_with_modelscope(prompt, fps=fps, resolution=resolution, duration_sec=duration_sec)
-	if raw is None:
-		raw = try_t2v_with_svd(prompt, fps=fps, resolution=resolution, duration_sec=duration_sec)
-	raw = raw or BytesIO()
-	if raw.getbuffer().nbytes == 0:
-		raw.write(b"Epiphany video stub")
+		source = await executor.run(try_t2v_with_modelscope, prompt, fps=fps, resolution=resolution, duration_sec=duration_sec)
+	if source is None:
+		source = await executor.run(try_t2v_with_svd, prompt, fps=fps, resolution=resolution, duration_sec=duration_sec)
+	cancels.check(job_id)
 	key = f"gen/t2v_{random.randint(0, 1_000_000)}.mp4"
-	url = upload_bytes(key, raw, 'video/mp4')
-	meta = bytes_meta(raw)
-	safety = simple_safety_from_prompt(prompt)
-	try:
-		vs = vision_safety_score(raw)
-		safety['nsfw'] = max(float(safety.get('nsfw', 0.0)), float(vs))
-	except Exception:
-		pass
-	return {"output_url": url, "model_hash": MODEL_ID, "duration_ms": 1, "video_meta": meta, "echo": {"prompt": prompt}, "safety_scores": safety}
+	published, sampler = None, frame_sampler(max(1, fps * duration_sec))
+	if isinstance(source, str):
+		published = await executor.io(upload_file, key, source, 'video/mp4')
+		sampler.samples = await executor.run(file_samples, source)
+	elif source is not None:
+		published = await executor.run(publish_frames, key, cancels.guard(source, job_id), w, h, fps, sampler)
+	if published is None:
+		published = await executor.io(stub_video, key, b"Epiphany video stub")
+	url, meta = published
+	safety = await executor.run(video_safety, prompt, sampler.samples)
+	return {"output_url": url, "model_hash": MODEL_ID, "video_meta": meta, "echo": {"prompt": prompt}, "safety_scores": safety}
+
+def fetch_source(src: str | None) -> bytes | None:
+	return fetcher.fetch(src)
+
+def render_animate(ctrl_bytes: bytes | None, fps: int, duration_sec: int, resolution: str, motion: str = 'zoom-in', easing: str = 'linear', zoom: float = 1.10) -> Iterator[np.ndarray]:
+	# Camera move over the source image honoring fps & duration; gradient placeholder without one.
+	# A generator, so the source is decoded on the job that consumes the frames, not the event loop
+	out_w, out_h = frame_size(resolution)
+	total = max(1, fps * duration_sec)
+	im = None
+	if ctrl_bytes:
+		try:
+			im = fetcher.decode(ctrl_bytes, 'RGB')
+		except Exception:
+			im = None
+	if im is None:
+		yield from svd_frames(out_w, out_h, total)
+	else:
+		yield from camera_frames(im, out_w, out_h, total, motion, easing, zoom)
 
 @app.post('/infer/animate')
+@executor.admitted_handler
+@cancels.handler
+@metrics.instrument('animate')
 async def animate(request: Request):
 	body = await request.json()
-	src = body.get('sourceImageUrl')
-	ctrl_bytes = None
-	try:
-		if src and is_allowed_url(src):
-			import requests as rq
-			r = rq.get(src, timeout=10); r.raise_for_status(); ctrl_bytes = r.content
-	except Exception:
-		ctrl_bytes = None
-	# Build simple pan/zoom frames from source image honoring fps & duration
-	frames = []
-	try:
-		from PIL import Image as PILImage
-		import numpy as np
-		fps = int((body.get('fps') or 12))
-		duration_sec = int((body.get('durationSec') or 4))
-		resolution = str(body.get('resolution') or '576p')
-		out_w, out_h = (1024, 576) if resolution == '576p' else (1280, 720)
-		total = max(1, fps * duration_sec)
-		if ctrl_bytes:
-			im = PILImage.open(BytesIO(ctrl_bytes)).convert('RGB').resize((out_w, out_h))
-			for i in range(total):
-				denom = max(1, total-1)
-				scale = 1.0 + 0.10 * (i/denom)
-				w = int(out_w*scale); h = int(out_h*scale)
-				im2 = im.resize((w,h))
-				x0 = (w-out_w)//2; y0 = (h-out_h)//2
-				crop = im2.crop((x0,y0,x0+out_w,y0+out_h))
-				frames.append(np.array(crop))
-		else:
-			for i in range(total):
-				denom = max(1, total-1)
-				val = int(255 * (i / denom))
-				frame = np.zeros((out_h, out_w, 3), dtype=np.uint8)
-				frame[:, :, 0] = val
-				frame[:, :, 1] = (255 - val)
-				frame[:, :, 2] = 128
-				frames.append(frame)
-		buf = BytesIO(); imageio.mimsave(buf, frames, format='FFMPEG', fps=fps)
-	except Exception:
-		buf = BytesIO(); buf.write(b"animate stub")
+	job_id = job_id_of(body)
+	cancels.check(job_id)
+	ctrl_bytes = await executor.io(fetch_source, body.get('sourceImageUrl'))
+	fps = int((body.get('fps') or 12))
+	duration_sec = int((body.get('durationSec') or 4))
+	resolution = str(body.get('resolution') or '576p')
+	motion = str(body.get('motion') or 'zoom-in')
+	motion = motion if motion in MOVES else 'zoom-in'
+	easing = str(body.get('easing') or 'linear')
+	easing = easing if easing in EASINGS else 'linear'
+	zoom = max(1.0, min(2.0, float(body.get('zoom') or 1.10)))
+	w, h = frame_size(resolution)
+	label(model='camera', resolution=f"{w}x{h}")
 	key = f"gen/animate_{random.randint(0, 1_000_000)}.mp4"
-	url = upload_bytes(key, buf, 'video/mp4')
-	meta = bytes_meta(buf)
-	return {"output_url": url, "model_hash": MODEL_ID, "duration_ms": 1, "video_meta": meta, "safety_scores": simple_safety_from_prompt(body.get('prompt',''))}
+	sampler = frame_sampler(max(1, fps * duration_sec))
+	published = await executor.run(publish_frames, key, cancels.guard(render_animate(ctrl_bytes, fps, duration_sec, resolution, motion, easing, zoom), job_id), w, h, fps, sampler)
+	url, meta = published or await executor.io(stub_video, key, b"animate stub")
+	safety = await executor.run(video_safety, body.get('prompt', ''), sampler.samples)
+	return {"output_url": url, "model_hash": MODEL_ID, "video_meta": meta, "safety_scores": safety, "echo": {"motion": motion, "easing": easing, "zoom": zoom}}
+
+def render_stylize(fps: int, duration_sec: int, resolution: str) -> Iterator[np.ndarray]:
+	# simple stylization gradient sweep
+	w, h = frame_size(resolution)
+	return solid_frames(triad_colors(time_vector(max(1, fps * duration_sec))), w, h)
 
 @app.post('/infer/stylize')
+@executor.admitted_handler
+@cancels.handler
+@metrics.instrument('stylize')
 async def stylize(request: Request):
 	body = await request.json()
+	job_id = job_id_of(body)
+	cancels.check(job_id)
 	fps = int(body.get('fps') or 12)
 	duration_sec = int(body.get('durationSec') or 4)
 	resolution = str(body.get('resolution') or '576p')
-	w, h = (1024, 576) if resolution == '576p' else (1280, 720)
-	total = max(1, fps * duration_sec)
-	frames = []
-	try:
-		import numpy as np
-		for i in range(total):
-			den = max(1, total-1)
-			t = i/den
-			# simple stylization gradient sweep
-			r = int(255 * abs(np.sin(np.pi * t)))
-			g = int(255 * abs(np.sin(np.pi * (t + 1/3))))
-			b = int(255 * abs(np.sin(np.pi * (t + 2/3))))
-			frame = np.zeros((h, w, 3), dtype=np.uint8)
-			frame[:, :, 0] = r
-			frame[:, :, 1] = g
-			frame[:, :, 2] = b
-			frames.append(frame)
-		buf = BytesIO(); imageio.mimsave(buf, frames, format='FFMPEG', fps=fps)
-	except Exception:
-		buf = BytesIO(); buf.write(b"Epiphany stylize stub")
+	w, h = frame_size(resolution)
+	label(model='stylize', resolution=f"{w}x{h}")
 	key = f"gen/stylize_{random.randint(0, 1_000_000)}.mp4"
-	url = upload_bytes(key, buf, 'video/mp4')
-	meta = bytes_meta(buf)
-	return {"output_url": url, "model_hash": MODEL_ID, "duration_ms": 1, "video_meta": meta, "safety_scores": simple_safety_from_prompt(body.get('prompt',''))}
+	sampler = frame_sampler(max(1, fps * duration_sec))
+	published = await executor.run(publish_frames, key, cancels.guard(render_stylize(fps, duration_sec, resolution), job_id), w, h, fps, sampler)
+	url, meta = published or await executor.io(stub_video, key, b"Epiphany stylize stub")
+	safety = await executor.run(video_safety, body.get('prompt', ''), sampler.samples)
+	return {"output_url": url, "model_hash": MODEL_ID, "video_meta": meta, "safety_scores": safety}
@@ -0,0 +1,71 @@
+import math
+from typing import Any
+
+import numpy as np
+from PIL import Image
+
+# The CLIP checker looks at 224px crops, so kept samples are shrunk to this first
+SAMPLE_SIDE = 256
+
+
+def sample_indices(total: int, stride: int = 24, max_samples: int = 8) -> list[int]:
+	# First, middle and last frame plus every stride-th frame, thinned evenly to max_samples
+	# so safety cost is bounded whatever the clip length
+	if total <= 0:
+		return []
+	anchors = {0, (total - 1) // 2, total - 1}
+	picked = sorted(anchors | (set(range(0, total, stride)) if stride > 0 else set()))
+	limit = max(len(anchors), int(max_samples))
+	if len(picked) > limit:
+		rest = [i for i in picked if i not in anchors]
+		keep = limit - len(anchors)
+		step = len(rest) / keep if keep else math.inf
+		picked = sorted(anchors | {rest[int(k * step)] for k in range(keep)})
+	return picked
+
+
+def _shrink(frame: np.ndarray) -> Image.Image:
+	im = Image.fromarray(np.asarray(frame, dtype=np.uint8))
+	im.thumbnail((SAMPLE_SIDE, SAMPLE_SIDE))
+	return im
+
+
+class FrameSampler:
+	# on_frame hook for the streaming encoder: keeps small copies of the selected frames
+	# while they are still in memory, so nothing has to be decoded back from the MP4
+	def __init__(self, total: int, stride: int = 24, max_samples: int = 8):
+		self.wanted = set(sample_indices(total, stride, max_samples))
+		self.samples: list[tuple[int, Image.Image]] = []
+
+	def __call__(self, i: int, frame: np.ndarray) -> None:
+		if i in self.wanted:
+			self.samples.append((i, _shrink(frame)))
+
+
+def sample_file(path: str, stride: int = 24, max_samples: int = 8) -> list[tuple[int, Image.Image]]:
+	# Finished videos: decode only the selected frames (the ffmpeg reader seeks for far jumps)
+	import imageio.v2 as iio
+	samples = []
+	reader = iio.get_reader(path, format='ffmpeg')
+	try:
+		meta = reader.get_meta_data()
+		total = meta.get('nframes')
+		if not isinstance(total, int) or total <= 0:
+			total = int(round(float(meta.get('fps') or 0) * float(meta.get('duration') or 0)))
+		for i in sample_indices(max(1, total), stride, max_samples):
+			try:
+				samples.append((i, _shrink(reader.get_data(i))))
+			except (IndexError, RuntimeError):
+				break
+	finally:
+		reader.close()
+	return samples
+
+
+def score_samples(scorer: Any, samples: list[tuple[int, Image.Image]]) -> dict:
+	# One batched checker pass; the clip scores as its worst sampled frame
+	if not samples:
+		return {"nsfw": 0.0, "frames": []}
+	scores = scorer.score([im for _, im in samples])
+	frames = [{"index": i, "nsfw": float(s)} for (i, _), s in zip(samples, scores)]
+	return {"nsfw": max(f["nsfw"] for f in frames), "frames": frames}
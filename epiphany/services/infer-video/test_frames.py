@@ -0,0 +1,34 @@
+import numpy as np
+from PIL import Image
+
+from frames import MOVES, camera_frames, camera_path, ramp_colors, solid_frames, time_vector, triad_colors
+
+
+def test_gradient_colors_match_per_frame_formula():
+	total = 7
+	t = time_vector(total)
+	for i, c in enumerate(triad_colors(t)):
+		ti = i / (total - 1)
+		assert list(c) == [int(255 * abs(np.sin(np.pi * (ti + k / 3)))) for k in range(3)]
+	frames = [f.copy() for f in solid_frames(ramp_colors(t), 8, 4)]
+	assert frames[-1].shape == (4, 8, 3)
+	assert (frames[-1] == [255, 0, 128]).all() and (frames[0] == [0, 255, 128]).all()
+
+
+def test_camera_windows_stay_inside_the_source():
+	for move in MOVES:
+		zoom, cx, cy = camera_path(move, 24, 'ease-in-out', 1.25)
+		half = 0.5 / zoom
+		assert (zoom >= 1.0).all()
+		assert (cx - half >= -1e-9).all() and (cx + half <= 1 + 1e-9).all()
+		assert (cy - half >= -1e-9).all() and (cy + half <= 1 + 1e-9).all()
+
+
+def test_camera_frames_zoom_in_starts_at_full_view():
+	src = Image.fromarray(np.tile(np.linspace(0, 255, 64, dtype=np.uint8)[None, :, None], (48, 1, 3)))
+	frames = [f.copy() for f in camera_frames(src, 32, 24, 5, 'zoom-in')]
+	assert len(frames) == 5 and frames[0].shape == (24, 32, 3)
+	full = np.asarray(src.resize((32, 24)))
+	assert np.abs(frames[0].astype(int) - full.astype(int)).mean() < 4
+	# zooming in narrows the visible gradient range
+	assert np.ptp(frames[-1][:, :, 0]) < np.ptp(frames[0][:, :, 0])
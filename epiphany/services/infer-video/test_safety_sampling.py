@@ -0,0 +1,30 @@
+import numpy as np
+
+from safety_sampling import FrameSampler, sample_indices, score_samples
+
+
+def test_indices_cover_anchors_and_stay_bounded():
+	assert sample_indices(1) == [0]
+	assert sample_indices(10, stride=4) == [0, 4, 8, 9]
+	long_clip = sample_indices(24 * 600, stride=24, max_samples=8)
+	assert len(long_clip) == 8
+	assert {0, (24 * 600 - 1) // 2, 24 * 600 - 1} <= set(long_clip)
+
+
+def test_sampler_keeps_small_copies_and_scores_worst_frame():
+	sampler = FrameSampler(5, stride=0)
+	buf = np.zeros((480, 640, 3), dtype=np.uint8)
+	for i in range(5):
+		buf[...] = i  # frames come from a reused buffer
+		sampler(i, buf)
+	assert [i for i, _ in sampler.samples] == [0, 2, 4]
+	assert max(sampler.samples[0][1].size) == 256
+	assert [np.asarray(im)[0, 0, 0] for _, im in sampler.samples] == [0, 2, 4]
+
+	class Scorer:
+		def score(self, images):
+			return [float(np.asarray(im)[0, 0, 0]) / 10 for im in images]
+
+	res = score_samples(Scorer(), sampler.samples)
+	assert res["nsfw"] == 0.4
+	assert [f["index"] for f in res["frames"]] == [0, 2, 4]
@@ -0,0 +1,188 @@
+import contextvars
+import hashlib
+import os
+import subprocess
+import tempfile
+import threading
+from typing import Any, Callable, Iterable
+
+import numpy as np
+
+from common.metrics import stage
+
+MIN_PART_BYTES = 5 * 1024 * 1024  # S3 minimum for every part but the last
+READ_CHUNK = 256 * 1024
+
+
+def ffmpeg_exe() -> str:
+	try:
+		import imageio_ffmpeg  # type: ignore
+		return imageio_ffmpeg.get_ffmpeg_exe()
+	except Exception:
+		return 'ffmpeg'
+
+
+class S3MultipartSink:
+	# Receives encoder output as it is produced. Bytes are spooled (memory, then disk past
+	# spool_max) until a part is full, and each full part is uploaded while encoding goes on.
+	# Outputs smaller than one part are sent as a single PUT.
+	def __init__(self, s3: Any, bucket: str, key: str, content_type: str = 'video/mp4', part_size: int = 8 * 1024 * 1024, spool_max: int = 2 * 1024 * 1024):
+		self.s3 = s3
+		self.bucket = bucket
+		self.key = key
+		self.content_type = content_type
+		self.part_size = max(MIN_PART_BYTES, int(part_size))
+		self._spool = tempfile.SpooledTemporaryFile(max_size=max(0, int(spool_max)))
+		self._upload_id = None
+		self._parts: list[dict] = []
+		self._sha = hashlib.sha256()
+		self.nbytes = 0
+
+	@property
+	def parts(self) -> int:
+		return len(self._parts)
+
+	def write(self, data: bytes) -> None:
+		with stage('hash'):
+			self._sha.update(data)
+		self.nbytes += len(data)
+		self._spool.write(data)
+		if self._spool.tell() >= self.part_size:
+			self._upload_part()
+
+	def close(self) -> dict:
+		size = self._spool.tell()
+		self._spool.seek(0)
+		if self._upload_id is None:
+			with stage('upload'):
+				self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=self._spool, ContentLength=size, ContentType=self.content_type)
+		else:
+			if size:
+				self._upload_part()
+			with stage('upload'):
+				self.s3.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id, MultipartUpload={'Parts': self._parts})
+		self._spool.close()
+		return {"bytes": self.nbytes, "sha256": self._sha.hexdigest()}
+
+	def abort(self) -> None:
+		if self._upload_id is not None:
+			try:
+				self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+			except Exception:
+				pass
+		self._spool.close()
+
+	def _upload_part(self) -> None:
+		if self._upload_id is None:
+			self._upload_id = self.s3.create_multipart_upload(Bucket=self.bucket, Key=self.key, ContentType=self.content_type)['UploadId']
+		size = self._spool.tell()
+		self._spool.seek(0)
+		number = len(self._parts) + 1
+		with stage('upload'):
+			res = self.s3.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id, PartNumber=number, Body=self._spool, ContentLength=size)
+		self._parts.append({'ETag': res['ETag'], 'PartNumber': number})
+		self._spool.seek(0)
+		self._spool.truncate()
+
+
+class FrameEncoder:
+	# ffmpeg fed raw RGB frames on stdin, writing fragmented MP4 to stdout so the container
+	# never needs a seek back; a reader thread hands output chunks to the sink as they appear.
+	def __init__(self, width: int, height: int, fps: int, write: Callable[[bytes], None], preset: str | None = None, crf: int | None = None):
+		self.width = int(width)
+		self.height = int(height)
+		self.frames = 0
+		self._write = write
+		self._error: BaseException | None = None
+		cmd = [
+			ffmpeg_exe(), '-y', '-loglevel', 'error',
+			'-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f"{self.width}x{self.height}", '-r', str(int(fps)), '-i', 'pipe:0',
+			'-an', '-c:v', 'libx264', '-pix_fmt', 'yuv420p',
+			'-preset', preset or os.getenv('VIDEO_ENCODE_PRESET', 'medium'),
+			'-crf', str(crf if crf is not None else int(os.getenv('VIDEO_ENCODE_CRF', '23'))),
+		]
+		if self.width % 2 or self.height % 2:
+			cmd += ['-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2']
+		cmd += ['-movflags', 'frag_keyframe+empty_moov+default_base_moof', '-f', 'mp4', 'pipe:1']
+		self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+		# The reader runs in the caller's context so hashing/part uploads land in its timings
+		self._reader = threading.Thread(target=contextvars.copy_context().run, args=(self._pump,), daemon=True)
+		self._reader.start()
+
+	def write(self, frame: np.ndarray) -> None:
+		if frame.shape != (self.height, self.width, 3):
+			raise ValueError(f"frame shape {frame.shape} does not match {(self.height, self.width, 3)}")
+		try:
+			self._proc.stdin.write(np.ascontiguousarray(frame, dtype=np.uint8).data)
+		except (BrokenPipeError, OSError):
+			self._raise()
+		self.frames += 1
+
+	def close(self) -> None:
+		try:
+			self._proc.stdin.close()
+		except (BrokenPipeError, OSError):
+			pass
+		self._reader.join()
+		code = self._proc.wait()
+		if self._error is not None or code != 0:
+			self._raise()
+
+	def kill(self) -> None:
+		try:
+			self._proc.kill()
+		except Exception:
+			pass
+		self._reader.join(timeout=5)
+
+	def _pump(self) -> None:
+		try:
+			while True:
+				chunk = self._proc.stdout.read1(READ_CHUNK)
+				if not chunk:
+					break
+				self._write(chunk)
+		except BaseException as e:
+			# Stop ffmpeg so the producer's next write fails instead of blocking on a full pipe
+			self._error = e
+			self._proc.kill()
+
+	def _raise(self) -> None:
+		if self._error is not None:
+			raise self._error
+		err = b''
+		try:
+			err = self._proc.stderr.read() or b''
+		except Exception:
+			pass
+		raise RuntimeError(f"ffmpeg failed: {err.decode('utf-8', 'replace').strip()[:500]}")
+
+
+def _produced(frames: Iterable[np.ndarray]) -> Iterable[np.ndarray]:
+	# Time spent producing each frame is the request's inference time
+	it = iter(frames)
+	while True:
+		with stage('inference'):
+			frame = next(it, None)
+		if frame is None:
+			return
+		yield frame
+
+
+def stream_frames(frames: Iterable[np.ndarray], width: int, height: int, fps: int, sink: Any, on_frame: Callable[[int, np.ndarray], None] | None = None) -> dict:
+	# Pulls frames one at a time from the producer, so at most one frame is resident here.
+	# Encoding, hashing and part uploads overlap, so their timings can sum past the total.
+	enc = FrameEncoder(width, height, fps, sink.write)
+	try:
+		for i, frame in enumerate(_produced(frames)):
+			if on_frame is not None:
+				on_frame(i, frame)
+			with stage('encode'):
+				enc.write(frame)
+		with stage('encode'):
+			enc.close()
+	except BaseException:
+		enc.kill()
+		sink.abort()
+		raise
+	return {**sink.close(), "frames": enc.frames}
@@ -0,0 +1,189 @@
+import asyncio
+import importlib.util
+import os
+import random
+import sys
+import time
+from contextlib import contextmanager
+from io import BytesIO
+from typing import Any, Callable
+
+import boto3
+import httpx
+
+import stubs
+
+SERVICES_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVICES = ('infer-image', 'infer-video', 'edit', 'explain')
+
+# What the stub models cost; every field is a CLI flag on run.py
+DEFAULT_STUB = {
+	'step_ms': 20.0,
+	'memory_mb': 64.0,
+	'frame_ms': 15.0,
+	'upscale_ms_per_mpx': 40.0,
+	'restore_ms': 30.0,
+	'rembg_ms': 30.0,
+	'safety_ms': 5.0,
+}
+
+# Environment the services are imported with: no warmup, attention capture or Redis, so a
+# run only measures request handling against the stubs
+BASE_ENV = {
+	'WARMUP_MODELS': '',
+	'ATTENTION_CAPTURE': 'false',
+	'REDIS_URL': '',
+	'PROGRESS_REDIS_URL': '',
+	'CANCEL_REDIS_URL': '',
+	'PROFILE_TOKEN': '',
+}
+
+
+@contextmanager
+def s3_backend(kind: str, latency_ms: float = 0.0):
+	# Yields (client, endpoint). 'memory': in-process MemoryS3; 'moto': moto's S3 mock (needs
+	# moto installed); anything else is the URL of a running MinIO/S3 with its buckets created
+	# (make buckets), using S3_ACCESS_KEY/S3_SECRET_KEY
+	if kind == 'memory':
+		yield stubs.MemoryS3(latency_ms), 'http://bench-s3.local'
+	elif kind == 'moto':
+		from moto import mock_aws  # type: ignore
+		with mock_aws():
+			client = boto3.client('s3', region_name='us-east-1')
+			for bucket in ('epiphany-outputs', 'epiphany-explain'):
+				client.create_bucket(Bucket=bucket)
+			yield client, 'https://s3.amazonaws.com'
+	else:
+		yield boto3.client('s3', endpoint_url=kind, aws_access_key_id=os.getenv('S3_ACCESS_KEY', 'minioadmin'), aws_secret_access_key=os.getenv('S3_SECRET_KEY', 'minioadmin'), region_name=os.getenv('S3_REGION', 'us-east-1')), kind
+
+
+def load_service(name: str, client: Any, endpoint: str, env: dict | None = None) -> Any:
+	# Imports services/<name>/main.py under its own module name (every service's entry point
+	# is called main) with boto3.client returning the shared S3 client
+	path = os.path.join(SERVICES_DIR, name)
+	for p in (SERVICES_DIR, path):
+		if p not in sys.path:
+			sys.path.insert(0, p)
+	os.environ.update({**BASE_ENV, 'S3_ENDPOINT': endpoint, **(env or {})})
+	spec = importlib.util.spec_from_file_location(f"{name.replace('-', '_')}_main", os.path.join(path, 'main.py'))
+	module = importlib.util.module_from_spec(spec)
+	original = boto3.client
+	boto3.client = lambda *args, **kwargs: client
+	try:
+		spec.loader.exec_module(module)
+	finally:
+		boto3.client = original
+	return module
+
+
+def install_stubs(name: str, m: Any, stub: dict) -> None:
+	# Swaps the model entry points of a loaded service for the deterministic stubs
+	scorer = getattr(m, 'safety_scorer', None)
+	if scorer is not None:
+		scorer.load = lambda: True
+		scorer._score = stubs.stub_scores(stub['safety_ms'])
+	if name == 'infer-image':
+		pipe = stubs.StubDiffusionPipeline(stub['step_ms'], stub['memory_mb'])
+		m._diffusers_available = True
+		m.resolve_device = lambda: 'cpu'
+		# Seeds pass straight through to the stub, which derives its image from them
+		m.make_generator = lambda seed: seed
+		m.load_pipe = lambda task='txt2img', controlnet=None: pipe
+	elif name == 'infer-video':
+		frames = m.svd_frames
+		m.load_svd = lambda: object()
+		m.svd_frames = lambda w, h, total: stubs.paced(frames(w, h, total), stub['frame_ms'])
+	elif name == 'edit':
+		m._realesrgan_available = m._gfpgan_available = m._rembg_available = True
+		m.models = type(m.models)({
+			'realesrgan-x2': lambda: stubs.StubUpscaler(2, stub['upscale_ms_per_mpx']),
+			'realesrgan-x4': lambda: stubs.StubUpscaler(4, stub['upscale_ms_per_mpx']),
+			'gfpgan': lambda: stubs.StubRestorer(stub['restore_ms']),
+			'rembg': lambda: object(),
+		})
+		m.rembg_remove = stubs.stub_rembg(stub['rembg_ms'])
+
+
+def seed_inputs(client: Any, endpoint: str, explain_ids: int) -> dict:
+	# Source image for img2img/controlnet/animate/edit and captured attention maps for explain
+	im = stubs.stub_image('source', 0, 512, 512)
+	buf = BytesIO()
+	im.save(buf, format='PNG')
+	client.put_object(Bucket='epiphany-outputs', Key='bench/source.png', Body=buf.getvalue(), ContentType='image/png')
+	for i in range(explain_ids):
+		client.put_object(Bucket='epiphany-outputs', Key=f"attention/bench-{i}.npz", Body=stubs.attention_npz(i), ContentType='application/octet-stream')
+	return {"source_url": f"{endpoint}/epiphany-outputs/bench/source.png", "explain_ids": explain_ids}
+
+
+# name -> (service, method, path(i, ctx), body(i, ctx, rng)); ctx carries seeded inputs and
+# run settings
+WORKLOADS: dict[str, tuple[str, str, Callable, Callable]] = {
+	'txt2img': ('infer-image', 'POST', lambda i, c: '/infer/txt2img', lambda i, c, r: {"prompt": f"bench prompt {i % 40}", "seed": i, "steps": c['steps'], "aspect": r.choice(['1:1', '1:1', '16:9', '2:3'])}),
+	'img2img': ('infer-image', 'POST', lambda i, c: '/infer/img2img', lambda i, c, r: {"prompt": f"bench restyle {i % 20}", "seed": i, "steps": c['steps'], "initImageUrl": c['source_url'], "strength": 0.6}),
+	'controlnet': ('infer-image', 'POST', lambda i, c: '/infer/controlnet', lambda i, c, r: {"prompt": f"bench control {i % 20}", "seed": i, "steps": c['steps'], "controlnet": {"type": 'canny', "imageUrl": c['source_url']}}),
+	't2v': ('infer-video', 'POST', lambda i, c: '/infer/t2v', lambda i, c, r: {"prompt": f"bench clip {i}", "fps": 8, "durationSec": 1, "resolution": '576p'}),
+	'animate': ('infer-video', 'POST', lambda i, c: '/infer/animate', lambda i, c, r: {"sourceImageUrl": c['source_url'], "fps": 8, "durationSec": 1, "motion": r.choice(['zoom-in', 'zoom-out', 'pan', 'ken-burns'])}),
+	'upscale': ('edit', 'POST', lambda i, c: '/upscale', lambda i, c, r: {"imageUrl": c['source_url'], "scale": 2}),
+	'remove-bg': ('edit', 'POST', lambda i, c: '/remove-bg', lambda i, c, r: {"imageUrl": c['source_url']}),
+	'edit-pipeline': ('edit', 'POST', lambda i, c: '/pipeline', lambda i, c, r: {"imageUrl": c['source_url'], "steps": [{"op": 'resize', "width": 256, "height": 256}, {"op": 'upscale', "scale": 2}, {"op": 'remove-bg'}]}),
+	'attention': ('explain', 'GET', lambda i, c: f"/attention/bench-{i % c['explain_ids']}?size=256", lambda i, c, r: None),
+	'explain-batch': ('explain', 'POST', lambda i, c: '/explain/batch', lambda i, c, r: {"items": [{"id": f"bench-{(i * 7 + k) % c['explain_ids']}"} for k in range(8)], "size": 128}),
+}
+
+# Relative request rates of the default mix
+DEFAULT_MIX = {'txt2img': 30, 'img2img': 10, 'controlnet': 8, 't2v': 4, 'animate': 4, 'upscale': 10, 'remove-bg': 8, 'edit-pipeline': 6, 'attention': 15, 'explain-batch': 5}
+
+
+def parse_mix(spec: str | None) -> dict[str, float]:
+	# "txt2img=30,upscale=10" (names from WORKLOADS); empty keeps the default mix
+	if not spec:
+		return dict(DEFAULT_MIX)
+	mix = {}
+	for part in spec.split(','):
+		name, _, weight = part.strip().partition('=')
+		if name not in WORKLOADS:
+			raise ValueError(f"unknown workload {name!r}; expected one of {sorted(WORKLOADS)}")
+		mix[name] = float(weight or 1)
+	return {k: v for k, v in mix.items() if v > 0}
+
+
+def rss_mb() -> float | None:
+	try:
+		with open('/proc/self/statm') as f:
+			return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+	except Exception:
+		return None
+
+
+async def drive(clients: dict[str, httpx.AsyncClient], mix: dict[str, float], ctx: dict, concurrency: int, requests: int | None, duration: float | None, seed: int = 0) -> tuple[list[dict], float]:
+	# Closed loop: `concurrency` workers each send the next request as soon as their last one
+	# returns, picking workloads by weight, until `requests` have been sent or `duration`
+	# seconds have passed. Returns one record per request and the wall time.
+	rng = random.Random(seed)
+	names, weights = list(mix), list(mix.values())
+	records: list[dict] = []
+	counter = iter(range(requests if requests is not None else sys.maxsize))
+	deadline = time.perf_counter() + duration if duration else None
+
+	async def worker():
+		while deadline is None or time.perf_counter() < deadline:
+			i = next(counter, None)
+			if i is None:
+				return
+			name = rng.choices(names, weights)[0]
+			service, method, path, body = WORKLOADS[name]
+			t0 = time.perf_counter()
+			try:
+				res = await clients[service].request(method, path(i, ctx), json=body(i, ctx, rng))
+				status, data = res.status_code, (res.json() if res.headers.get('content-type', '').startswith('application/json') else None)
+			except Exception as e:
+				status, data = 0, {"error": f"{type(e).__name__}: {e}"}
+			records.append({"workload": name, "status": status, "ms": (time.perf_counter() - t0) * 1000.0, "timings": (data or {}).get('timings') if isinstance(data, dict) else None})
+
+	t0 = time.perf_counter()
+	await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+	return records, time.perf_counter() - t0
+
+
+def clients_for(apps: dict[str, Any], timeout: float = 600.0) -> dict[str, httpx.AsyncClient]:
+	return {name: httpx.AsyncClient(transport=httpx.ASGITransport(app=m.app), base_url=f"http://{name}", timeout=timeout) for name, m in apps.items()}
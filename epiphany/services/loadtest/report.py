@@ -0,0 +1,132 @@
+import resource
+from typing import Any
+
+# Metrics compared against a baseline: (path, True when larger is worse)
+COMPARED = (
+	(('throughput_rps',), False),
+	(('latency_ms', 'p50'), True),
+	(('latency_ms', 'p95'), True),
+	(('latency_ms', 'p99'), True),
+	(('peak_rss_mb',), True),
+)
+WORKLOAD_COMPARED = (
+	(('throughput_rps',), False),
+	(('latency_ms', 'p95'), True),
+)
+
+
+def percentile(values: list[float], pct: float) -> float:
+	if not values:
+		return 0.0
+	s = sorted(values)
+	return s[min(len(s) - 1, max(0, int(round(pct / 100.0 * (len(s) - 1)))))]
+
+
+def latency(values: list[float]) -> dict:
+	return {
+		"p50": round(percentile(values, 50), 1),
+		"p95": round(percentile(values, 95), 1),
+		"p99": round(percentile(values, 99), 1),
+		"mean": round(sum(values) / len(values), 1) if values else 0.0,
+		"max": round(max(values), 1) if values else 0.0,
+	}
+
+
+def stage_means(records: list[dict]) -> dict:
+	# Mean ms per stage over the requests that reported the stage (see common/metrics.py)
+	sums: dict[str, list[float]] = {}
+	for r in records:
+		for stage, ms in (r.get('timings') or {}).items():
+			if stage == 'steps' and isinstance(ms, dict):
+				sums.setdefault('step', []).append(ms.get('mean', 0.0))
+			elif isinstance(ms, (int, float)):
+				sums.setdefault(stage, []).append(float(ms))
+	return {k: round(sum(v) / len(v), 2) for k, v in sorted(sums.items())}
+
+
+def summarize(records: list[dict], wall_s: float, config: dict, rss_start_mb: float | None = None, extra: dict | None = None) -> dict:
+	ok = [r for r in records if 200 <= r['status'] < 300]
+	workloads = {}
+	for name in sorted({r['workload'] for r in records}):
+		mine = [r for r in records if r['workload'] == name]
+		good = [r for r in mine if 200 <= r['status'] < 300]
+		workloads[name] = {
+			"requests": len(mine),
+			"errors": sum(1 for r in mine if not 200 <= r['status'] < 300 and r['status'] != 429),
+			"rejected": sum(1 for r in mine if r['status'] == 429),
+			"throughput_rps": round(len(good) / wall_s, 3) if wall_s else 0.0,
+			"latency_ms": latency([r['ms'] for r in good]),
+			"stages_ms": stage_means(good),
+		}
+	# ru_maxrss is KiB on Linux and covers the whole process, imports included
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+	return {
+		"config": config,
+		"wall_s": round(wall_s, 3),
+		"requests": len(records),
+		"errors": sum(w['errors'] for w in workloads.values()),
+		"rejected": sum(w['rejected'] for w in workloads.values()),
+		"throughput_rps": round(len(ok) / wall_s, 3) if wall_s else 0.0,
+		"latency_ms": latency([r['ms'] for r in ok]),
+		"peak_rss_mb": round(peak, 1),
+		"rss_start_mb": None if rss_start_mb is None else round(rss_start_mb, 1),
+		"workloads": workloads,
+		**(extra or {}),
+	}
+
+
+def _get(d: dict, path: tuple) -> Any:
+	for k in path:
+		d = d.get(k) if isinstance(d, dict) else None
+	return d
+
+
+def _check(name: str, now: float | None, base: float | None, worse_up: bool, tolerance: float) -> dict | None:
+	if now is None or not base:
+		return None
+	ratio = now / base
+	row = {"metric": name, "baseline": base, "current": now, "ratio": round(ratio, 3)}
+	if (ratio > 1 + tolerance) if worse_up else (ratio < 1 - tolerance):
+		row["verdict"] = 'regression'
+	elif (ratio < 1 - tolerance) if worse_up else (ratio > 1 + tolerance):
+		row["verdict"] = 'improvement'
+	else:
+		row["verdict"] = 'same'
+	return row
+
+
+def config_diff(config: dict, baseline: dict, prefix: str = '') -> list[str]:
+	# Dotted names of the settings that differ between two run configs
+	out = []
+	for k in sorted(set(config) | set(baseline)):
+		a, b = config.get(k), baseline.get(k)
+		if isinstance(a, dict) and isinstance(b, dict):
+			out += config_diff(a, b, f"{prefix}{k}.")
+		elif a != b:
+			out.append(f"{prefix}{k}")
+	return out
+
+
+def compare(report: dict, baseline: dict, tolerance: float = 0.15) -> dict:
+	# Ratios of current to baseline for the COMPARED metrics, overall and per workload present in
+	# both; anything more than `tolerance` worse is a regression. Runs with a different config
+	# are not comparable: the result lists the differing settings instead
+	mismatch = config_diff(report.get('config') or {}, baseline.get('config') or {})
+	if mismatch:
+		return {"tolerance": tolerance, "skipped": 'config differs from the baseline', "config_mismatch": mismatch, "regressions": [], "improvements": [], "metrics": []}
+	rows = []
+	for path, worse_up in COMPARED:
+		rows.append(_check('.'.join(path), _get(report, path), _get(baseline, path), worse_up, tolerance))
+	for name, current in sorted(report.get('workloads', {}).items()):
+		base = baseline.get('workloads', {}).get(name)
+		if base is None:
+			continue
+		for path, worse_up in WORKLOAD_COMPARED:
+			rows.append(_check(f"{name}.{'.'.join(path)}", _get(current, path), _get(base, path), worse_up, tolerance))
+	rows = [r for r in rows if r is not None]
+	return {
+		"tolerance": tolerance,
+		"regressions": [r for r in rows if r['verdict'] == 'regression'],
+		"improvements": [r for r in rows if r['verdict'] == 'improvement'],
+		"metrics": rows,
+	}
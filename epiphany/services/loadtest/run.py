@@ -0,0 +1,82 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+import harness
+from report import compare, summarize
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+async def run(args) -> dict:
+	mix = harness.parse_mix(args.mix)
+	needed = sorted({harness.WORKLOADS[name][0] for name in mix})
+	stub = {k: getattr(args, k) for k in harness.DEFAULT_STUB}
+	with harness.s3_backend(args.s3, args.s3_latency_ms) as (client, endpoint):
+		apps = {}
+		for name in needed:
+			apps[name] = harness.load_service(name, client, endpoint)
+			harness.install_stubs(name, apps[name], stub)
+		ctx = {**harness.seed_inputs(client, endpoint, args.explain_ids), "steps": args.steps}
+		clients = harness.clients_for(apps)
+		try:
+			# A few requests per workload first: lazy loads and first-call costs stay out of the numbers
+			for name in mix if args.warmup else ():
+				await harness.drive(clients, {name: 1}, ctx, 1, args.warmup, None, seed=args.seed + 1)
+			rss_start = harness.rss_mb()
+			records, wall = await harness.drive(clients, mix, ctx, args.concurrency, args.requests, args.duration, seed=args.seed)
+		finally:
+			for c in clients.values():
+				await c.aclose()
+		config = {"concurrency": args.concurrency, "requests": args.requests, "duration": args.duration, "mix": mix, "steps": args.steps, "s3": args.s3 if args.s3 in ('memory', 'moto') else 'endpoint', "s3_latency_ms": args.s3_latency_ms, "stub": stub, "seed": args.seed}
+		extra = {"s3_stats": client.stats()} if hasattr(client, 'stats') else {}
+		return summarize(records, wall, config, rss_start, extra)
+
+
+def main():
+	ap = argparse.ArgumentParser(description="CPU-only load test of the Python services in-process, with stub models and a local S3")
+	ap.add_argument('--concurrency', type=int, default=8, help="requests in flight (closed loop)")
+	ap.add_argument('--requests', type=int, default=120, help="requests to send (0: use --duration)")
+	ap.add_argument('--duration', type=float, default=None, help="seconds to run instead of a request count")
+	ap.add_argument('--mix', default='', help=f"weights, e.g. txt2img=3,upscale=1; default {','.join(f'{k}={v}' for k, v in harness.DEFAULT_MIX.items())}")
+	ap.add_argument('--steps', type=int, default=8, help="denoising steps per image request")
+	ap.add_argument('--warmup', type=int, default=1, help="unmeasured requests per workload before the run")
+	ap.add_argument('--explain-ids', type=int, default=32, help="distinct generations with captured attention maps")
+	ap.add_argument('--s3', default='memory', help="memory, moto, or the URL of a MinIO/S3 endpoint with the buckets created")
+	ap.add_argument('--s3-latency-ms', type=float, default=2.0, help="added to every in-memory S3 call")
+	ap.add_argument('--seed', type=int, default=0)
+	for k, v in harness.DEFAULT_STUB.items():
+		ap.add_argument(f"--{k.replace('_', '-')}", dest=k, type=float, default=v, help="stub model cost")
+	ap.add_argument('--out', default=None, help="write the JSON report here as well as to stdout")
+	ap.add_argument('--baseline', default=BASELINE, help="report to compare against ('' to skip)")
+	ap.add_argument('--tolerance', type=float, default=0.15, help="relative change counted as a regression")
+	ap.add_argument('--save-baseline', action='store_true', help="write this run to --baseline instead of comparing")
+	args = ap.parse_args()
+	if not args.requests:
+		args.requests = None
+	if args.requests is None and not args.duration:
+		ap.error('--requests 0 needs --duration')
+
+	report = asyncio.run(run(args))
+	status = 0
+	if args.save_baseline:
+		with open(args.baseline, 'w') as f:
+			json.dump(report, f, indent=1)
+	elif args.baseline and os.path.exists(args.baseline):
+		with open(args.baseline) as f:
+			report['comparison'] = compare(report, json.load(f), args.tolerance)
+		status = 1 if report['comparison']['regressions'] else 0
+		if report['comparison'].get('config_mismatch'):
+			print(f"not compared with {args.baseline}: run config differs in {', '.join(report['comparison']['config_mismatch'])} (use the baseline's settings, or --save-baseline)", file=sys.stderr)
+	text = json.dumps(report, indent=1)
+	if args.out:
+		with open(args.out, 'w') as f:
+			f.write(text)
+	print(text)
+	sys.exit(status)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,201 @@
+import hashlib
+import threading
+import time
+import uuid
+import zlib
+from io import BytesIO
+from types import SimpleNamespace
+from typing import Any, Iterable, Iterator
+
+import numpy as np
+from botocore.exceptions import ClientError
+from PIL import Image
+
+
+def _sleep_ms(ms: float) -> None:
+	if ms > 0:
+		time.sleep(ms / 1000.0)
+
+
+def _client_error(status: int, code: str, op: str) -> ClientError:
+	return ClientError({'Error': {'Code': code, 'Message': code}, 'ResponseMetadata': {'HTTPStatusCode': status}}, op)
+
+
+def _body_bytes(body: Any, length: int | None = None) -> bytes:
+	if hasattr(body, 'read'):
+		return body.read(length) if length is not None else body.read()
+	return bytes(body)
+
+
+class MemoryS3:
+	# In-process stand-in for the boto3 S3 client with the calls the services make. Objects
+	# live in a dict; latency_ms is added to every call to model a network round trip.
+	def __init__(self, latency_ms: float = 0.0):
+		self.latency_ms = latency_ms
+		self._lock = threading.Lock()
+		self._objects: dict[tuple[str, str], dict] = {}
+		self._uploads: dict[str, dict] = {}
+		self.calls = 0
+		self.bytes_in = 0
+		self.bytes_out = 0
+
+	def _call(self) -> None:
+		with self._lock:
+			self.calls += 1
+		_sleep_ms(self.latency_ms)
+
+	def _store(self, bucket: str, key: str, data: bytes, content_type: str | None, metadata: dict | None) -> str:
+		etag = '"' + hashlib.md5(data).hexdigest() + '"'
+		with self._lock:
+			self._objects[(bucket, key)] = {"data": data, "content_type": content_type, "metadata": dict(metadata or {}), "etag": etag}
+			self.bytes_in += len(data)
+		return etag
+
+	def create_bucket(self, Bucket: str, **kwargs) -> dict:
+		return {}
+
+	def put_object(self, Bucket: str, Key: str, Body: Any = b'', ContentType: str | None = None, Metadata: dict | None = None, ContentLength: int | None = None, **kwargs) -> dict:
+		self._call()
+		return {"ETag": self._store(Bucket, Key, _body_bytes(Body, ContentLength), ContentType, Metadata)}
+
+	def upload_file(self, Filename: str, Bucket: str, Key: str, ExtraArgs: dict | None = None, **kwargs) -> None:
+		self._call()
+		with open(Filename, 'rb') as f:
+			self._store(Bucket, Key, f.read(), (ExtraArgs or {}).get('ContentType'), (ExtraArgs or {}).get('Metadata'))
+
+	def get_object(self, Bucket: str, Key: str, IfNoneMatch: str | None = None, **kwargs) -> dict:
+		self._call()
+		obj = self._objects.get((Bucket, Key))
+		if obj is None:
+			raise _client_error(404, 'NoSuchKey', 'GetObject')
+		if IfNoneMatch is not None and IfNoneMatch == obj['etag']:
+			raise _client_error(304, '304', 'GetObject')
+		with self._lock:
+			self.bytes_out += len(obj['data'])
+		return {"Body": BytesIO(obj['data']), "ETag": obj['etag'], "ContentType": obj['content_type'], "ContentLength": len(obj['data']), "Metadata": obj['metadata']}
+
+	def head_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+		self._call()
+		obj = self._objects.get((Bucket, Key))
+		if obj is None:
+			raise _client_error(404, '404', 'HeadObject')
+		return {"ETag": obj['etag'], "ContentType": obj['content_type'], "ContentLength": len(obj['data']), "Metadata": obj['metadata']}
+
+	def create_multipart_upload(self, Bucket: str, Key: str, ContentType: str | None = None, **kwargs) -> dict:
+		self._call()
+		upload_id = uuid.uuid4().hex
+		with self._lock:
+			self._uploads[upload_id] = {"content_type": ContentType, "parts": {}}
+		return {"UploadId": upload_id}
+
+	def upload_part(self, Bucket: str, Key: str, UploadId: str, PartNumber: int, Body: Any, ContentLength: int | None = None, **kwargs) -> dict:
+		self._call()
+		data = _body_bytes(Body, ContentLength)
+		with self._lock:
+			self._uploads[UploadId]["parts"][PartNumber] = data
+		return {"ETag": '"' + hashlib.md5(data).hexdigest() + '"'}
+
+	def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str, MultipartUpload: dict, **kwargs) -> dict:
+		self._call()
+		with self._lock:
+			upload = self._uploads.pop(UploadId)
+		data = b''.join(upload["parts"][p['PartNumber']] for p in MultipartUpload['Parts'])
+		return {"ETag": self._store(Bucket, Key, data, upload["content_type"], None)}
+
+	def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str, **kwargs) -> dict:
+		with self._lock:
+			self._uploads.pop(UploadId, None)
+		return {}
+
+	def stats(self) -> dict:
+		return {"objects": len(self._objects), "calls": self.calls, "bytes_in": self.bytes_in, "bytes_out": self.bytes_out}
+
+
+def stub_image(prompt: str, seed: Any, width: int, height: int) -> Image.Image:
+	# Deterministic per (prompt, seed): smooth noise upsampled from latent resolution, so
+	# encoders see photo-like texture rather than a flat fill
+	rng = np.random.default_rng(zlib.crc32(f"{prompt}|{seed}".encode()))
+	latent = rng.integers(0, 256, (max(1, height // 8), max(1, width // 8), 3), dtype=np.uint8)
+	return Image.fromarray(latent).resize((width, height), resample=Image.Resampling.BICUBIC)
+
+
+class StubDiffusionPipeline:
+	# Stands in for the diffusers SDXL pipelines: sleeps step_ms per denoising step per image,
+	# holds memory_mb of host memory for the duration of the call, drives
+	# callback_on_step_end like diffusers does, and returns deterministic images
+	def __init__(self, step_ms: float = 20.0, memory_mb: float = 0.0, batch_efficiency: float = 0.6):
+		self.step_ms = step_ms
+		self.memory_mb = memory_mb
+		# Cost of each extra image in a batched call, relative to the first
+		self.batch_efficiency = batch_efficiency
+		self.calls = 0
+
+	def __call__(self, prompt: Any = '', image: Any = None, num_inference_steps: int = 20, width: int | None = None, height: int | None = None, generator: Any = None, callback_on_step_end: Any = None, **kwargs) -> SimpleNamespace:
+		prompts = prompt if isinstance(prompt, list) else [prompt]
+		seeds = generator if isinstance(generator, list) else [generator] * len(prompts)
+		if width is None or height is None:
+			width, height = image.size if image is not None else (768, 768)
+		self.calls += 1
+		held = np.ones(int(self.memory_mb * len(prompts) * 1024 * 1024), dtype=np.uint8) if self.memory_mb > 0 else None
+		per_step = self.step_ms * (1 + self.batch_efficiency * (len(prompts) - 1))
+		for step in range(max(1, int(num_inference_steps))):
+			_sleep_ms(per_step)
+			if callback_on_step_end is not None:
+				callback_on_step_end(self, step, 1000 - step, {"latents": None})
+		del held
+		return SimpleNamespace(images=[stub_image(p, s, width, height) for p, s in zip(prompts, seeds)])
+
+
+def paced(frames: Iterable[np.ndarray], frame_ms: float) -> Iterator[np.ndarray]:
+	# A video model producing frames at frame_ms each
+	for frame in frames:
+		_sleep_ms(frame_ms)
+		yield frame
+
+
+class StubUpscaler:
+	# RealESRGAN.predict stand-in: LANCZOS resize plus ms_per_mpx of model time per input megapixel
+	def __init__(self, scale: int, ms_per_mpx: float = 40.0):
+		self.scale = scale
+		self.ms_per_mpx = ms_per_mpx
+
+	def predict(self, im: Any) -> Image.Image:
+		im = im if isinstance(im, Image.Image) else Image.fromarray(np.asarray(im))
+		_sleep_ms(self.ms_per_mpx * im.width * im.height / 1e6)
+		return im.resize((im.width * self.scale, im.height * self.scale), resample=Image.Resampling.LANCZOS)
+
+
+class StubRestorer:
+	# GFPGANer.enhance stand-in: returns the input after ms of model time
+	def __init__(self, ms: float = 30.0):
+		self.ms = ms
+
+	def enhance(self, bgr: np.ndarray, has_aligned: bool = False, only_center_face: bool = False, paste_back: bool = True):
+		_sleep_ms(self.ms)
+		return [], [], bgr
+
+
+def stub_rembg(ms: float = 30.0):
+	# rembg.remove stand-in: alpha from luminance after ms of model time
+	def remove(im: Image.Image, session: Any = None) -> Image.Image:
+		_sleep_ms(ms)
+		out = im.convert('RGBA')
+		out.putalpha(im.convert('L'))
+		return out
+	return remove
+
+
+def stub_scores(ms_per_image: float = 5.0):
+	# SafetyScorer._score stand-in
+	def score(images: list) -> list[float]:
+		_sleep_ms(ms_per_image * len(images))
+		return [0.0] * len(images)
+	return score
+
+
+def attention_npz(seed: int, tokens: int = 8, grid: int = 32) -> bytes:
+	# attention/{id}.npz in the format infer-image writes and explain reads
+	rng = np.random.default_rng(seed)
+	buf = BytesIO()
+	np.savez_compressed(buf, maps=rng.random((tokens, grid, grid)).astype(np.float16), tokens=np.array([f"tok{i}" for i in range(tokens)]))
+	return buf.getvalue()
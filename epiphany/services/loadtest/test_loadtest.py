@@ -0,0 +1,68 @@
+import asyncio
+
+import harness
+import stubs
+from report import compare, percentile, summarize
+
+
+def test_memory_s3_round_trips_and_revalidates():
+	s3 = stubs.MemoryS3()
+	etag = s3.put_object(Bucket='b', Key='k', Body=b'data')['ETag']
+	assert s3.get_object(Bucket='b', Key='k')['Body'].read() == b'data'
+	try:
+		s3.get_object(Bucket='b', Key='k', IfNoneMatch=etag)
+		raise AssertionError('expected 304')
+	except Exception as e:
+		assert e.response['ResponseMetadata']['HTTPStatusCode'] == 304
+	upload = s3.create_multipart_upload(Bucket='b', Key='v')['UploadId']
+	parts = [{'ETag': s3.upload_part(Bucket='b', Key='v', UploadId=upload, PartNumber=n, Body=chunk)['ETag'], 'PartNumber': n} for n, chunk in ((1, b'ab'), (2, b'cd'))]
+	s3.complete_multipart_upload(Bucket='b', Key='v', UploadId=upload, MultipartUpload={'Parts': parts})
+	assert s3.get_object(Bucket='b', Key='v')['Body'].read() == b'abcd'
+
+
+def test_stub_pipeline_is_deterministic_and_drives_callbacks():
+	steps = []
+	pipe = stubs.StubDiffusionPipeline(step_ms=0)
+	a = pipe(prompt=['x', 'y'], generator=[1, 2], num_inference_steps=3, width=64, height=32, callback_on_step_end=lambda p, i, t, kw: steps.append(i) or kw).images
+	b = pipe(prompt='x', generator=1, num_inference_steps=1, width=64, height=32).images
+	assert steps == [0, 1, 2] and a[0].size == (64, 32) and a[0].tobytes() == b[0].tobytes() != a[1].tobytes()
+
+
+def test_compare_flags_regressions_beyond_tolerance():
+	base = {"throughput_rps": 10.0, "latency_ms": {"p50": 100, "p95": 200, "p99": 300}, "peak_rss_mb": 500, "workloads": {"txt2img": {"throughput_rps": 5.0, "latency_ms": {"p95": 200}}}}
+	now = {"throughput_rps": 7.0, "latency_ms": {"p50": 105, "p95": 150, "p99": 300}, "peak_rss_mb": 500, "workloads": {"txt2img": {"throughput_rps": 5.0, "latency_ms": {"p95": 260}}, "new": {}}}
+	out = compare(now, base, tolerance=0.1)
+	assert [r['metric'] for r in out['regressions']] == ['throughput_rps', 'txt2img.latency_ms.p95']
+	assert [r['metric'] for r in out['improvements']] == ['latency_ms.p95']
+	assert percentile([3, 1, 2], 50) == 2 and percentile([], 99) == 0.0
+
+
+def test_compare_skips_runs_with_a_different_config():
+	base = {"config": {"concurrency": 8, "requests": 120, "stub": {"step_ms": 20.0}}, "throughput_rps": 10.0}
+	now = {"config": {"concurrency": 4, "requests": 120, "stub": {"step_ms": 5.0}}, "throughput_rps": 2.0}
+	out = compare(now, base)
+	assert out['config_mismatch'] == ['concurrency', 'stub.step_ms'] and out['regressions'] == []
+	assert compare({**now, "config": base['config']}, base)['regressions'][0]['metric'] == 'throughput_rps'
+
+
+def test_mixed_run_reports_latency_and_stages():
+	async def go():
+		with harness.s3_backend('memory') as (client, endpoint):
+			stub = {**harness.DEFAULT_STUB, 'step_ms': 1.0, 'memory_mb': 1.0, 'frame_ms': 0.0}
+			apps = {}
+			for name in ('infer-image', 'edit', 'explain'):
+				apps[name] = harness.load_service(name, client, endpoint)
+				harness.install_stubs(name, apps[name], stub)
+			ctx = {**harness.seed_inputs(client, endpoint, 4), "steps": 2}
+			clients = harness.clients_for(apps)
+			try:
+				records, wall = await harness.drive(clients, {'txt2img': 1, 'img2img': 1, 'upscale': 1, 'attention': 1}, ctx, 2, 12, None)
+			finally:
+				for c in clients.values():
+					await c.aclose()
+			return summarize(records, wall, {})
+	report = asyncio.run(go())
+	assert report['requests'] == 12 and report['errors'] == 0 and report['throughput_rps'] > 0
+	assert report['latency_ms']['p99'] >= report['latency_ms']['p50'] > 0 and report['peak_rss_mb'] > 0
+	stages = {stage for w in report['workloads'].values() for stage in w['stages_ms']}
+	assert {'inference', 'encode', 'upload', 'step'} <= stages